@@ -3,118 +3,119 @@ import sys
 
 
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session
+from flask import Flask, render_template, request, redirect, url_for, session, g, make_response
 from src.exception import CustomException
 from src.logger import logging
 from notebooks.utils.SQL_Connection import getConnection, getUser
-from src.pipeline.predict_pipeline import CustomData, PredictPipeline
+from src.pipeline.predict_pipeline import CustomData, CustomBatchData, PredictPipeline
 from src.utils import *
+from src.image_cache import resolve_image_urls
+from src.repository import AnimeRepository
+from src.connection_pool import get_client_pool
+from src.interaction_buffer import add_interaction_listener, get_interaction_buffer
+from src.user_cache import get_user_id_cache
+from src.feed_builder import get_feed_builder
+from src.delta_index import get_delta_index
+from src.pipeline.recommendation_cache import get_recommendation_cache
+from src.pipeline.request_coalescer import get_request_coalescer
 
 app = Flask(__name__)
 # Fixed secret key - DO NOT CHANGE THIS or sessions will be invalidated
 app.secret_key = 'anime-recommendation-secret-key-keep-this-private-2024'
+# Feeds are refreshed from the views the interaction buffer writes; the buffer
+# itself is created in each worker on first use, not when the app is imported
+add_interaction_listener(get_feed_builder().apply_events)
+# Anime missing from the catalog become recommendable through the delta index
+add_interaction_listener(get_delta_index().add_events)
+# Upper bound on the number of queries accepted by /api/recommend/batch in one call
+MAX_BATCH_QUERIES = 1000
+# Cover images are looked up remotely on a miss, with_images is only accepted for small batches
+MAX_BATCH_IMAGE_QUERIES = 20
+
+def getClient():
+    # One pooled Supabase client per request, kept on the app context
+    if 'supabase_client' not in g:
+        g.supabase_client = get_client_pool().acquire()
+    return g.supabase_client
+
+@app.teardown_appcontext
+def releaseClient(exception):
+    client = g.pop('supabase_client', None)
+    if client is not None:
+        get_client_pool().release(client, healthy=exception is None)
+
+def rememberUser(email, user_id):
+    # Resolved once at login/signup, then carried in the signed session cookie
+    session['email'] = email
+    session['user_id'] = user_id
+    get_user_id_cache().put(email, user_id)
+
+def resolveUserId(repository=None):
+    '''
+        user_id of the logged in user: from the session, then the server-side
+        cache, and from the users table only when repository is given.
+        Every lookup answered without the database is counted on g.
+    '''
+    email = session.get("email")
+    if email is None:
+        return None
+    user_id = session.get("user_id")
+    if user_id is None:
+        user_id = get_user_id_cache().get(email)
+        if user_id is not None:
+            session['user_id'] = user_id
+    if user_id is not None:
+        g.user_lookups_avoided = g.get('user_lookups_avoided', 0) + 1
+        return user_id
+    if repository is None:
+        return None
+    user_id = repository.get_user_id(email)
+    if user_id is not None:
+        rememberUser(email, user_id)
+    return user_id
+
+@app.after_request
+def reportUserLookups(response):
+    response.headers['X-User-Lookups-Avoided'] = str(g.get('user_lookups_avoided', 0))
+    return response
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return {
+        "supabase_pool": get_client_pool().metrics(),
+        "interaction_buffer": get_interaction_buffer().metrics(),
+        "user_id_cache": get_user_id_cache().metrics(),
+        "feed_builder": get_feed_builder().metrics(),
+        "recommendation_cache": get_recommendation_cache().metrics(),
+        "delta_index": get_delta_index().metrics(),
+        "request_coalescer": get_request_coalescer().metrics()
+    }
+
+def renderHomeFeed(repository, user_id):
+    # Materialized feed shared by every worker, only a user's first visit queries the database
+    anime_names = get_feed_builder().get_feed(user_id, repository)
+    
+    # Resolve every cover of the page in parallel, placeholder for the misses
+    image_urls = resolve_image_urls(anime_names)
+    animes = [
+        {
+            'anime_name': anime_name,
+            'image_url': image_urls.get(anime_name) or f'https://via.placeholder.com/300x450/1a1033/a78bfa?text={anime_name}'
+        }
+        for anime_name in anime_names
+    ]
+    return render_template('home.html', animes=animes)
 
 @app.route("/", methods=['GET'])
 def home():
     try:
-        client = getConnection()
         if session.get("email") is None:
             return render_template("signup.html")
-        response = (
-            client.table("users")
-            .select("user_id")
-            .eq("email", session.get("email"))
-            .execute()
-        )
-        if len(response.data) == 0:
+        repository = AnimeRepository(getClient())
+        user_id = resolveUserId(repository)
+        if user_id is None:
             return render_template("signup.html")
-        user_id = response.data[0]['user_id']
-        response = (
-                client.table("useranimeinteractions")
-                .select("*", count="exact")
-                .eq("user_id", user_id)
-                .execute()
-            )
-        interaction_count = response.count
-        response = (
-            client.table("useranimeinteractions")
-            .select("*", count="exact")
-            .eq("user_id", user_id)
-            .eq("interaction_type", "view")
-            .execute()
-        )
-        
-        seenCount = response.count
-        if interaction_count == 0 or seenCount == 0:
-            return render_template('home.html', animes=[])
-    
-    
-        response = (
-            client.table("useranimeinteractions")
-            .select("anime_id")
-            .eq("user_id", user_id)
-            .eq("interaction_type", "view")
-            .execute()
-        )
-        
-        # Collect all genres from viewed animes
-        all_genres = set()
-        viewed_anime_ids = []
-        
-        for interaction in response.data:
-            anime_id = interaction['anime_id']
-            viewed_anime_ids.append(anime_id)
-            
-            # Get genre for this anime
-            anime_response = (
-                client.table("animes")
-                .select("anime_genre")
-                .eq("anime_id", anime_id)
-                .execute()
-            )
-            
-            if len(anime_response.data) > 0:
-                anime_genre = anime_response.data[0]['anime_genre']
-                if anime_genre is not None:
-                    # Split and add all genres
-                    genres = [g.strip() for g in anime_genre.split(',')]
-                    all_genres.update(genres)
-        
-        # Now find animes with matching genres (excluding already viewed)
-        animes = []
-        for genre in list(all_genres)[:3]:  # Top 3 genres
-            anime_response = (
-                client.table("animes")
-                .select("anime_name, anime_id")
-                .ilike("anime_genre", f"%{genre}%")
-                .not_.in_("anime_id", viewed_anime_ids)  # ✅ Exclude viewed animes
-                .limit(10)
-                .execute()
-            )
-            
-            for anime_data in anime_response.data:
-                anime_name = anime_data['anime_name']
-                
-                # Avoid duplicates
-                if not any(a['anime_name'] == anime_name for a in animes):
-                    image_url = get_anime_image_url_hybrid(anime_name)
-                    
-                    if not image_url:
-                        image_url = f'https://via.placeholder.com/300x450/1a1033/a78bfa?text={anime_name}'
-                    
-                    animes.append({
-                        'anime_name': anime_name,
-                        'image_url': image_url
-                    })
-                    
-                    # Limit total recommendations
-                    if len(animes) >= 20:
-                        break
-            
-            if len(animes) >= 20:
-                break
-            # Pass interaction_count to template
-        return render_template('home.html', animes=animes)
+        return renderHomeFeed(repository, user_id)
     except Exception as e:
         raise CustomException(e, sys)
 
@@ -144,13 +145,40 @@ def findAnime():
             ]
             
             obj = CustomData(features, values)
-            df = obj.generate_data_frame()
             
-            print("The data frame is: ",df)
+            # Identical submissions share one computation per artifact version,
+            # concurrent misses are searched together in one batch
             predict_obj = PredictPipeline()
-            animes = predict_obj.suggestAnimes(df)
+            animes, hit = predict_obj.suggestAnimesCached(obj, coalescer=get_request_coalescer())
             
-            return render_template('anime.html', animes=animes) 
+            response = make_response(render_template('anime.html', animes=animes))
+            response.headers['X-Recommendation-Cache'] = 'HIT' if hit else 'MISS'
+            return response
+    except Exception as e:
+        raise CustomException(e, sys)
+
+@app.route("/api/recommend/batch", methods=['POST'])
+def recommendBatch():
+    try:
+        payload = request.get_json(silent=True) or {}
+        queries = payload.get("queries")
+        if not isinstance(queries, list) or len(queries) == 0:
+            return {"status": "error", "message": "queries must be a non-empty list"}, 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return {"status": "error", "message": f"At most {MAX_BATCH_QUERIES} queries per request"}, 400
+        with_images = bool(payload.get("with_images", False))
+        if with_images and len(queries) > MAX_BATCH_IMAGE_QUERIES:
+            return {"status": "error", "message": f"with_images accepts at most {MAX_BATCH_IMAGE_QUERIES} queries per request"}, 400
+        
+        batch = CustomBatchData(queries)
+        error = batch.validate()
+        if error is not None:
+            return {"status": "error", "message": error}, 400
+        records = batch.generate_records()
+        predict_obj = PredictPipeline()
+        results = predict_obj.recommendRecords(records, with_images=with_images)
+        
+        return {"status": "success", "results": results}
     except Exception as e:
         raise CustomException(e, sys)
 
@@ -163,114 +191,21 @@ def login():
             email = request.form.get('email')
             password = request.form.get("password")
             
-            client = getConnection()
+            repository = AnimeRepository(getClient())
             
             # Check if user exists
-            result = (
-                client.table("users")
-                .select("user_id, password")
-                .eq("email", email)
-                .execute()
-            )
-            if len(result.data) == 0:
+            user = repository.get_user(email, "user_id, password")
+            if user is None:
                 return render_template('signup.html')
             
-            user_id = result.data[0]['user_id']
-            db_password = result.data[0]['password']
-            
             # User exists - verify password
-           
-            if db_password != password:
+            if user['password'] != password:
                 return render_template('login.html')
             
-            # Store email in session
-            session['email'] = email
+            # Store email and user_id in session
+            rememberUser(email, user['user_id'])
             
-            # Password is correct - check interaction count
-            response = (
-                client.table("useranimeinteractions")
-                .select("*", count="exact")
-                .eq("user_id", user_id)
-                .execute()
-            )
-            interaction_count = response.count
-            response = (
-                client.table("useranimeinteractions")
-                .select("*", count="exact")
-                .eq("user_id", user_id)
-                .eq("interaction_type", "view")
-                .execute()
-            )
-        
-            seenCount = response.count
-            if interaction_count == 0 or seenCount == 0:
-                return render_template('home.html', animes=[])
-            
-            response = (
-                client.table("useranimeinteractions")
-                .select("anime_id")
-                .eq("user_id", user_id)
-                .eq("interaction_type", "view")
-                .execute()
-            )
-            
-            # Collect all genres from viewed animes
-            all_genres = set()
-            viewed_anime_ids = []
-            
-            for interaction in response.data:
-                anime_id = interaction['anime_id']
-                viewed_anime_ids.append(anime_id)
-                
-                # Get genre for this anime
-                anime_response = (
-                    client.table("animes")
-                    .select("anime_genre")
-                    .eq("anime_id", anime_id)
-                    .execute()
-                )
-                
-                if len(anime_response.data) > 0:
-                    anime_genre = anime_response.data[0]['anime_genre']
-                    if anime_genre is not None:
-                        # Split and add all genres
-                        genres = [g.strip() for g in anime_genre.split(',')]
-                        all_genres.update(genres)
-            
-            # Now find animes with matching genres (excluding already viewed)
-            animes = []
-            for genre in list(all_genres)[:3]:  # Top 3 genres
-                anime_response = (
-                    client.table("animes")
-                    .select("anime_name, anime_id")
-                    .ilike("anime_genre", f"%{genre}%")
-                    .not_.in_("anime_id", viewed_anime_ids)  # ✅ Exclude viewed animes
-                    .limit(10)
-                    .execute()
-                )
-                
-                for anime_data in anime_response.data:
-                    anime_name = anime_data['anime_name']
-                    
-                    # Avoid duplicates
-                    if not any(a['anime_name'] == anime_name for a in animes):
-                        image_url = get_anime_image_url_hybrid(anime_name)
-                        
-                        if not image_url:
-                            image_url = f'https://via.placeholder.com/300x450/1a1033/a78bfa?text={anime_name}'
-                        
-                        animes.append({
-                            'anime_name': anime_name,
-                            'image_url': image_url
-                        })
-                        
-                        # Limit total recommendations
-                        if len(animes) >= 20:
-                            break
-                
-                if len(animes) >= 20:
-                    break
-            return render_template('home.html', animes=animes)
+            return renderHomeFeed(repository, user['user_id'])
     except Exception as e:
         raise CustomException(e, sys)
     
@@ -283,20 +218,17 @@ def signup():
             name = request.form.get("name")
             email = request.form.get("email")
             password = request.form.get("password")
-            client = getConnection()
-            result = (
-                client.table("users")
-                .select("user_id")
-                .eq("email", email)
-                .execute()
-            )
-            if len(result.data) == 0:
-                response = (
-                    client.table("users")
-                    .insert({"name": name, "email":email, "password": password})
-                    .execute()
-                )
-                session['email'] = email
+            repository = AnimeRepository(getClient())
+            if repository.get_user_id(email) is None:
+                response = repository.create_user(name, email, password)
+                # A cached id for this email belongs to a row that no longer exists
+                get_user_id_cache().invalidate(email)
+                session.pop('user_id', None)
+                created = response.data[0] if response is not None and len(response.data) > 0 else {}
+                if created.get('user_id') is not None:
+                    rememberUser(email, created['user_id'])
+                else:
+                    session['email'] = email
                 return render_template('index.html')
             return render_template('login.html')
     except Exception as e:
@@ -308,36 +240,17 @@ def view():
         anime_title = request.args.get('anime_title')
         anime_id = request.args.get('anime_id')
         anime_genre = request.args.get("anime_genre")
-        client = getConnection()
         
-        # Check if anime exists in database
-        result = (
-            client.table("animes")
-            .select("anime_id")
-            .eq("anime_name", anime_title)
-            .execute()
-        )
-        if len(result.data) == 0:
-            (
-                client.table("animes")
-                .insert({"anime_id": anime_id, "anime_name": anime_title, "anime_genre": anime_genre})
-                .execute()
-            )
-        
-        # Get user_id from session email
-        result = (
-            client.table("users")
-            .select("user_id")
-            .eq("email", session.get("email"))
-            .execute()
-        )
-        user_id = result.data[0]['user_id']
+        # Written to the database in bulk by the interaction buffer, the click does not wait for it
         interaction = 'view'
-        (
-            client.table("useranimeinteractions")
-            .insert({"user_id": user_id, "anime_id": anime_id, "interaction_type": interaction, "timestamp": datetime.now().isoformat()})
-            .execute()
-        )
+        accepted = get_interaction_buffer().submit({
+            "email": session.get("email"),
+            "user_id": resolveUserId(),
+            "anime": {"anime_id": anime_id, "anime_name": anime_title, "anime_genre": anime_genre},
+            "interaction": {"anime_id": anime_id, "interaction_type": interaction, "timestamp": datetime.now().isoformat()}
+        })
+        if not accepted:
+            return {"status": "error", "message": "Too many pending interactions, retry later"}, 503
         return {"status": "success", "message": "View tracked"}
     except Exception as e:
         raise CustomException(e, sys)
@@ -350,35 +263,16 @@ def rating():
         anime_genre = request.args.get("anime_genre")
         rating_value = request.args.get('rating', type=int)
         
-        client = getConnection()
-        
-        # Check if anime exists
-        response = (
-            client.table("animes")
-            .select("anime_id")
-            .eq("anime_name", anime_title)
-            .execute()
-        )
-        if len(response.data) == 0:
-            (
-                client.table("animes")
-                .insert({"anime_id": anime_id, "anime_name": anime_title, "anime_genre": anime_genre, "anime_rating": rating_value})
-                .execute()
-            )
-        response = (
-            client.table("users")
-            .select("user_id")
-            .eq("email", session.get("email"))
-            .execute()
-        )
-        user_id = response.data[0]['user_id']
         interaction = 'rated'
         time = datetime.now().isoformat()
-        (
-            client.table("useranimeinteractions")
-            .insert({"user_id": user_id, "anime_id": anime_id, "interaction_type": interaction, "timestamp": time})
-            .execute()
-        )
+        accepted = get_interaction_buffer().submit({
+            "email": session.get("email"),
+            "user_id": resolveUserId(),
+            "anime": {"anime_id": anime_id, "anime_name": anime_title, "anime_genre": anime_genre, "anime_rating": rating_value},
+            "interaction": {"anime_id": anime_id, "interaction_type": interaction, "timestamp": time}
+        })
+        if not accepted:
+            return {"status": "error", "message": "Too many pending interactions, retry later"}, 503
         return {"status": "success", "message": "Rating tracked"}
     except Exception as e:
         raise CustomException(e, sys)
@@ -386,51 +280,25 @@ def rating():
 @app.route("/seenAnimes", methods=['GET'])
 def seenAnimes():
     try:
-        client = getConnection()
-        response = (
-            client.table("users")
-            .select("user_id")
-            .eq("email", session.get("email"))
-            .execute()
-        )
-        if len(response.data) == 0:
+        repository = AnimeRepository(getClient())
+        user_id = resolveUserId(repository)
+        if user_id is None:
             return render_template("signup.html")
-        user_id = response.data[0]['user_id']
-        type = 'view'
-        response = (
-            client.table("useranimeinteractions")
-            .select("anime_id")
-            .eq("user_id", user_id)
-            .eq("interaction_type", type)
-            .execute()
-        )
-        if len(response.data) == 0:
+        
+        # One query for the viewed ids and one for all their names
+        anime_names = repository.get_seen_anime_names(user_id)
+        if len(anime_names) == 0:
             return render_template("seenAnimes.html", animes=[])
         
-        animes = []
-        for interaction in response.data:
-            anime_id = interaction['anime_id']
-            anime_response = (
-                client.table("animes")
-                .select("anime_name")
-                .eq("anime_id", anime_id)
-                .execute()
-            )
-            
-            if len(anime_response.data) > 0:
-                anime_name = anime_response.data[0]['anime_name']
-                
-                # Scrape image URL using hybrid method (AniList + MAL fallback)
-                image_url = get_anime_image_url_hybrid(anime_name)
-                
-                # Use placeholder if scraping fails
-                if not image_url:
-                    image_url = f'https://via.placeholder.com/300x450/1a1033/a78bfa?text={anime_name}'
-                
-                animes.append({
-                    'anime_name': anime_name,
-                    'image_url': image_url
-                })
+        # Resolve every cover in parallel (AniList + MAL fallback), placeholder if scraping fails
+        image_urls = resolve_image_urls(anime_names)
+        animes = [
+            {
+                'anime_name': anime_name,
+                'image_url': image_urls.get(anime_name) or f'https://via.placeholder.com/300x450/1a1033/a78bfa?text={anime_name}'
+            }
+            for anime_name in anime_names
+        ]
         
         return render_template('seenAnimes.html', animes=animes)
     except Exception as e:
@@ -0,0 +1,106 @@
+'''
+    Load time of the training artifacts in the pickle formats and in the
+    artifact bundle, each load in a fresh interpreter with sklearn and the
+    loaders already imported.
+
+        python -m benchmarks.artifact_load [--rows 500000] [--features 111] [--repeat 5]
+
+    The index is saved as a pickled sklearn NearestNeighbors (the original
+    format), a pickled ExactIndex with its matrix, and a bundle component.
+    Bundle arrays are memory-mapped, so 'load + scan' also reads every
+    matrix row once, which is what the first brute-force search pays.
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import numpy as np
+import pandas as pd
+
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import MultiLabelBinarizer
+from benchmarks.common import GENRES, run_python, synthetic_catalog
+from src.components.artifact_bundle import save_encoder_components, save_index_component
+from src.components.data_transformation import DataTransformation
+from src.components.model_index import ExactIndex
+from src.components.query_encoder import QueryEncoder
+from src.utils import generateEmbeddingWeights, parseGenres, save_embedding, save_object
+
+
+LOAD = '''
+import json, sys, time
+import numpy as np
+import sklearn.compose, sklearn.neighbors, sklearn.preprocessing
+from src.components.artifact_bundle import load_component
+from src.utils import load_embedding, load_object
+loader = {'pickle': load_object, 'npz': load_embedding, 'bundle': load_component}[sys.argv[1]]
+start = time.perf_counter()
+loaded = loader(sys.argv[2])
+loaded_at = time.perf_counter()
+matrix = getattr(loaded, 'matrix', getattr(loaded, '_fit_X', None))
+if matrix is not None:
+    np.asarray(matrix).sum()
+print(json.dumps({'load': loaded_at - start, 'scan': time.perf_counter() - start}))
+'''
+
+
+def save_artifacts(directory, n_rows, n_features):
+    pickles = os.path.join(directory, 'pickle')
+    bundle_dir = os.path.join(directory, 'bundle')
+
+    matrix = np.random.default_rng(0).standard_normal((n_rows, n_features)).astype(np.float32)
+    save_object(os.path.join(pickles, 'nearest_neighbors.pkl'), NearestNeighbors(n_neighbors=10, metric='cosine').fit(matrix))
+    index = ExactIndex().fit(matrix)
+    save_object(os.path.join(pickles, 'model_trainer.pkl'), index)
+
+    # Encoder artifacts fitted on a small synthetic catalog, their size does not depend on the catalog
+    frame = pd.read_csv(synthetic_catalog(os.path.join(directory, 'raw.csv'), 2000))
+    preprocessor = DataTransformation().get_preprocessor_object().fit(frame[['rating', 'episodes', 'type']])
+    binarizer = MultiLabelBinarizer(classes=GENRES).fit(frame['genre'].apply(parseGenres))
+    weights = generateEmbeddingWeights()
+    query_encoder = QueryEncoder.from_fitted(preprocessor, binarizer, weights, 12)
+    save_object(os.path.join(pickles, 'preprocessor.pkl'), preprocessor)
+    save_object(os.path.join(pickles, 'binarizer.pkl'), binarizer)
+    save_object(os.path.join(pickles, 'query_encoder.pkl'), query_encoder)
+    save_embedding(os.path.join(pickles, 'embedding.npz'), weights, 12)
+    save_encoder_components(bundle_dir, query_encoder)
+    # After the encoder, which starts a new run in the manifest
+    save_index_component(bundle_dir, index)
+
+    return [
+        ('index', 'NearestNeighbors pickle', 'pickle', os.path.join(pickles, 'nearest_neighbors.pkl')),
+        ('index', 'ExactIndex pickle', 'pickle', os.path.join(pickles, 'model_trainer.pkl')),
+        ('index', 'bundle', 'bundle', os.path.join(bundle_dir, 'model.json')),
+        ('preprocessor', 'pickle', 'pickle', os.path.join(pickles, 'preprocessor.pkl')),
+        ('query_encoder', 'pickle', 'pickle', os.path.join(pickles, 'query_encoder.pkl')),
+        ('query_encoder', 'bundle (also the preprocessor)', 'bundle', os.path.join(bundle_dir, 'query_encoder.json')),
+        ('binarizer', 'pickle', 'pickle', os.path.join(pickles, 'binarizer.pkl')),
+        ('binarizer', 'bundle', 'bundle', os.path.join(bundle_dir, 'binarizer.json')),
+        ('embedding', 'npz', 'npz', os.path.join(pickles, 'embedding.npz')),
+        ('embedding', 'bundle', 'bundle', os.path.join(bundle_dir, 'embedding.json')),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000, help="rows of the index matrix")
+    parser.add_argument('--features', type=int, default=111, help="columns of the index matrix")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        for artifact, label, kind, file_path in save_artifacts(directory, args.rows, args.features):
+            runs = [run_python(root, LOAD, kind, file_path) for _ in range(args.repeat)]
+            errors = [run['error'] for run in runs if 'error' in run]
+            if errors:
+                print(f"{artifact:14s} {label:32s} failed: {errors[0]}")
+                continue
+            load = statistics.median(run['load'] for run in runs) * 1000
+            scan = statistics.median(run['scan'] for run in runs) * 1000
+            print(f"{artifact:14s} {label:32s} load {load:9.2f} ms   load + scan {scan:9.2f} ms")
+    print(f"Index of {args.rows} x {args.features} float32, median of {args.repeat} fresh interpreters per line")
+
+
+if __name__ == '__main__':
+    main()
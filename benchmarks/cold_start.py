@@ -0,0 +1,53 @@
+'''
+    Cold-start cost of a web worker: wall time and peak RSS of importing the
+    modules gunicorn loads, each in a fresh interpreter, for the working tree
+    and for an earlier revision.
+
+        python -m benchmarks.cold_start [--before 878d75d] [--modules src.utils app] [--repeat 5]
+
+    The default --before is the revision just before the keras/torch imports
+    were dropped from src.utils; it needs tensorflow and torch installed.
+'''
+import argparse
+import statistics
+
+from benchmarks.common import checkout, run_python
+
+
+IMPORT = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+# ru_maxrss is in KiB on Linux
+print(json.dumps({'seconds': seconds, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def measure(root, module, repeat):
+    runs = [run_python(root, IMPORT, module) for _ in range(repeat)]
+    errors = [run['error'] for run in runs if 'error' in run]
+    if errors:
+        return f"failed: {errors[0]}"
+    seconds = statistics.median(run['seconds'] for run in runs)
+    max_rss = statistics.median(run['max_rss_mb'] for run in runs)
+    return f"{seconds:6.2f} s  {max_rss:7.1f} MB max RSS"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--before', default='878d75d', help="git revision measured as 'before'")
+    parser.add_argument('--after', default=None, help="git revision measured as 'after', the working tree by default")
+    parser.add_argument('--modules', nargs='+', default=['src.utils', 'app'])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for label, rev in (('before', args.before), ('after', args.after)):
+        with checkout(rev) as root:
+            for module in args.modules:
+                print(f"{label:6s} {rev or 'working tree':12s} import {module:10s} {measure(root, module, args.repeat)}")
+    print(f"Median of {args.repeat} fresh interpreters per line")
+
+
+if __name__ == '__main__':
+    main()
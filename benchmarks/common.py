@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+
+from contextlib import contextmanager
+
+
+RAW_CSV = os.path.join('artifacts', 'raw.csv')
+WORDS = [
+    'Attack', 'on', 'Titan', 'My', 'Hero', 'Academia', 'Dragon', 'Ball', 'One', 'Piece', 'Death', 'Note',
+    'the', 'of', 'a', 'Spirited', 'Away', 'Season', 'Final', 'Movie', 'Princess', 'Stories', 'Girls', 'Heroes',
+]
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Sci-Fi', 'Slice of Life', 'Sports']
+
+
+def synthetic_catalog(file_path, n_rows, seed=0):
+    '''
+        CSV with the columns of raw.csv, for machines without the real catalog.
+    '''
+    rng = np.random.default_rng(seed)
+    titles = [' '.join(rng.choice(WORDS, rng.integers(1, 7))) for _ in range(n_rows)]
+    untitled = rng.random(n_rows) < 0.1
+    frame = pd.DataFrame({
+        'englishTitle': np.where(untitled, None, titles),
+        'title_userPreferred': titles,
+        'genre': [str(list(rng.choice(GENRES, rng.integers(0, 4), replace=False))) for _ in range(n_rows)],
+        'theme': '[]',
+        'rating': np.where(rng.random(n_rows) < 0.1, np.nan, rng.uniform(4, 9, n_rows).round(2)),
+        'episodes': np.where(rng.random(n_rows) < 0.1, np.nan, rng.integers(1, 100, n_rows)),
+        'type': rng.choice(['TV', 'Movie', 'OVA', 'ONA', 'Special'], n_rows),
+    })
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    frame.to_csv(file_path, index=False)
+    return file_path
+
+
+def catalog_csv(csv_path, n_rows, scratch_dir):
+    '''
+        csv_path when it exists, a synthetic catalog of n_rows otherwise.
+        Returns (path, description) so the report says which one was used.
+    '''
+    if csv_path and os.path.exists(csv_path):
+        return csv_path, csv_path
+    return synthetic_catalog(os.path.join(scratch_dir, 'synthetic.csv'), n_rows), f"synthetic catalog of {n_rows} rows"
+
+
+@contextmanager
+def checkout(rev):
+    '''
+        Detached git worktree of rev in a temporary directory, removed afterwards.
+        Yields its path, or the working tree itself when rev is None.
+    '''
+    if rev is None:
+        yield os.getcwd()
+        return
+    scratch_dir = tempfile.mkdtemp(prefix='benchmark-')
+    root = os.path.join(scratch_dir, 'tree')
+    subprocess.run(['git', 'worktree', 'add', '--detach', root, rev], check=True, capture_output=True)
+    try:
+        yield root
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', root], check=False, capture_output=True)
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def run_python(root, code, *args):
+    '''
+        Runs code in a fresh interpreter with root first on sys.path and as
+        working directory. The code prints one JSON object on its last line;
+        returns it, or {'error': <last stderr line>} when the process failed.
+    '''
+    env = dict(os.environ, PYTHONPATH=root)
+    process = subprocess.run([sys.executable, '-c', code, *map(str, args)], cwd=root, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f"exit status {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
@@ -0,0 +1,77 @@
+'''
+    Peak traced memory of DataTransformation.initiate_data_transformation
+    per titled catalog row, for the in-memory and the streaming path, in
+    the working tree and in an earlier revision. Each run is a fresh
+    interpreter; the artifacts are written to a temporary directory.
+
+        python -m benchmarks.memory_profile [--csv artifacts/raw.csv] [--rows 200000]
+            [--chunk-size 10000] [--before 14632a0] [--plain-text]
+
+    The default --before is the revision just before the feature matrix
+    was assembled in place. Title normalization needs the NLTK stopwords,
+    wordnet and punkt data; --plain-text replaces it with str.split in both
+    revisions, which leaves the assembly being measured unchanged.
+'''
+import argparse
+import tempfile
+import pandas as pd
+
+from benchmarks.common import RAW_CSV, catalog_csv, checkout, run_python
+
+
+PROFILE = '''
+import json, os, sys, tempfile, tracemalloc
+csv_path, streaming, chunk_size, plain_text = sys.argv[1], sys.argv[2] == '1', int(sys.argv[3]), sys.argv[4] == '1'
+from src import utils
+import src.components.data_transformation as data_transformation
+if plain_text:
+    utils.getStopwords = lambda: frozenset()
+    utils.lemmatizeToken = lambda word: word
+    utils.generateTokens = data_transformation.generateTokens = lambda corpus: [text.split() for text in corpus]
+
+transformation = data_transformation.DataTransformation()
+config = transformation.transformation_config
+scratch_dir = tempfile.mkdtemp()
+for name in dir(config):
+    if name.endswith('_path') or name.endswith('_dir'):
+        setattr(config, name, os.path.join(scratch_dir, getattr(config, name)))
+config.streaming = streaming
+config.chunk_size = chunk_size
+
+tracemalloc.start()
+train_arr = transformation.initiate_data_transformation(csv_path)[0]
+peak = tracemalloc.get_traced_memory()[1]
+print(json.dumps({'peak': peak, 'rows': len(train_arr)}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=RAW_CSV)
+    parser.add_argument('--rows', type=int, default=200000, help="rows of the synthetic catalog")
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--before', default='14632a0', help="git revision measured as 'before'")
+    parser.add_argument('--after', default=None, help="git revision measured as 'after', the working tree by default")
+    parser.add_argument('--plain-text', action='store_true', help="normalize titles with str.split, without NLTK")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        csv_path, source = catalog_csv(args.csv, args.rows, scratch_dir)
+        n_rows = len(pd.read_csv(csv_path, encoding='latin', usecols=['englishTitle']))
+        for label, rev in (('before', args.before), ('after', args.after)):
+            with checkout(rev) as root:
+                for mode, streaming in (('in-memory', False), ('streaming', True)):
+                    result = run_python(root, PROFILE, csv_path, int(streaming), args.chunk_size, int(args.plain_text))
+                    if 'error' in result:
+                        print(f"{label:6s} {rev or 'working tree':12s} {mode:9s} failed: {result['error']}")
+                        continue
+                    print(
+                        f"{label:6s} {rev or 'working tree':12s} {mode:9s} peak {result['peak'] / 2 ** 20:8.1f} MB"
+                        f"  {result['peak'] / result['rows']:8.0f} bytes per catalog row"
+                    )
+    print(f"{n_rows} rows from {source}, titled rows are the catalog rows; chunk_size {args.chunk_size}"
+          + (", plain-text normalization" if args.plain_text else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+    Rows/sec of the title normalization, the generateCorpus loop of the
+    baseline against the batched normalizeTitles.
+
+        python -m benchmarks.normalize_titles [--csv artifacts/raw.csv] [--rows 20000] [--repeat 3]
+
+    Uses the englishTitle column of --csv, or synthetic titles when the file
+    does not exist. Needs the NLTK stopwords and wordnet corpora:
+    python -c "import nltk; nltk.download('stopwords'); nltk.download('wordnet')"
+'''
+import argparse
+import tempfile
+import time
+import pandas as pd
+
+from benchmarks.common import RAW_CSV, catalog_csv
+from src import utils
+
+
+def baseline_corpus(df):
+    # generateCorpus as it was before the batched normalizer
+    from nltk.corpus import stopwords
+    from nltk.stem import WordNetLemmatizer
+    corpus = []
+    lemmatizer = WordNetLemmatizer()
+    for i in range(df.shape[0]):
+        data = str(df['englishTitle'][i]).lower()
+        data = data.split(" ")
+        data = [word for word in data if word not in stopwords.words("english")]
+        data = [lemmatizer.lemmatize(word) for word in data]
+        corpus.append(' '.join(data))
+    return corpus
+
+
+def batched_corpus(df):
+    # Every run starts with an empty lemma cache
+    utils.lemmatizeToken.cache_clear()
+    return utils.generateCorpus(df)
+
+
+def measure(function, df, repeat):
+    best, output = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(df)
+        best = min(best, time.perf_counter() - start)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=RAW_CSV)
+    parser.add_argument('--rows', type=int, default=20000, help="rows of the synthetic catalog")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        csv_path, source = catalog_csv(args.csv, args.rows, scratch_dir)
+        df = pd.read_csv(csv_path, encoding='latin', usecols=['englishTitle'])
+    # Corpora loaded before timing, both sides then start warm
+    try:
+        utils.getStopwords()
+        utils.getLemmatizer().lemmatize('warmup')
+    except LookupError:
+        raise SystemExit("The NLTK stopwords and wordnet corpora are missing, see the usage at the top of this file")
+
+    results = {}
+    for name, function in (('generateCorpus loop', baseline_corpus), ('normalizeTitles', batched_corpus)):
+        seconds, results[name] = measure(function, df, args.repeat)
+        print(f"{name:20s} {seconds:8.3f} s  {len(df) / seconds:12,.0f} rows/s")
+    print(f"{len(df)} titles from {source}, best of {args.repeat}")
+    print(f"Identical output: {results['generateCorpus loop'] == results['normalizeTitles']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import numpy as np
+
+from sklearn.preprocessing import MultiLabelBinarizer
+from src.components.model_index import INDEX_MODES, build_index
+from src.components.query_encoder import QueryEncoder
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import array_digest, file_digest, save_array, load_array
+
+
+# Bumped whenever the layout of a component changes; older readers refuse newer bundles
+BUNDLE_SCHEMA_VERSION = 1
+BUNDLE_MANIFEST = 'manifest.json'
+# Arrays of each index mode, everything else about an index is a JSON parameter
+INDEX_ARRAYS = {
+    'exact': ('matrix',),
+    'ivf': ('matrix', 'centroids', 'ids', 'offsets', 'positions'),
+}
+
+
+def to_json_value(value):
+    # Fitted sklearn attributes hold numpy scalars
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_json(file_path, content):
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp_path, file_path)
+
+
+def read_json(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_component(bundle_dir, name, kind, meta, arrays, artifacts=None):
+    '''
+        Writes one component of the bundle: every array as <name>.<key>.npy,
+        then <name>.json with the parameters and the sha256, shape and dtype
+        of each array, then the bundle manifest. The component JSON is what
+        the artifact registry watches, so it changes whenever an array does.
+        artifacts is recorded in the same manifest write, see update_manifest.
+    '''
+    try:
+        os.makedirs(bundle_dir, exist_ok=True)
+        entries = {}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            file_name = f"{name}.{key}.npy"
+            save_array(os.path.join(bundle_dir, file_name), array)
+            entries[key] = {
+                'file': file_name,
+                'sha256': array_digest([array]),
+                'shape': list(array.shape),
+                'dtype': array.dtype.str
+            }
+        component_path = os.path.join(bundle_dir, f"{name}.json")
+        write_json(component_path, {
+            'schema_version': BUNDLE_SCHEMA_VERSION,
+            'kind': kind,
+            'meta': meta,
+            'arrays': entries
+        })
+        update_manifest(bundle_dir, component=(name, component_path), artifacts=artifacts)
+        logging.info(f"Bundle component {name} saved to {component_path}")
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def update_manifest(bundle_dir, component=None, artifacts=None, remove=(), **fields):
+    '''
+        Read-modify-write of the bundle manifest: the schema version, the
+        feature layout, the sha256 of every component JSON and, in
+        artifacts, the sha256 of the artifacts of the same training run kept
+        outside the bundle (catalog store and genre index manifests, catalog
+        embedding), keyed by their artifact registry name. remove drops
+        components that do not belong to the run being written.
+    '''
+    os.makedirs(bundle_dir, exist_ok=True)
+    manifest_path = os.path.join(bundle_dir, BUNDLE_MANIFEST)
+    manifest = read_json(manifest_path) if os.path.exists(manifest_path) else {'components': {}}
+    manifest['schema_version'] = BUNDLE_SCHEMA_VERSION
+    manifest.update(fields)
+    manifest.setdefault('artifacts', {}).update(artifacts or {})
+    for name in remove:
+        manifest['components'].pop(name, None)
+    if component is not None:
+        name, component_path = component
+        manifest['components'][name] = {
+            'file': os.path.basename(component_path),
+            'sha256': file_digest(component_path)
+        }
+    write_json(manifest_path, manifest)
+
+
+def feature_layout(query_encoder):
+    '''
+        Column ranges of the feature matrix, in the order the encoder builds it.
+    '''
+    blocks = [
+        ('embedding', query_encoder.weights.shape[1], None),
+        ('genre', len(query_encoder.genre_classes), query_encoder.genre_classes),
+    ]
+    blocks += [(column, 1, None) for column in query_encoder.numeric]
+    blocks.append(('type', len(query_encoder.type_categories), query_encoder.type_categories))
+    layout, start = [], 0
+    for name, width, labels in blocks:
+        block = {'name': name, 'start': start, 'stop': start + width}
+        if labels is not None:
+            block['labels'] = [to_json_value(label) for label in labels]
+        layout.append(block)
+        start += width
+    return {'n_features': start, 'blocks': layout}
+
+
+def save_encoder_components(bundle_dir, query_encoder, artifacts=None):
+    '''
+        The query encoder, the embedding table and the genre vocabulary.
+        The same query_encoder component also serves as the preprocessor, it
+        reproduces the fitted ColumnTransformer. This starts a training run:
+        the model of the previous run is dropped from the manifest until
+        the new one is saved, and artifacts, the digests of the catalog
+        files written just before, are recorded last.
+    '''
+    try:
+        update_manifest(bundle_dir, remove=('model',))
+        columns = list(query_encoder.numeric)
+        save_component(bundle_dir, 'query_encoder', 'query_encoder', {
+            'max_length': int(query_encoder.max_length),
+            'genre_classes': [to_json_value(genre) for genre in query_encoder.genre_classes],
+            'numeric_columns': columns,
+            'type_fill': to_json_value(query_encoder.type_fill),
+            'type_categories': [to_json_value(category) for category in query_encoder.type_categories]
+        }, {
+            'weights': np.asarray(query_encoder.weights, dtype=np.float32),
+            # One row per numeric column: imputer statistic, scaler mean, scaler scale
+            'numeric': np.array([query_encoder.numeric[column] for column in columns], dtype=np.float64).reshape(len(columns), 3)
+        })
+        save_component(bundle_dir, 'embedding', 'embedding', {
+            'max_length': int(query_encoder.max_length)
+        }, {
+            'weights': np.asarray(query_encoder.weights, dtype=np.float32)
+        })
+        save_component(bundle_dir, 'binarizer', 'binarizer', {
+            'classes': [to_json_value(genre) for genre in query_encoder.genre_classes]
+        }, {})
+        update_manifest(bundle_dir, feature_layout=feature_layout(query_encoder), artifacts=artifacts)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def save_index_component(bundle_dir, index, artifacts=None):
+    try:
+        mode = next(mode for mode, index_class in INDEX_MODES.items() if isinstance(index, index_class))
+        arrays = {key: getattr(index, key) for key in INDEX_ARRAYS[mode]}
+        params = {
+            key: to_json_value(value) for key, value in vars(index).items()
+            if key not in arrays and key != 'dtype' and not isinstance(value, np.ndarray)
+        }
+        params['dtype'] = np.dtype(index.dtype).name
+        save_component(bundle_dir, 'model', 'index', {'mode': mode, 'params': params}, arrays, artifacts=artifacts)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def load_component(file_path, mmap_mode='r'):
+    '''
+        Builds the object of one component from its JSON and arrays, the
+        arrays memory-mapped. Shapes and dtypes are checked against the JSON,
+        verify_bundle also checks the hashes.
+    '''
+    try:
+        component = read_json(file_path)
+        if component['schema_version'] > BUNDLE_SCHEMA_VERSION:
+            raise ValueError(f"{file_path} has schema version {component['schema_version']}, this code reads up to {BUNDLE_SCHEMA_VERSION}")
+        directory = os.path.dirname(file_path) or '.'
+        arrays = {}
+        for key, entry in component['arrays'].items():
+            array = load_array(os.path.join(directory, entry['file']), mmap_mode=mmap_mode)
+            if list(array.shape) != entry['shape'] or array.dtype.str != entry['dtype']:
+                # Caught between the arrays and the JSON of a new training run
+                raise ValueError(f"{entry['file']} is {array.dtype.str}{list(array.shape)}, expected {entry['dtype']}{entry['shape']}")
+            arrays[key] = array
+        return COMPONENT_LOADERS[component['kind']](component['meta'], arrays)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def build_query_encoder(meta, arrays):
+    numeric = {
+        column: tuple(float(value) for value in row)
+        for column, row in zip(meta['numeric_columns'], np.asarray(arrays['numeric']))
+    }
+    return QueryEncoder(arrays['weights'], meta['max_length'], meta['genre_classes'], numeric, meta['type_fill'], meta['type_categories'])
+
+
+def build_embedding(meta, arrays):
+    # Same dict as load_embedding
+    return {'weights': arrays['weights'], 'max_length': meta['max_length']}
+
+
+def build_binarizer(meta, arrays):
+    return MultiLabelBinarizer(classes=meta['classes']).fit([])
+
+
+def build_index_component(meta, arrays):
+    params = dict(meta['params'])
+    params['dtype'] = np.dtype(params['dtype']).type
+    index = build_index(meta['mode'])
+    for key, value in params.items():
+        setattr(index, key, value)
+    for key, array in arrays.items():
+        setattr(index, key, array)
+    return index
+
+
+COMPONENT_LOADERS = {
+    'query_encoder': build_query_encoder,
+    'embedding': build_embedding,
+    'binarizer': build_binarizer,
+    'index': build_index_component,
+}
+
+
+def verify_bundle(bundle_dir):
+    '''
+        Checks every hash in the bundle against the files and the feature
+        layout against the model matrix. Raises on the first mismatch.
+    '''
+    try:
+        manifest = read_json(os.path.join(bundle_dir, BUNDLE_MANIFEST))
+        for name, entry in manifest['components'].items():
+            component_path = os.path.join(bundle_dir, entry['file'])
+            if file_digest(component_path) != entry['sha256']:
+                raise ValueError(f"Bundle component {name} does not match the manifest")
+            for key, array_entry in read_json(component_path)['arrays'].items():
+                if array_digest([load_array(os.path.join(bundle_dir, array_entry['file']))]) != array_entry['sha256']:
+                    raise ValueError(f"Bundle array {array_entry['file']} does not match {entry['file']}")
+        layout = manifest.get('feature_layout')
+        if layout is not None and 'model' in manifest['components']:
+            model = read_json(os.path.join(bundle_dir, manifest['components']['model']['file']))
+            if model['arrays']['matrix']['shape'][1] != layout['n_features']:
+                raise ValueError(f"Model matrix has {model['arrays']['matrix']['shape'][1]} features, the layout {layout['n_features']}")
+        logging.info(f"Artifact bundle {bundle_dir} verified: {sorted(manifest['components'])}")
+        return manifest
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import ArrayWriter, array_digest, save_array, load_array
+
+
+# Columns shown on a recommendation card: stored dtype and the value a missing entry gets.
+# Numeric columns keep a <name>_present mask, the card shows 'N/A' where it is False
+CATALOG_COLUMNS = {
+    'id': (np.int64, 0),
+    'englishTitle': (str, ''),
+    'type': (str, 'Unknown'),
+    'rating': (np.float64, 0.0),
+    'episodes': (np.float64, 0.0),
+    'genre': (str, '[]'),
+}
+MISSING_VALUE = 'N/A'
+
+
+class CatalogStore:
+    '''
+        Validated, columnar copy of the catalog display columns, one entry per
+        row of the index. Built at training time from the rows that have an
+        englishTitle, with every missing value already replaced by its default,
+        so a page of results is a fancy-index gather of each column.
+        Every column is a .npy file (fixed-width unicode for strings, no
+        pickled objects), memory-mapped and shared between worker processes.
+    '''
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['englishTitle'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    @classmethod
+    def from_frame(cls, frame):
+        columns = {}
+        for name, (dtype, default) in CATALOG_COLUMNS.items():
+            values = frame[name] if name in frame.columns else pd.Series([None] * len(frame), dtype=object)
+            if dtype is str:
+                columns[name] = np.array([default if pd.isna(value) or str(value) == '' else str(value) for value in values], dtype=str)
+            else:
+                numbers = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+                present = ~np.isnan(numbers)
+                columns[name] = np.where(present, numbers, default).astype(dtype)
+                columns[f"{name}_present"] = present
+        if (columns['englishTitle'] == '').any():
+            raise ValueError("Every catalog row needs an englishTitle, filter the rows before building the store")
+        return cls(columns)
+
+    def append(self, other):
+        '''
+            New store with the rows of other after the current ones.
+        '''
+        return CatalogStore({name: np.concatenate([column, other[name]]) for name, column in self.columns.items()})
+
+    def gather(self, indices, limit=None):
+        '''
+            Recommendation cards of the rows in indices, in order.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)[:limit]
+        values = {name: self.columns[name][indices].tolist() for name in CATALOG_COLUMNS}
+        for name, (dtype, _) in CATALOG_COLUMNS.items():
+            if dtype is not str:
+                values[name] = [
+                    value if present else MISSING_VALUE
+                    for value, present in zip(values[name], self.columns[f"{name}_present"][indices].tolist())
+                ]
+        return [dict(zip(values, card)) for card in zip(*values.values())]
+
+
+def save_catalog_store(manifest_path, catalog_store):
+    '''
+        Writes one .npy file per column next to manifest_path, the manifest last.
+        Its row count must match the index built from the same rows.
+    '''
+    try:
+        directory = os.path.dirname(manifest_path) or '.'
+        for name, column in catalog_store.columns.items():
+            save_array(os.path.join(directory, f"{name}.npy"), column)
+        write_catalog_manifest(manifest_path, catalog_store.columns)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def write_catalog_manifest(manifest_path, columns):
+    # The digest makes the manifest change whenever a column does, which is what the registry watches
+    manifest = {
+        'columns': {name: column.dtype.str for name, column in columns.items()},
+        'n_rows': len(columns['englishTitle']),
+        'digest': array_digest(columns.values())
+    }
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    logging.info(f"Catalog store saved: {manifest['n_rows']} rows, columns {list(manifest['columns'])}")
+
+
+class CatalogStoreWriter:
+    '''
+        Writes the catalog store chunk by chunk, for the streaming training.
+        n_rows and the width of every string column come from the first pass.
+    '''
+    def __init__(self, manifest_path, n_rows, widths):
+        directory = os.path.dirname(manifest_path) or '.'
+        self.manifest_path = manifest_path
+        self.writers = {}
+        for name, (dtype, _) in CATALOG_COLUMNS.items():
+            if dtype is str:
+                self.writers[name] = ArrayWriter(os.path.join(directory, f"{name}.npy"), (n_rows,), f"<U{max(1, widths.get(name, 1))}")
+            else:
+                self.writers[name] = ArrayWriter(os.path.join(directory, f"{name}.npy"), (n_rows,), dtype)
+                self.writers[f"{name}_present"] = ArrayWriter(os.path.join(directory, f"{name}_present.npy"), (n_rows,), bool)
+
+    def append(self, frame):
+        try:
+            for name, column in CatalogStore.from_frame(frame).columns.items():
+                self.writers[name].write(column)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def close(self):
+        try:
+            for writer in self.writers.values():
+                writer.close()
+            write_catalog_manifest(self.manifest_path, {name: load_array(writer.file_path) for name, writer in self.writers.items()})
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def load_catalog_store(manifest_path, mmap_mode='r'):
+    try:
+        directory = os.path.dirname(manifest_path) or '.'
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        columns = {
+            name: load_array(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in manifest['columns']
+        }
+        for name, column in columns.items():
+            if len(column) != manifest['n_rows']:
+                raise ValueError(f"Catalog column {name} has {len(column)} rows, the manifest {manifest['n_rows']}")
+        return CatalogStore(columns)
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -3,23 +3,45 @@ import sys
 import numpy as np
 import pandas as pd
 import sklearn
-import torch
-import tensorflow as tf
-import nltk
 
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import OneHotEncoder, MultiLabelBinarizer, StandardScaler, FunctionTransformer
+from collections import Counter
 from dataclasses import dataclass
+from src.components.artifact_bundle import BUNDLE_MANIFEST, save_encoder_components
+from src.components.catalog_store import CatalogStore, CatalogStoreWriter, save_catalog_store
+from src.components.genre_index import GenreIndex, GenreIndexWriter, save_genre_index
+from src.components.query_encoder import QueryEncoder
+from src.components.streaming_statistics import RunningMoments, ValueCounts
 from src.exception import CustomException
 from src.logger import logging
 from src.utils import *
 
 @dataclass
 class DataTransformationConfig:
-    preprocessor_file_path = os.path.join("artifacts", "preprocessor.pkl")
-    binarizer_file_path = os.path.join('artifacts', 'binarizer.pkl')
+    # Query encoder (also the preprocessor), embedding table and genre vocabulary
+    bundle_dir = os.path.join('artifacts', 'bundle')
+    # Raw title vectors of the catalog rows, the index rows are normalized over every feature
+    catalog_embedding_file_path = os.path.join('artifacts', 'catalog_embedding.npy')
+    genre_index_file_path = os.path.join('artifacts', 'genre_index', 'manifest.json')
+    catalog_store_file_path = os.path.join('artifacts', 'catalog', 'manifest.json')
+    # Feature matrix written by the streaming mode, memory-mapped by the trainer
+    train_features_file_path = os.path.join('artifacts', 'train_features.npy')
+    vocab_size = 500
+    embedding_dim = 100
+    embedding_seed = 42
+    # dtype of the feature matrix handed to the trainer, the index searches in float32 anyway
+    feature_dtype = np.float32
+    # Read the CSV chunk_size rows at a time, for catalogs that do not fit in memory
+    streaming = False
+    chunk_size = 50000
+
+def titledRows(frame):
+    # Rows without an englishTitle are never shown: they are kept for fitting the
+    # preprocessor but left out of the index, the genre index and the catalog store
+    return (frame['englishTitle'].notna() & (frame['englishTitle'].astype(str) != '')).to_numpy()
 
 class DataTransformation:
     def __init__(self):
@@ -66,22 +88,41 @@ class DataTransformation:
     
     def initiate_data_transformation(self, train_path):
         try:
+            if self.transformation_config.streaming:
+                return self.initiate_streaming_data_transformation(train_path)
+            
             train_data = pd.read_csv(train_path, encoding='latin')
             logging.info("Train and test datasets have been loaded successfully")
             
             preprocessor_obj = self.get_preprocessor_object()
             logging.info("Preprocessor object created successfully")
             
+            has_title = titledRows(train_data)
+            catalog_store = CatalogStore.from_frame(train_data[has_title])
+            
             # Generate embeddings for englishTitle
             if('englishTitle' in train_data.columns):
                 train_data['englishTitle'] = train_data['englishTitle'].fillna(train_data['title_userPreferred'])
                 logging.info("All null values filled successfully")
-                train_embedding = generateEmbeddings(train_data)
+                
+                # The embedding table is created once here and reused at inference,
+                # so queries and catalog rows live in the same vector space
+                train_corpus = generateCorpus(train_data)
+                max_length = generateMaxLength(generateTokens(train_corpus))
+                embedding_weights = generateEmbeddingWeights(
+                    vocab_size=self.transformation_config.vocab_size,
+                    embedding_dim=self.transformation_config.embedding_dim,
+                    seed=self.transformation_config.embedding_seed
+                )
+                # Every title counts for max_length, only the titled rows are embedded
+                train_corpus = [text for text, keep in zip(train_corpus, has_title) if keep]
             
-            # Binarize genre separately
+            # Binarize genre separately. raw.csv stores each genre list as a string,
+            # it is parsed first so the classes are genre names and not characters
             binarizer = MultiLabelBinarizer()
-            genre_encoded = binarizer.fit_transform(train_data['genre'])
+            genre_encoded = binarizer.fit_transform(train_data['genre'].apply(parseGenres))[has_title]
             print(f"Genre encoded shape: {genre_encoded.shape}")
+            genre_index = GenreIndex.from_matrix(genre_encoded, binarizer.classes_)
              
             # Drop englishTitle, genre, title_userPreferred, and theme for preprocessing
             # Only keep: rating, episodes, type
@@ -89,27 +130,147 @@ class DataTransformation:
             logging.info("Independent features have been extracted successfully")
             
             # Transform the remaining features (rating, episodes, type)
-            independent_train_data = preprocessor_obj.fit_transform(independent_train_data)
+            tabular_train_data = independent_train_data
+            independent_train_data = preprocessor_obj.fit_transform(tabular_train_data)
+            
+            # The same preprocessing as plain parameters, for single-query inference
+            query_encoder = QueryEncoder.from_fitted(preprocessor_obj, binarizer, embedding_weights, max_length)
+            query_encoder.verify(preprocessor_obj, tabular_train_data.head(1000))
             print(f"Preprocessor output shape: {independent_train_data.shape}")
-            print(f"Embedding shape: {train_embedding.shape}")
             
-            # Concatenate in order: [embedding, genre, other_features]
-            train_arr = np.concatenate((pd.DataFrame(train_embedding.numpy()), genre_encoded, independent_train_data), axis=1)
+            train_arr = self.assembleFeatures(train_corpus, genre_encoded, independent_train_data[has_title], embedding_weights, max_length)
             print(f"Final train_arr shape: {train_arr.shape}")
             logging.info("Feature engineering handled successfully")
             
-            save_object(
-                file_path = self.transformation_config.preprocessor_file_path,
-                obj = preprocessor_obj
+            save_array(self.transformation_config.catalog_embedding_file_path, train_arr[:, :embedding_weights.shape[1]].astype(np.float32))
+            save_genre_index(self.transformation_config.genre_index_file_path, genre_index)
+            save_catalog_store(self.transformation_config.catalog_store_file_path, catalog_store)
+            # The verified encoder is saved in place of the ColumnTransformer pickle, after the catalog files it vouches for
+            save_encoder_components(self.transformation_config.bundle_dir, query_encoder, self.artifactDigests())
+            logging.info("Preprocessor object saved successfully")
+            return(
+                train_arr,
+                os.path.join(self.transformation_config.bundle_dir, BUNDLE_MANIFEST)
             )
-            save_object(
-                file_path=self.transformation_config.binarizer_file_path,
-                obj = binarizer
+        except Exception as e:
+            raise CustomException(e, sys)
+    
+    def artifactDigests(self):
+        '''
+            Digests of the catalog files of this run, recorded in the bundle
+            manifest so the artifact registry never pairs them with the
+            encoder or the model of another run. Keyed by registry name.
+        '''
+        config = self.transformation_config
+        return {
+            'catalog': file_digest(config.catalog_store_file_path),
+            'genre_index': file_digest(config.genre_index_file_path),
+            'catalog_embedding': file_digest(config.catalog_embedding_file_path),
+        }
+    
+    def assembleFeatures(self, corpus, genre_encoded, tabular, embedding_weights, max_length):
+        '''
+            [embedding, genre, other_features] of the same rows, each block
+            written in place into one preallocated matrix of feature_dtype
+            instead of being concatenated.
+        '''
+        try:
+            embedding_dim = embedding_weights.shape[1]
+            genre_end = embedding_dim + genre_encoded.shape[1]
+            features = np.empty((len(corpus), genre_end + tabular.shape[1]), dtype=self.transformation_config.feature_dtype)
+            embedCorpus(corpus, embedding_weights, max_length, out=features[:, :embedding_dim])
+            features[:, embedding_dim:genre_end] = genre_encoded
+            features[:, genre_end:] = tabular
+            return features
+        except Exception as e:
+            raise CustomException(e, sys)
+    
+    def readChunks(self, train_path):
+        return pd.read_csv(train_path, encoding='latin', chunksize=self.transformation_config.chunk_size)
+    
+    def initiate_streaming_data_transformation(self, train_path):
+        '''
+            Same artifacts as initiate_data_transformation, with at most
+            chunk_size rows of the CSV in memory at a time.
+            1) first pass: max title length, genre classes and per-genre counts,
+               imputer and scaler statistics, catalog string widths
+            2) second pass: embed and transform each chunk and append it to the
+               feature matrix, the catalog embedding, the genre index and the
+               catalog store, all written to disk as they are produced
+        '''
+        try:
+            config = self.transformation_config
+            max_length = 0
+            n_rows = 0
+            genre_classes = set()
+            genre_counts = Counter()
+            catalog_widths = {}
+            rating_moments = RunningMoments()
+            episodes_counts = ValueCounts(numeric=True)
+            type_counts = ValueCounts()
+            for chunk in self.readChunks(train_path):
+                has_title = titledRows(chunk)
+                for name, column in CatalogStore.from_frame(chunk[has_title]).columns.items():
+                    if column.dtype.kind == 'U':
+                        catalog_widths[name] = max(catalog_widths.get(name, 1), column.dtype.itemsize // 4)
+                n_rows += int(has_title.sum())
+                
+                chunk['englishTitle'] = chunk['englishTitle'].fillna(chunk['title_userPreferred'])
+                max_length = max(max_length, generateMaxLength(generateTokens(generateCorpus(chunk))))
+                
+                # The binarizer is fitted on every row, the genre index only holds titled rows
+                for genres, keep in zip(chunk['genre'].apply(parseGenres), has_title):
+                    genre_classes.update(genres)
+                    if keep:
+                        genre_counts.update(set(genres))
+                
+                rating_moments.update(chunk['rating'])
+                episodes_counts.update(chunk['episodes'])
+                type_counts.update(chunk['type'])
+            logging.info(f"Streaming statistics collected: {n_rows} titled rows, max title length {max_length}")
+            
+            embedding_weights = generateEmbeddingWeights(
+                vocab_size=config.vocab_size,
+                embedding_dim=config.embedding_dim,
+                seed=config.embedding_seed
+            )
+            classes = sorted(genre_classes)
+            binarizer = MultiLabelBinarizer(classes=classes).fit([])
+            # Fitted from the partial statistics, it stands in for the ColumnTransformer
+            query_encoder = QueryEncoder(
+                embedding_weights,
+                max_length,
+                classes,
+                {'rating': rating_moments.imputed_scaler(), 'episodes': episodes_counts.imputed_scaler()},
+                type_counts.most_frequent(),
+                type_counts.categories()
             )
+            
+            features = ArrayWriter(config.train_features_file_path, (n_rows, query_encoder.n_features), config.feature_dtype)
+            catalog_embedding = ArrayWriter(config.catalog_embedding_file_path, (n_rows, config.embedding_dim), np.float32)
+            genre_index = GenreIndexWriter(config.genre_index_file_path, classes, n_rows, [genre_counts[genre] for genre in classes])
+            catalog_store = CatalogStoreWriter(config.catalog_store_file_path, n_rows, catalog_widths)
+            for chunk in self.readChunks(train_path):
+                # Only the titled rows reach the index, the others are not transformed again
+                chunk = chunk[titledRows(chunk)]
+                if len(chunk) == 0:
+                    continue
+                genre_encoded = binarizer.transform(chunk['genre'].apply(parseGenres))
+                block = self.assembleFeatures(generateCorpus(chunk), genre_encoded, query_encoder.transform(chunk), embedding_weights, max_length)
+                features.write(block)
+                catalog_embedding.write(block[:, :config.embedding_dim])
+                genre_index.append(genre_encoded)
+                catalog_store.append(chunk)
+            for writer in (features, catalog_embedding, genre_index, catalog_store):
+                writer.close()
+            print(f"Final train_arr shape: {(n_rows, query_encoder.n_features)}")
+            logging.info("Streaming feature engineering handled successfully")
+            
+            save_encoder_components(config.bundle_dir, query_encoder, self.artifactDigests())
             logging.info("Preprocessor object saved successfully")
             return(
-                pd.DataFrame(train_arr),
-                self.transformation_config.preprocessor_file_path
+                load_array(config.train_features_file_path),
+                os.path.join(config.bundle_dir, BUNDLE_MANIFEST)
             )
         except Exception as e:
-            raise CustomException(e, sys)
\ No newline at end of file
+            raise CustomException(e, sys)
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import ArrayWriter, array_digest, save_array, load_array
+
+
+GENRE_INDEX_ARRAYS = ('indptr', 'indices', 'offsets', 'postings')
+
+
+class GenreIndex:
+    '''
+        Genre membership of every catalog row, stored twice as flat int32 arrays:
+        - CSR (indptr, indices): the genre ids of row r are indices[indptr[r]:indptr[r + 1]]
+        - posting lists (offsets, postings): the sorted row ids carrying genre g are
+          postings[offsets[g]:offsets[g + 1]]
+        The arrays are plain .npy files, loaded with mmap_mode='r' so every
+        worker shares the same pages.
+    '''
+    def __init__(self, classes, indptr, indices, offsets, postings):
+        self.classes = list(classes)
+        self.class_ids = {genre: position for position, genre in enumerate(self.classes)}
+        self.indptr = indptr
+        self.indices = indices
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def from_matrix(cls, genre_encoded, classes):
+        '''
+            Builds the index from a dense (n_rows, n_classes) 0/1 matrix,
+            e.g. the output of the fitted MultiLabelBinarizer.
+        '''
+        rows, columns = np.nonzero(np.asarray(genre_encoded))
+        n_rows, n_classes = genre_encoded.shape
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows)))).astype(np.int32)
+        # np.nonzero is row-major, a stable sort by genre keeps every posting list sorted by row
+        order = np.argsort(columns, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(columns, minlength=n_classes)))).astype(np.int32)
+        return cls(classes, indptr, columns.astype(np.int32), offsets, rows[order].astype(np.int32))
+
+    @classmethod
+    def from_labels(cls, genre_lists):
+        classes = sorted(set(genre for genres in genre_lists for genre in genres))
+        class_ids = {genre: position for position, genre in enumerate(classes)}
+        encoded = np.zeros((len(genre_lists), len(classes)), dtype=np.int8)
+        for row, genres in enumerate(genre_lists):
+            for genre in genres:
+                encoded[row, class_ids[genre]] = 1
+        return cls.from_matrix(encoded, classes)
+
+    @property
+    def n_rows(self):
+        return len(self.indptr) - 1
+
+    def to_csr(self):
+        from scipy.sparse import csr_matrix
+        data = np.ones(len(self.indices), dtype=np.int8)
+        return csr_matrix((data, self.indices, self.indptr), shape=(self.n_rows, len(self.classes)))
+
+    def posting(self, genre):
+        position = self.class_ids.get(genre)
+        if position is None:
+            return np.empty(0, dtype=np.int32)
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+
+    def genres_of(self, row):
+        return [self.classes[position] for position in self.indices[self.indptr[row]:self.indptr[row + 1]]]
+
+    def select(self, genres, mode='or'):
+        '''
+            Sorted row ids carrying all ('and') or any ('or') of genres.
+            Unknown genres match nothing.
+        '''
+        postings = [self.posting(genre) for genre in dict.fromkeys(genres)]
+        if len(postings) == 0:
+            return np.empty(0, dtype=np.int32)
+        if mode == 'and':
+            # Intersect from the shortest list, the running result only shrinks
+            postings.sort(key=len)
+            rows = postings[0]
+            for posting in postings[1:]:
+                if len(rows) == 0:
+                    break
+                rows = np.intersect1d(rows, posting, assume_unique=True)
+            return np.asarray(rows, dtype=np.int32)
+        if mode == 'or':
+            return np.unique(np.concatenate(postings)).astype(np.int32)
+        raise ValueError(f"Unknown genre selection mode {mode}, expected 'and' or 'or'")
+
+    def extend(self, genre_lists):
+        '''
+            New index with one row per label list appended after the current
+            rows. Genres not seen before are added after the current classes.
+        '''
+        known = set(self.classes)
+        classes = self.classes + sorted(set(genre for genres in genre_lists for genre in genres) - known)
+        class_ids = {genre: position for position, genre in enumerate(classes)}
+        rows, columns = [], []
+        for row, genres in enumerate(genre_lists):
+            for genre in dict.fromkeys(genres):
+                rows.append(row)
+                columns.append(class_ids[genre])
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+
+        indptr = np.concatenate((self.indptr, self.indptr[-1] + np.cumsum(np.bincount(rows, minlength=len(genre_lists)))))
+        old_counts = np.zeros(len(classes), dtype=np.int64)
+        old_counts[:len(self.classes)] = np.diff(self.offsets)
+        new_counts = np.bincount(columns, minlength=len(classes))
+        offsets = np.concatenate(([0], np.cumsum(old_counts + new_counts)))
+        # New rows come after every current row, so they go at the end of each posting list
+        postings = np.empty(offsets[-1], dtype=np.int32)
+        new_rows = (rows + self.n_rows)[np.argsort(columns, kind='stable')]
+        start = 0
+        for genre in range(len(classes)):
+            end = offsets[genre] + old_counts[genre]
+            if old_counts[genre]:
+                postings[offsets[genre]:end] = self.postings[self.offsets[genre]:self.offsets[genre + 1]]
+            postings[end:offsets[genre + 1]] = new_rows[start:start + new_counts[genre]]
+            start += new_counts[genre]
+        return GenreIndex(
+            classes,
+            indptr.astype(np.int32),
+            np.concatenate((self.indices, columns)).astype(np.int32),
+            offsets.astype(np.int32),
+            postings
+        )
+
+    def score(self, weights):
+        '''
+            float32 vector holding, for every row, the sum of weights[genre]
+            over the genres of that row.
+        '''
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for genre, weight in weights.items():
+            # A row appears once per posting list, so fancy-index += is exact
+            scores[self.posting(genre)] += weight
+        return scores
+
+
+def save_genre_index(manifest_path, genre_index):
+    '''
+        Writes one .npy file per array next to manifest_path, then the manifest.
+        The manifest is written last and carries a digest of the arrays, so a
+        reader that watches it never sees a half written index.
+    '''
+    try:
+        directory = os.path.dirname(manifest_path) or '.'
+        arrays = [np.asarray(getattr(genre_index, name), dtype=np.int32) for name in GENRE_INDEX_ARRAYS]
+        for name, array in zip(GENRE_INDEX_ARRAYS, arrays):
+            save_array(os.path.join(directory, f"{name}.npy"), array)
+        write_genre_index_manifest(manifest_path, genre_index.classes, arrays)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def write_genre_index_manifest(manifest_path, classes, arrays):
+    indptr, indices = arrays[0], arrays[1]
+    manifest = {
+        'classes': list(classes),
+        'n_rows': int(len(indptr) - 1),
+        'nnz': int(len(indices)),
+        'digest': array_digest(arrays)
+    }
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    logging.info(f"Genre index saved: {manifest['n_rows']} rows, {len(manifest['classes'])} genres, {manifest['nnz']} entries")
+
+
+class GenreIndexWriter:
+    '''
+        Builds the genre index files chunk by chunk, for the streaming training.
+        genre_counts (rows per genre) and n_rows come from the first pass, so
+        every posting list gets its final place up front and each chunk is
+        written straight to the files.
+    '''
+    def __init__(self, manifest_path, classes, n_rows, genre_counts):
+        directory = os.path.dirname(manifest_path) or '.'
+        genre_counts = np.asarray(genre_counts, dtype=np.int64)
+        nnz = int(genre_counts.sum())
+        self.manifest_path = manifest_path
+        self.classes = list(classes)
+        self.writers = {
+            'indptr': ArrayWriter(os.path.join(directory, 'indptr.npy'), (n_rows + 1,), np.int32),
+            'indices': ArrayWriter(os.path.join(directory, 'indices.npy'), (nnz,), np.int32),
+            'offsets': ArrayWriter(os.path.join(directory, 'offsets.npy'), (len(self.classes) + 1,), np.int32),
+            'postings': ArrayWriter(os.path.join(directory, 'postings.npy'), (nnz,), np.int32),
+        }
+        self.offsets = np.concatenate(([0], np.cumsum(genre_counts)))
+        self.writers['offsets'].write(self.offsets)
+        self.writers['indptr'].write([0])
+        self.cursors = self.offsets[:-1].copy()
+        self.n_rows = 0
+        self.nnz = 0
+
+    def append(self, genre_encoded):
+        try:
+            rows, columns = np.nonzero(np.asarray(genre_encoded))
+            self.writers['indptr'].write(self.nnz + np.cumsum(np.bincount(rows, minlength=len(genre_encoded))))
+            self.writers['indices'].write(columns)
+
+            # Rows arrive in increasing order, so appending keeps every posting list sorted
+            order = np.argsort(columns, kind='stable')
+            rows = rows[order] + self.n_rows
+            counts = np.bincount(columns, minlength=len(self.classes))
+            start = 0
+            for genre in np.flatnonzero(counts):
+                self.writers['postings'].write_at(self.cursors[genre], rows[start:start + counts[genre]])
+                self.cursors[genre] += counts[genre]
+                start += counts[genre]
+
+            self.n_rows += len(genre_encoded)
+            self.nnz += len(columns)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def close(self):
+        try:
+            # The postings were placed by cursor, every list must be full
+            if not np.array_equal(self.cursors, self.offsets[1:]):
+                raise ValueError("Genre counts of the first pass do not match the rows appended")
+            self.writers['postings'].position = self.nnz
+            for writer in self.writers.values():
+                writer.close()
+            directory = os.path.dirname(self.manifest_path) or '.'
+            arrays = [load_array(os.path.join(directory, f"{name}.npy")) for name in GENRE_INDEX_ARRAYS]
+            write_genre_index_manifest(self.manifest_path, self.classes, arrays)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+def load_genre_index(manifest_path, mmap_mode='r'):
+    try:
+        directory = os.path.dirname(manifest_path) or '.'
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        arrays = {
+            name: load_array(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in GENRE_INDEX_ARRAYS
+        }
+        return GenreIndex(manifest['classes'], **arrays)
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -0,0 +1,256 @@
+import os
+import sys
+import copy
+import time
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import load_object, load_array
+
+
+def normalize_rows(X, dtype=np.float32):
+    X = np.asarray(X, dtype=dtype)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    # Zero vectors stay zero, which gives them a cosine distance of 1 to everything
+    norms[norms == 0] = 1
+    return X / norms
+
+
+def top_k(similarities, k):
+    '''
+        Indices and values of the k largest similarities of every row, sorted
+        in descending order, using argpartition instead of a full sort.
+    '''
+    k = min(k, similarities.shape[1])
+    if k < similarities.shape[1]:
+        indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(similarities.shape[1]), (similarities.shape[0], 1))
+    values = np.take_along_axis(similarities, indices, axis=1)
+    order = np.argsort(-values, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def search_candidates(matrix, queries, candidates, k):
+    '''
+        Exact search of the normalized queries restricted to matrix[candidates].
+        Returned indices are the candidate row ids.
+    '''
+    candidates = np.asarray(candidates, dtype=np.int64)
+    k = min(k, len(candidates))
+    best, similarities = top_k(queries @ matrix[candidates].T, k)
+    return (1 - similarities).astype(matrix.dtype), candidates[best]
+
+
+def merge_neighbors(distances, indices, other_distances, other_indices, k):
+    '''
+        The k closest of two neighbor lists per query, ties to the first list.
+    '''
+    distances = np.concatenate([distances, other_distances], axis=1)
+    indices = np.concatenate([indices, other_indices], axis=1)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class ExactIndex:
+    '''
+        Brute-force cosine search over a pre-normalized float32 matrix.
+        Exposes the same kneighbors() contract as sklearn's NearestNeighbors.
+    '''
+    def __init__(self, n_neighbors=10, dtype=np.float32):
+        self.n_neighbors = n_neighbors
+        self.dtype = dtype
+        self.matrix = None
+
+    def fit(self, X):
+        self.matrix = normalize_rows(X, self.dtype)
+        return self
+
+    def extend(self, X):
+        '''
+            New index with the rows of X appended after the current ones.
+        '''
+        extended = copy.copy(self)
+        extended.matrix = np.concatenate([self.matrix, normalize_rows(X, self.dtype)])
+        return extended
+
+    def kneighbors(self, X, n_neighbors=None, batch_size=1024, candidates=None):
+        '''
+            candidates, a sorted array of row ids (e.g. from GenreIndex.select),
+            restricts the search to those rows.
+        '''
+        n_neighbors = n_neighbors or self.n_neighbors
+        queries = normalize_rows(X, self.dtype)
+        if candidates is not None:
+            return search_candidates(self.matrix, queries, candidates, n_neighbors)
+        k = min(n_neighbors, self.matrix.shape[0])
+
+        # Queries are scored in blocks so a large batch never materializes
+        # the full (n_queries, n_rows) similarity matrix
+        distances = np.empty((queries.shape[0], k), dtype=self.dtype)
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        for start in range(0, queries.shape[0], batch_size):
+            block_indices, similarities = top_k(queries[start:start + batch_size] @ self.matrix.T, k)
+            indices[start:start + batch_size] = block_indices
+            distances[start:start + batch_size] = 1 - similarities
+        return distances, indices
+
+
+class IVFIndex:
+    '''
+        Inverted-file approximate index.
+        Rows are clustered with spherical k-means and stored grouped by cluster,
+        a query only scans the n_probe clusters whose centroids are closest to it.
+    '''
+    def __init__(self, n_neighbors=10, n_lists=None, n_probe=8, n_iter=10, seed=42, dtype=np.float32):
+        self.n_neighbors = n_neighbors
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.dtype = dtype
+        self.centroids = None
+        self.matrix = None
+        self.ids = None
+        self.offsets = None
+        self.positions = None
+
+    def _assign(self, X, centroids, batch_size=8192):
+        assignment = np.empty(X.shape[0], dtype=np.int64)
+        for start in range(0, X.shape[0], batch_size):
+            assignment[start:start + batch_size] = np.argmax(X[start:start + batch_size] @ centroids.T, axis=1)
+        return assignment
+
+    def fit(self, X):
+        X = normalize_rows(X, self.dtype)
+        n_lists = self.n_lists or max(1, int(np.sqrt(X.shape[0])))
+        n_lists = min(n_lists, X.shape[0])
+        rng = np.random.default_rng(self.seed)
+
+        centroids = X[rng.choice(X.shape[0], n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignment = self._assign(X, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, X)
+            empty = counts == 0
+            # Re-seed empty lists with random rows so every centroid stays useful
+            sums[empty] = X[rng.choice(X.shape[0], int(empty.sum()))]
+            centroids = normalize_rows(sums, self.dtype)
+
+        assignment = self._assign(X, centroids)
+        order = np.argsort(assignment, kind='stable')
+        self.centroids = centroids
+        self.matrix = X[order]
+        self.ids = order
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=n_lists))))
+        self.positions = np.empty_like(order)
+        self.positions[order] = np.arange(len(order))
+        return self
+
+    def extend(self, X):
+        '''
+            New index with the rows of X appended after the current ones, each
+            added to the list of its closest centroid. The centroids are kept,
+            a retrain re-clusters.
+        '''
+        X = normalize_rows(X, self.dtype)
+        n_lists = self.centroids.shape[0]
+        lists = np.concatenate([
+            np.repeat(np.arange(n_lists), np.diff(self.offsets)),
+            self._assign(X, self.centroids)
+        ])
+        order = np.argsort(lists, kind='stable')
+        extended = copy.copy(self)
+        extended.matrix = np.concatenate([self.matrix, X])[order]
+        extended.ids = np.concatenate([self.ids, np.arange(len(self.ids), len(self.ids) + len(X))])[order]
+        extended.offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=n_lists))))
+        extended.positions = np.empty_like(extended.ids)
+        extended.positions[extended.ids] = np.arange(len(extended.ids))
+        return extended
+
+    def kneighbors(self, X, n_neighbors=None, candidates=None):
+        n_neighbors = n_neighbors or self.n_neighbors
+        queries = normalize_rows(X, self.dtype)
+        if candidates is not None:
+            # A candidate set is already small, it is scanned exactly.
+            # positions maps a catalog row id to its place in the clustered matrix
+            if getattr(self, 'positions', None) is None:
+                self.positions = np.empty_like(self.ids)
+                self.positions[self.ids] = np.arange(len(self.ids))
+            distances, found = search_candidates(self.matrix, queries, self.positions[np.asarray(candidates)], n_neighbors)
+            return distances, self.ids[found]
+        n_lists = self.centroids.shape[0]
+        k = min(n_neighbors, self.matrix.shape[0])
+
+        distances = np.ones((queries.shape[0], k), dtype=self.dtype)
+        indices = np.zeros((queries.shape[0], k), dtype=np.int64)
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        sizes = np.diff(self.offsets)
+        for row, query in enumerate(queries):
+            # Probe at least n_probe lists, and more if they hold fewer than k rows
+            n_probe = min(self.n_probe, n_lists)
+            covered = np.cumsum(sizes[list_order[row]])
+            n_probe = max(n_probe, int(np.searchsorted(covered, k)) + 1)
+            probes = list_order[row, :min(n_probe, n_lists)]
+            candidates = np.concatenate([np.arange(self.offsets[p], self.offsets[p + 1]) for p in probes])
+
+            best, similarities = top_k((self.matrix[candidates] @ query).reshape(1, -1), k)
+            distances[row] = 1 - similarities[0]
+            indices[row] = self.ids[candidates[best[0]]]
+        return distances, indices
+
+
+INDEX_MODES = {
+    'exact': ExactIndex,
+    'ivf': IVFIndex,
+}
+
+
+def build_index(mode, **kwargs):
+    try:
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode {mode}, expected one of {sorted(INDEX_MODES)}")
+        return INDEX_MODES[mode](**kwargs)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def load_index(file_path, mmap_mode='r'):
+    try:
+        index = load_object(file_path)
+        # Indexes pickled with their matrix still load as they are
+        if getattr(index, 'matrix_file', None) is not None:
+            index.matrix = load_array(os.path.join(os.path.dirname(file_path) or '.', index.matrix_file), mmap_mode=mmap_mode)
+            if tuple(index.matrix.shape) != tuple(index.matrix_shape):
+                # Caught between the matrix and the pickle of a new training run
+                raise ValueError(f"Index matrix has shape {index.matrix.shape}, expected {index.matrix_shape}")
+        return index
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def evaluate_index(index, reference, queries, k=10):
+    '''
+        Recall@k of index against the exact reference results and the
+        queries/sec the index sustains on the same queries.
+    '''
+    try:
+        _, expected = reference.kneighbors(queries, n_neighbors=k)
+
+        start = time.perf_counter()
+        _, found = index.kneighbors(queries, n_neighbors=k)
+        elapsed = time.perf_counter() - start
+
+        hits = sum(len(np.intersect1d(a, b)) for a, b in zip(expected, found))
+        report = {
+            f'recall@{k}': hits / float(expected.size),
+            'qps': len(queries) / elapsed if elapsed > 0 else float('inf')
+        }
+        logging.info(f"Index evaluation for {type(index).__name__}: {report}")
+        return report
+    except Exception as e:
+        raise CustomException(e, sys)
@@ -5,14 +5,22 @@ import pandas as pd
 import sklearn
 
 from dataclasses import dataclass
-from sklearn.neighbors import NearestNeighbors
+from src.components.artifact_bundle import save_index_component, verify_bundle
+from src.components.model_index import ExactIndex, build_index, evaluate_index
 from src.exception import CustomException
 from src.logger import logging
 from src.utils import *
 
 @dataclass
 class ModelTrainerConfig:
-    model_trainer_path = os.path.join("artifacts", "model_trainer.pkl")
+    # The index parameters as JSON and its normalized vectors as .npy, memory-mapped at inference
+    bundle_dir = os.path.join("artifacts", "bundle")
+    # 'exact' scans every row, 'ivf' only scans the n_probe closest clusters
+    index_mode = 'exact'
+    n_neighbors = 10
+    n_lists = None
+    n_probe = 8
+    eval_queries = 200
 
 class ModelTrainer:
     def __init__(self):
@@ -21,16 +29,30 @@ class ModelTrainer:
     def initiate_model_trainer(self, train_arr):
         try:
             logging.info("Model training initiated successfully")
-            model = NearestNeighbors(n_neighbors=10, metric='cosine')
+            train_arr = np.asarray(train_arr)
+            if self.trainer_config.index_mode == 'ivf':
+                model = build_index(
+                    'ivf',
+                    n_neighbors=self.trainer_config.n_neighbors,
+                    n_lists=self.trainer_config.n_lists,
+                    n_probe=self.trainer_config.n_probe
+                )
+            else:
+                model = build_index(self.trainer_config.index_mode, n_neighbors=self.trainer_config.n_neighbors)
             logging.info("Model loaded successfully")
         
             model.fit(train_arr)
             logging.info("Model trained successfully")
             
-            save_object(
-                file_path=self.trainer_config.model_trainer_path,
-                obj=model
-            )
+            # Report recall@10 against exact search and queries/sec on a sample of catalog rows
+            rng = np.random.default_rng(0)
+            sample = rng.choice(train_arr.shape[0], min(self.trainer_config.eval_queries, train_arr.shape[0]), replace=False)
+            reference = model if isinstance(model, ExactIndex) else ExactIndex().fit(train_arr)
+            report = evaluate_index(model, reference, train_arr[sample], k=10)
+            print(f"Index {self.trainer_config.index_mode}: {report}")
+            
+            save_index_component(self.trainer_config.bundle_dir, model)
+            verify_bundle(self.trainer_config.bundle_dir)
             return model
         except Exception as e:
             raise CustomException(e, sys)
\ No newline at end of file
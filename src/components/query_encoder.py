@@ -0,0 +1,131 @@
+import sys
+import numpy as np
+
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import embedCorpus, normalizeTitles
+
+
+def to_number(value):
+    # SimpleImputer reads None as NaN and numeric strings as floats
+    return np.nan if value is None else float(value)
+
+
+class QueryEncoder:
+    '''
+        The fitted preprocessing of a query reduced to its parameters: the
+        embedding table, the binarizer classes, the imputer statistics,
+        scaler mean/scale and one-hot categories. encode_records turns form
+        records into the [embedding, genre, rating, episodes, type one-hot]
+        matrix with a few NumPy operations, without building DataFrames or
+        going through the ColumnTransformer, and gives the same float64
+        values as that path.
+    '''
+    def __init__(self, weights, max_length, genre_classes, numeric, type_fill, type_categories):
+        self.weights = weights
+        self.max_length = max_length
+        self.genre_classes = list(genre_classes)
+        self.genre_ids = {genre: position for position, genre in enumerate(self.genre_classes)}
+        # column name -> (imputer statistic, scaler mean, scaler scale), in output order
+        self.numeric = numeric
+        self.type_fill = type_fill
+        self.type_categories = list(type_categories)
+        self.type_ids = {category: position for position, category in enumerate(self.type_categories)}
+
+    @classmethod
+    def from_fitted(cls, preprocessor, binarizer, weights, max_length):
+        try:
+            numeric = {}
+            type_fill, type_categories = None, []
+            for name, pipeline, columns in preprocessor.transformers_:
+                if name == 'remainder':
+                    continue
+                imputer = pipeline.named_steps['imputer']
+                if 'scaler' in pipeline.named_steps:
+                    scaler = pipeline.named_steps['scaler']
+                    for position, column in enumerate(columns):
+                        mean = scaler.mean_[position] if scaler.mean_ is not None else 0.0
+                        scale = scaler.scale_[position] if scaler.scale_ is not None else 1.0
+                        numeric[column] = (imputer.statistics_[position], mean, scale)
+                else:
+                    type_fill = imputer.statistics_[0]
+                    type_categories = pipeline.named_steps['encoder'].categories_[0]
+            return cls(weights, max_length, binarizer.classes_, numeric, type_fill, type_categories)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    @property
+    def n_features(self):
+        return self.weights.shape[1] + len(self.genre_classes) + len(self.numeric) + len(self.type_categories)
+
+    def transform(self, frame):
+        '''
+            Same output as the fitted ColumnTransformer on a frame with the
+            rating, episodes and type columns.
+        '''
+        return self.encode_tabular(frame['rating'].tolist(), frame['episodes'].tolist(), frame['type'].tolist())
+
+    def encode_tabular(self, ratings, episodes, types):
+        values = {'rating': ratings, 'episodes': episodes}
+        output = np.zeros((len(types), len(self.numeric) + len(self.type_categories)), dtype=np.float64)
+        for position, (column, (fill, mean, scale)) in enumerate(self.numeric.items()):
+            numbers = np.array([to_number(value) for value in values[column]], dtype=np.float64)
+            numbers[np.isnan(numbers)] = fill
+            numbers -= mean
+            numbers /= scale
+            output[:, position] = numbers
+        offset = len(self.numeric)
+        for row, anime_type in enumerate(types):
+            # Only NaN counts as missing for the most_frequent imputer, unknown types stay all zeros
+            if isinstance(anime_type, float) and np.isnan(anime_type):
+                anime_type = self.type_fill
+            position = self.type_ids.get(anime_type)
+            if position is not None:
+                output[row, offset + position] = 1
+        return output
+
+    def encode_records(self, records):
+        '''
+            records are CustomData.generate_record() dicts; returns the
+            (len(records), n_features) float64 feature matrix.
+        '''
+        try:
+            # Rows without a title keep a zero vector
+            english_embedding = np.zeros((len(records), self.weights.shape[1]), dtype=np.float32)
+            titled = [
+                row for row, record in enumerate(records)
+                if record.get('englishTitle') is not None and record.get('englishTitle') == record.get('englishTitle')
+                and record.get('englishTitle') != ''
+            ]
+            if titled:
+                corpus = normalizeTitles([records[row]['englishTitle'] for row in titled])
+                english_embedding[titled] = embedCorpus(corpus, self.weights, self.max_length)
+
+            # Unknown genres are ignored, as MultiLabelBinarizer.transform does
+            genre_encoded = np.zeros((len(records), len(self.genre_classes)), dtype=np.float64)
+            for row, record in enumerate(records):
+                genres = record.get('genre')
+                if isinstance(genres, (list, tuple)):
+                    for genre in genres:
+                        position = self.genre_ids.get(genre)
+                        if position is not None:
+                            genre_encoded[row, position] = 1
+
+            tabular = self.encode_tabular(
+                [record.get('rating') for record in records],
+                [record.get('episodes') for record in records],
+                [record.get('type') for record in records]
+            )
+            return np.concatenate([english_embedding, genre_encoded, tabular], axis=1)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def verify(self, preprocessor, frame):
+        '''
+            Raises if transform differs from the fitted preprocessor on frame.
+        '''
+        expected = np.asarray(preprocessor.transform(frame), dtype=np.float64)
+        found = self.transform(frame)
+        if not np.array_equal(expected, found):
+            raise ValueError(f"Query encoder differs from the preprocessor by up to {np.abs(expected - found).max()}")
+        logging.info(f"Query encoder verified against the preprocessor on {len(frame)} rows")
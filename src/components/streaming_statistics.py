@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from collections import Counter
+
+
+def scaler_parameters(mean, var, n_samples):
+    '''
+        StandardScaler mean_/scale_ from the moments of the imputed column,
+        with the same rule for treating a feature as constant.
+    '''
+    eps = np.finfo(np.float64).eps
+    if var <= n_samples * eps * var + (n_samples * mean * eps) ** 2:
+        return mean, 1.0
+    scale = float(np.sqrt(var))
+    return mean, scale if scale >= 10 * eps else 1.0
+
+
+class RunningMoments:
+    '''
+        Count, mean and sum of squared deviations of the non-missing values
+        of a column, merged chunk by chunk (Chan et al.). Backs the mean
+        imputer and the scaler that follows it.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.n_missing = 0
+
+    def update(self, values):
+        values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+        present = values[~np.isnan(values)]
+        self.n_missing += len(values) - len(present)
+        if len(present) == 0:
+            return
+        count = len(present)
+        mean = float(present.mean())
+        m2 = float(((present - mean) ** 2).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def imputed_scaler(self):
+        # Missing values are filled with the mean, they add samples but no deviation
+        n_samples = self.count + self.n_missing
+        return (self.mean,) + scaler_parameters(self.mean, self.m2 / n_samples, n_samples)
+
+
+class ValueCounts:
+    '''
+        Exact count of every distinct non-missing value of a column. Backs
+        the median and most_frequent imputers, which need the whole
+        distribution; catalog columns such as episodes or type only take a
+        few thousand distinct values.
+    '''
+    def __init__(self, numeric=False):
+        self.numeric = numeric
+        self.counts = Counter()
+        self.n_missing = 0
+
+    def update(self, values):
+        if self.numeric:
+            values = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+            present = values[~np.isnan(values)]
+            self.counts.update(present.tolist())
+        else:
+            values = pd.Series(values, dtype=object)
+            present = values[values.notna()]
+            self.counts.update(present.tolist())
+        self.n_missing += len(values) - len(present)
+
+    def median(self):
+        values = np.array(sorted(self.counts), dtype=np.float64)
+        cumulative = np.cumsum([self.counts[value] for value in values])
+        count = int(cumulative[-1])
+        # The two middle values, averaged as np.median does for an even count
+        lower = values[np.searchsorted(cumulative, (count - 1) // 2, side='right')]
+        upper = values[np.searchsorted(cumulative, count // 2, side='right')]
+        return float((lower + upper) / 2)
+
+    def most_frequent(self):
+        # Ties go to the smallest value, as in SimpleImputer
+        top = max(self.counts.values())
+        return min(value for value, count in self.counts.items() if count == top)
+
+    def categories(self):
+        # Missing values become the most frequent value, already one of the categories
+        return sorted(self.counts)
+
+    def imputed_scaler(self):
+        median = self.median()
+        values = np.array(list(self.counts) + [median], dtype=np.float64)
+        weights = np.array(list(self.counts.values()) + [self.n_missing], dtype=np.float64)
+        n_samples = int(weights.sum())
+        mean = float((values * weights).sum() / n_samples)
+        var = float((weights * (values - mean) ** 2).sum() / n_samples)
+        return (median,) + scaler_parameters(mean, var, n_samples)
@@ -0,0 +1,107 @@
+import sys
+import queue
+import threading
+import time
+
+from dataclasses import dataclass
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import getConnection
+
+
+@dataclass
+class ConnectionPoolConfig:
+    max_size = 8
+    # Seconds to wait for a free client before giving up
+    acquire_timeout = 10
+    # A client idle for longer than this is pinged before it is handed out again
+    health_check_interval = 60
+
+
+class SupabaseClientPool:
+    '''
+        Per-process pool of Supabase clients.
+        Clients are created lazily, on first demand, and handed back after
+        each request so their HTTP connections, TLS sessions and auth setup
+        are reused. A client that sat idle too long, or whose last request
+        failed, is health checked before reuse and replaced if the check fails.
+    '''
+    def __init__(self, factory=None, config=None):
+        self.pool_config = config or ConnectionPoolConfig()
+        self.factory = factory or getConnection
+        # LIFO hands out the most recently used client, the one whose connections are still warm
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_config.max_size)
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.reused = 0
+        self.created = 0
+        self.discarded = 0
+
+    def _is_healthy(self, client):
+        try:
+            client.table("users").select("user_id").limit(1).execute()
+            return True
+        except Exception as e:
+            logging.info(f"Supabase client failed its health check: {e}")
+            return False
+
+    def acquire(self):
+        try:
+            if not self._slots.acquire(timeout=self.pool_config.acquire_timeout):
+                raise TimeoutError("No Supabase client available in the pool")
+            try:
+                client = None
+                while client is None:
+                    try:
+                        candidate, last_used = self._idle.get_nowait()
+                    except queue.Empty:
+                        client = self.factory()
+                        with self._lock:
+                            self.created += 1
+                        break
+                    if time.monotonic() - last_used > self.pool_config.health_check_interval and not self._is_healthy(candidate):
+                        with self._lock:
+                            self.discarded += 1
+                        continue
+                    client = candidate
+                    with self._lock:
+                        self.reused += 1
+                with self._lock:
+                    self.acquisitions += 1
+                return client
+            except Exception:
+                self._slots.release()
+                raise
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def release(self, client, healthy=True):
+        # A client whose request failed is checked on its next acquire
+        last_used = time.monotonic() if healthy else float('-inf')
+        self._idle.put((client, last_used))
+        self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'acquisitions': self.acquisitions,
+                'reused': self.reused,
+                'created': self.created,
+                'discarded': self.discarded,
+                'idle': self._idle.qsize(),
+                'reuse_rate': self.reused / self.acquisitions if self.acquisitions else 0.0
+            }
+
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+
+
+def get_client_pool():
+    global _client_pool
+    if _client_pool is None:
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = SupabaseClientPool()
+    return _client_pool
@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import fcntl
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from src.components.artifact_bundle import save_index_component
+from src.components.catalog_store import CatalogStore, save_catalog_store
+from src.components.genre_index import GenreIndex, save_genre_index
+from src.components.model_index import normalize_rows, search_candidates
+from src.exception import CustomException
+from src.feed_builder import anime_key
+from src.logger import logging
+from src.pipeline.artifact_registry import get_registry
+from src.utils import file_digest, parseGenres, save_array
+
+
+@dataclass
+class DeltaIndexConfig:
+    # Append-only log of the anime first seen through /view and /rating, shared by every worker
+    log_path = os.path.join('artifacts', 'delta', 'items.jsonl')
+    # Seconds between two checks of the log for items appended by other workers
+    check_interval = 2.0
+    # Delta rows that start a background compaction into the base artifacts
+    compact_threshold = 1000
+    # Seconds between two compaction attempts of a worker, whether they merged or were skipped
+    compact_backoff = 60.0
+    # Where compaction writes; the artifact registry reloads them from there
+    bundle_dir = os.path.join('artifacts', 'bundle')
+    catalog_store_file_path = os.path.join('artifacts', 'catalog', 'manifest.json')
+    genre_index_file_path = os.path.join('artifacts', 'genre_index', 'manifest.json')
+    catalog_embedding_file_path = os.path.join('artifacts', 'catalog_embedding.npy')
+
+
+@contextmanager
+def locked(lock_path):
+    # flock, so the appends of different workers never interleave in the log
+    with open(lock_path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DeltaSnapshot:
+    '''
+        Immutable view of the delta built against one artifact version.
+        Delta row j is result row n_base + j, after the rows of the catalog,
+        so one list of indices can point into both.
+    '''
+    def __init__(self, version, base_version, n_base, anime_ids, matrix, catalog, genre_index, embedding=None):
+        self.version = version
+        self.base_version = base_version
+        self.n_base = n_base
+        self.anime_ids = anime_ids
+        self.matrix = matrix
+        # Raw title vectors, the rows compaction appends to the catalog embedding
+        self.embedding = embedding
+        self.catalog = catalog
+        self.genre_index = genre_index
+
+    def __len__(self):
+        return len(self.anime_ids)
+
+    def search(self, queries, n_neighbors, genres=(), mode=None):
+        '''
+            Exact cosine search of the delta, restricted like the base search
+            to the rows having all ('and') or any ('or') of genres.
+        '''
+        candidates = np.arange(len(self)) if mode is None else self.genre_index.select(genres, mode=mode)
+        if len(candidates) == 0:
+            return np.empty((len(queries), 0), dtype=self.matrix.dtype), np.empty((len(queries), 0), dtype=np.int64)
+        distances, found = search_candidates(self.matrix, normalize_rows(queries), candidates, n_neighbors)
+        return distances, found + self.n_base
+
+    def gather(self, indices, catalog, limit=None):
+        '''
+            Recommendation cards of result rows from the catalog and the delta, in order.
+        '''
+        indices = np.asarray(indices, dtype=np.int64)[:limit]
+        in_delta = indices >= self.n_base
+        if not in_delta.any():
+            return catalog.gather(indices)
+        cards = [None] * len(indices)
+        for rows, store, offset in ((np.flatnonzero(~in_delta), catalog, 0), (np.flatnonzero(in_delta), self.catalog, self.n_base)):
+            for row, card in zip(rows, store.gather(indices[rows] - offset)):
+                cards[row] = card
+        return cards
+
+
+class DeltaIndex:
+    '''
+        Append-only index of the anime that are not in the trained catalog.
+        The interaction buffer hands it every flushed /view and /rating event;
+        anime missing from the catalog are appended to a log file that every
+        worker tails. Each worker encodes the new items with the query encoder
+        of its artifacts and searches them next to the base index, so a new
+        title is recommendable without a retrain. Once the delta holds
+        compact_threshold rows, a background thread appends it to the
+        catalog store, the genre index, the catalog embedding and the index,
+        which the artifact registry then reloads. The log keeps the merged
+        items: they are filtered out as catalog rows, and come back as delta
+        rows after a retrain rebuilds the artifacts from raw.csv.
+    '''
+    def __init__(self, config=None, registry=None):
+        self.delta_config = config or DeltaIndexConfig()
+        self.registry = registry
+        self.lock_path = f"{self.delta_config.log_path}.lock"
+        self._lock = threading.Lock()
+        self._items = {}
+        self._log_state = (None, 0)
+        self._base_ids = (None, frozenset())
+        self._vectors = (None, {})
+        self._snapshot = None
+        self._last_check = 0.0
+        self._compacting = False
+        self._compact_after = 0.0
+        self._version = 0
+        self.appended = 0
+        self.compactions = 0
+        os.makedirs(os.path.dirname(self.delta_config.log_path) or '.', exist_ok=True)
+
+    def _artifacts(self):
+        return (self.registry or get_registry()).get()
+
+    def _catalog_ids(self, artifacts):
+        version, anime_ids = self._base_ids
+        if version != artifacts.version:
+            catalog = artifacts['catalog']
+            anime_ids = frozenset(
+                anime_key(anime_id) for anime_id, present in zip(catalog['id'].tolist(), catalog['id_present'].tolist()) if present
+            )
+            self._base_ids = (artifacts.version, anime_ids)
+        return anime_ids
+
+    def add_events(self, events):
+        '''
+            Interaction buffer listener: appends the anime of events that are
+            neither in the catalog nor in the delta yet.
+        '''
+        try:
+            artifacts = self._artifacts()
+            with self._lock:
+                catalog_ids = self._catalog_ids(artifacts)
+                delta_ids = set(self._items)
+            items = {}
+            for event in events:
+                anime = event.get('anime') or {}
+                anime_id = anime_key(anime['anime_id']) if anime.get('anime_id') is not None else None
+                title = anime.get('anime_name')
+                # The catalog only holds titled rows
+                if anime_id is None or not title or anime_id in catalog_ids or anime_id in delta_ids:
+                    continue
+                items.setdefault(anime_id, {'anime_id': anime_id, 'englishTitle': title, 'genre': parseGenres(anime.get('anime_genre'))})
+            if not items:
+                return
+            with locked(self.lock_path):
+                with open(self.delta_config.log_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(item) + '\n' for item in items.values()))
+            self.appended += len(items)
+            # The next search reads the log at once
+            self._last_check = 0.0
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _read_log(self):
+        '''
+            Reads the lines appended since the last call. Returns True when
+            the set of items changed.
+        '''
+        try:
+            stat = os.stat(self.delta_config.log_path)
+        except FileNotFoundError:
+            changed = bool(self._items)
+            self._items, self._log_state = {}, (None, 0)
+            return changed
+        inode, offset = self._log_state
+        changed = False
+        if stat.st_ino != inode or stat.st_size < offset:
+            # Replaced or truncated, e.g. cleared by hand after a retrain, read again from the start
+            changed = bool(self._items)
+            self._items, offset = {}, 0
+        if stat.st_size > offset:
+            with open(self.delta_config.log_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(stat.st_size - offset)
+            # A line still being appended is read on the next call
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.decode('utf-8').splitlines():
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    logging.info(f"Skipping unreadable delta line in {self.delta_config.log_path}")
+                    continue
+                if item['anime_id'] not in self._items:
+                    self._items[item['anime_id']] = item
+                    changed = True
+            offset += len(complete)
+        self._log_state = (stat.st_ino, offset)
+        return changed
+
+    def get(self, artifacts, encode):
+        '''
+            Delta snapshot matching artifacts. encode(records, artifacts) turns
+            items into feature rows, normally PredictPipeline.encodeRecords.
+        '''
+        try:
+            snapshot = self._snapshot
+            current = snapshot is not None and snapshot.base_version == artifacts.version
+            if current and time.monotonic() - self._last_check < self.delta_config.check_interval:
+                return snapshot
+            # A snapshot of another artifact version has the wrong row offsets, so that case waits
+            if not self._lock.acquire(blocking=not current):
+                return snapshot
+            try:
+                self._last_check = time.monotonic()
+                changed = self._read_log()
+                if changed or self._snapshot is None or self._snapshot.base_version != artifacts.version:
+                    self._snapshot = self._build(artifacts, encode)
+                snapshot = self._snapshot
+            finally:
+                self._lock.release()
+
+            if len(snapshot) >= self.delta_config.compact_threshold and not self._compacting and time.monotonic() >= self._compact_after:
+                self._compacting = True
+                threading.Thread(target=self._compact, args=(artifacts, snapshot), name='delta-compaction', daemon=True).start()
+            return snapshot
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _build(self, artifacts, encode):
+        catalog_ids = self._catalog_ids(artifacts)
+        items = [item for anime_id, item in self._items.items() if anime_id not in catalog_ids]
+
+        # Encoded rows depend on the encoder, they are kept until the artifacts change
+        version, vectors = self._vectors
+        if version != artifacts.version:
+            vectors = {}
+            self._vectors = (artifacts.version, vectors)
+        new_items = [item for item in items if item['anime_id'] not in vectors]
+        if new_items:
+            records = [
+                # Type, rating and episodes are unknown and get the imputed values, as in training
+                {'englishTitle': item['englishTitle'], 'genre': item['genre'], 'episodes': None, 'rating': None, 'type': np.nan}
+                for item in new_items
+            ]
+            for item, features in zip(new_items, np.asarray(encode(records, artifacts), dtype=np.float32)):
+                vectors[item['anime_id']] = features
+
+        n_features = artifacts['model'].matrix.shape[1]
+        features = np.array([vectors[item['anime_id']] for item in items], dtype=np.float32).reshape(len(items), n_features)
+        catalog_embedding = artifacts.get('catalog_embedding')
+        # The encoder output starts with the title embedding
+        embedding = features[:, :catalog_embedding.shape[1]].copy() if catalog_embedding is not None else None
+        catalog = CatalogStore.from_frame(pd.DataFrame({
+            'id': [item['anime_id'] for item in items],
+            'englishTitle': [item['englishTitle'] for item in items],
+            # Same text form as the genre column of raw.csv
+            'genre': [str(item['genre']) for item in items],
+        }, dtype=object))
+        genre_index = GenreIndex.from_labels([item['genre'] for item in items])
+        self._version += 1
+        return DeltaSnapshot(
+            self._version, artifacts.version, len(artifacts['catalog']), [item['anime_id'] for item in items],
+            normalize_rows(features), catalog, genre_index, embedding
+        )
+
+    def _targets(self):
+        # Files compaction rewrites, keyed by registry name
+        return {
+            'catalog': self.delta_config.catalog_store_file_path,
+            'genre_index': self.delta_config.genre_index_file_path,
+            'catalog_embedding': self.delta_config.catalog_embedding_file_path,
+            'model': os.path.join(self.delta_config.bundle_dir, 'model.json'),
+        }
+
+    def _on_disk(self, artifacts):
+        '''
+            True when the files compaction rewrites still hold the artifacts
+            it extends. The registry snapshot can be check_interval seconds
+            old, another worker's compaction or a retrain may have replaced them.
+        '''
+        for name, file_path in self._targets().items():
+            signature = artifacts.signatures.get(name)
+            # A model loaded from the pickle fallback is not in the bundle yet
+            expected = signature[2] if signature is not None and os.path.abspath(signature[0]) == os.path.abspath(file_path) else None
+            current = file_digest(file_path) if os.path.exists(file_path) else None
+            if current != expected:
+                return False
+        return True
+
+    def _compact(self, artifacts, snapshot):
+        '''
+            Appends the delta to the catalog store, the genre index, the
+            catalog embedding and the index, in that order: a reader that sees
+            the new catalog before the new index never gets a row id past the
+            catalog.
+        '''
+        try:
+            with open(f"{self.delta_config.log_path}.compact", 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another worker is compacting
+                    return
+                try:
+                    catalog, model = artifacts['catalog'], artifacts['model']
+                    if model.matrix.shape[0] != len(catalog) or not self._on_disk(artifacts):
+                        logging.info("Delta compaction skipped, the artifacts are being replaced")
+                        return
+                    save_catalog_store(self.delta_config.catalog_store_file_path, catalog.append(snapshot.catalog))
+                    genre_index = artifacts.get('genre_index')
+                    if genre_index is not None:
+                        genre_index = genre_index.extend([snapshot.genre_index.genres_of(row) for row in range(len(snapshot))])
+                        save_genre_index(self.delta_config.genre_index_file_path, genre_index)
+                    catalog_embedding = artifacts.get('catalog_embedding')
+                    if catalog_embedding is not None:
+                        save_array(self.delta_config.catalog_embedding_file_path, np.concatenate([catalog_embedding, snapshot.embedding]))
+                    written = {name: file_digest(file_path) for name, file_path in self._targets().items() if name != 'model' and os.path.exists(file_path)}
+                    save_index_component(self.delta_config.bundle_dir, model.extend(snapshot.matrix), written)
+                    self.compactions += 1
+                    logging.info(f"Delta compaction merged {len(snapshot)} anime into the base index")
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except Exception as e:
+            logging.info(f"Delta compaction failed: {e}")
+        finally:
+            # Until the registry reloads, the snapshot still holds the merged rows
+            self._compact_after = time.monotonic() + self.delta_config.compact_backoff
+            self._compacting = False
+
+    def metrics(self):
+        snapshot = self._snapshot
+        return {
+            'rows': len(snapshot) if snapshot is not None else 0,
+            'version': snapshot.version if snapshot is not None else 0,
+            'base_version': snapshot.base_version if snapshot is not None else None,
+            'appended': self.appended,
+            'compactions': self.compactions,
+            'compacting': self._compacting
+        }
+
+
+_delta_index = None
+_delta_index_lock = threading.Lock()
+
+
+def get_delta_index():
+    global _delta_index
+    if _delta_index is None:
+        with _delta_index_lock:
+            if _delta_index is None:
+                _delta_index = DeltaIndex()
+    return _delta_index
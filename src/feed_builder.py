@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from collections import Counter
+from dataclasses import dataclass
+from src.components.genre_index import GenreIndex
+from src.exception import CustomException
+from src.logger import logging
+from src.pipeline.artifact_registry import get_registry
+from src.utils import parseGenres
+
+
+@dataclass
+class FeedBuilderConfig:
+    feed_size = 20
+    # Feeds of every user, shared by all workers and kept across restarts
+    store_file_path = os.path.join('artifacts', 'feed_store.sqlite')
+    # Without a trained genre index the animes table is indexed instead, rebuilt after this many seconds
+    index_ttl = 10 * 60
+
+
+class UserFeed:
+    def __init__(self, affinity, viewed, anime_names=None, source=None):
+        # genre -> number of viewed anime carrying it
+        self.affinity = affinity
+        self.viewed = viewed
+        self.anime_names = anime_names or []
+        # Index the feed was scored against
+        self.source = source
+
+    def to_json(self):
+        return json.dumps({
+            'affinity': dict(self.affinity),
+            'viewed': sorted(anime_id for anime_id in self.viewed if anime_id is not None),
+            'anime_names': self.anime_names,
+            'source': self.source
+        })
+
+    @classmethod
+    def from_json(cls, content):
+        state = json.loads(content)
+        return cls(Counter(state['affinity']), set(state['viewed']), state['anime_names'], state['source'])
+
+
+def anime_key(anime_id):
+    # Catalog ids are floats (NaN when missing) and strings in request arguments
+    if isinstance(anime_id, float):
+        return str(int(anime_id)) if not np.isnan(anime_id) else None
+    return str(anime_id)
+
+
+class FeedBuilder:
+    '''
+        Materialized "For You" feeds for the home page.
+        Candidates come from the genre index built at training time
+        (src/components/genre_index.py) over the catalog, or from an index of
+        the animes table when the artifacts predate it. Per user it keeps a
+        genre-affinity vector counted from their views; a feed is the
+        feed_size unseen anime with the highest sum of the user's affinity
+        over their genres. Feeds live in a SQLite file shared by all workers,
+        keyed by user_id, and are recomputed there when an interaction buffer
+        flushes new views, so rendering the home page is one row lookup. A
+        user seen for the first time is bootstrapped from one or two queries;
+        views flushed while that runs are kept as pending events of the row
+        and applied before the feed is stored.
+    '''
+    def __init__(self, config=None, registry=None):
+        self.feed_config = config or FeedBuilderConfig()
+        self.registry = registry
+        self._lock = threading.RLock()
+        self._index_lock = threading.Lock()
+        self._local = threading.local()
+        self._source = None
+        self._source_key = None
+        self._built_at = None
+        self._genre_index = None
+        self._names = []
+        self._rows = {}
+        self._valid = np.zeros(0, dtype=bool)
+        self.hits = 0
+        self.rescored = 0
+        self.bootstraps = 0
+        self.refreshes = 0
+        self.store_errors = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.feed_config.store_file_path) or '.', exist_ok=True)
+            # Transactions are opened explicitly, BEGIN IMMEDIATE serializes the read-modify-write of a feed
+            connection = sqlite3.connect(self.feed_config.store_file_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS feeds (user_id TEXT PRIMARY KEY, feed TEXT, pending TEXT NOT NULL DEFAULT '[]')"
+            )
+            self._local.connection = connection
+        return connection
+
+    def _catalog(self):
+        try:
+            snapshot = (self.registry or get_registry()).get()
+        except Exception as e:
+            logging.info(f"Catalog artifacts unavailable for the home feed: {e}")
+            return None, None
+        return snapshot, snapshot.get('genre_index')
+
+    def _ensure_index(self, repository):
+        snapshot, genre_index = self._catalog()
+        if genre_index is not None:
+            source = ('catalog', snapshot.version)
+            if source == self._source:
+                return
+        elif self._source is not None and self._source[0] == 'animes' and time.monotonic() - self._built_at < self.feed_config.index_ttl:
+            return
+
+        with self._index_lock:
+            if genre_index is not None:
+                if source == self._source:
+                    return
+                # The catalog digest names the index the same way in every worker
+                signature = snapshot.signatures.get('catalog')
+                source_key = f"catalog:{signature[2] if signature is not None else snapshot.version}"
+                catalog = snapshot['catalog']
+                anime_ids = [
+                    anime_key(anime_id) if present else None
+                    for anime_id, present in zip(catalog['id'].tolist(), catalog['id_present'].tolist())
+                ]
+                names = catalog['englishTitle'].tolist()
+            else:
+                source = ('animes',)
+                source_key = 'animes'
+                animes = repository.get_all_animes("anime_id, anime_name, anime_genre")
+                genre_index = GenreIndex.from_labels([parseGenres(anime['anime_genre']) for anime in animes])
+                anime_ids = [anime_key(anime['anime_id']) for anime in animes]
+                names = [anime['anime_name'] for anime in animes]
+
+            valid = np.array([not pd.isna(name) and name != '' for name in names], dtype=bool)
+            rows = {anime_id: row for row, anime_id in enumerate(anime_ids)}
+            with self._lock:
+                self._genre_index = genre_index
+                self._names = names
+                self._valid = valid
+                self._rows = rows
+                self._source = source
+                self._source_key = source_key
+                self._built_at = time.monotonic()
+            logging.info(f"Home feed index built from {source[0]}: {len(names)} animes, {len(genre_index.classes)} genres")
+
+    def _score(self, user_feed):
+        scores = self._genre_index.score(user_feed.affinity)
+        scores[~self._valid] = 0
+        seen = [self._rows[anime_id] for anime_id in user_feed.viewed if anime_id in self._rows]
+        scores[seen] = 0
+        candidates = np.flatnonzero(scores > 0)
+        # Highest score first, ties in catalog order so the feed is stable between refreshes;
+        # a few extra candidates cover duplicate names
+        k = min(2 * self.feed_config.feed_size, len(candidates))
+        if k < len(candidates):
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        anime_names = []
+        for row in candidates:
+            anime_name = self._names[row]
+            if anime_name not in anime_names:
+                anime_names.append(anime_name)
+                if len(anime_names) >= self.feed_config.feed_size:
+                    break
+        user_feed.anime_names = anime_names
+        user_feed.source = self._source_key
+        return anime_names
+
+    def _apply_view(self, user_feed, anime_id, anime_genre):
+        if anime_id in user_feed.viewed:
+            return
+        user_feed.viewed.add(anime_id)
+        row = self._rows.get(anime_id)
+        if row is not None:
+            user_feed.affinity.update(self._genre_index.genres_of(row))
+        else:
+            user_feed.affinity.update(parseGenres(anime_genre))
+
+    def _bootstrap(self, user_id, repository):
+        _, viewed_anime_ids = repository.get_interaction_summary(user_id)
+        viewed = {anime_key(anime_id) for anime_id in viewed_anime_ids}
+        affinity = Counter()
+        # Views of indexed anime need no extra query
+        for anime_id in viewed_anime_ids:
+            row = self._rows.get(anime_key(anime_id))
+            if row is not None:
+                affinity.update(self._genre_index.genres_of(row))
+        missing = [anime_id for anime_id in viewed_anime_ids if anime_key(anime_id) not in self._rows]
+        if missing:
+            animes = repository.get_animes(missing, "anime_id, anime_genre")
+            for anime_id in missing:
+                if anime_id in animes:
+                    affinity.update(parseGenres(animes[anime_id]['anime_genre']))
+        return UserFeed(affinity, viewed)
+
+    def _load(self, user_id):
+        row = self._connection().execute("SELECT feed, pending FROM feeds WHERE user_id = ?", (str(user_id),)).fetchone()
+        if row is None:
+            return None, []
+        return UserFeed.from_json(row[0]) if row[0] is not None else None, json.loads(row[1])
+
+    def _merge(self, user_id, user_feed=None):
+        '''
+            Applies the pending views of a user to their stored feed, or to
+            user_feed when none is stored yet, rescores it against this
+            worker's index and stores it. A feed another worker stored while
+            user_feed was bootstrapped wins.
+        '''
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT feed, pending FROM feeds WHERE user_id = ?", (str(user_id),)).fetchone()
+            if row is not None and row[0] is not None:
+                user_feed = UserFeed.from_json(row[0])
+            with self._lock:
+                for anime_id, anime_genre in json.loads(row[1]) if row is not None else []:
+                    self._apply_view(user_feed, anime_id, anime_genre)
+                self._score(user_feed)
+            connection.execute(
+                "INSERT OR REPLACE INTO feeds (user_id, feed, pending) VALUES (?, ?, '[]')",
+                (str(user_id), user_feed.to_json())
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return user_feed
+
+    def get_feed(self, user_id, repository):
+        try:
+            self._ensure_index(repository)
+            try:
+                user_feed, pending = self._load(user_id)
+                if user_feed is not None:
+                    if not pending and user_feed.source == self._source_key:
+                        self.hits += 1
+                        return list(user_feed.anime_names)
+                    # Views flushed by a worker without the index, or a feed scored against another index
+                    self.rescored += 1
+                    return list(self._merge(user_id).anime_names)
+            except sqlite3.Error as e:
+                logging.info(f"Feed store read failed for user {user_id}: {e}")
+                self.store_errors += 1
+
+            # The queries run outside any transaction so other users' feeds keep being served meanwhile
+            user_feed = self._bootstrap(user_id, repository)
+            self.bootstraps += 1
+            try:
+                user_feed = self._merge(user_id, user_feed)
+            except sqlite3.Error as e:
+                logging.info(f"Feed store write failed for user {user_id}: {e}")
+                self.store_errors += 1
+                with self._lock:
+                    self._score(user_feed)
+            return list(user_feed.anime_names)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def apply_events(self, events):
+        '''
+            Interaction buffer listener. Every flushed view bumps the user's
+            affinity for the genres of the anime and recomputes that user's
+            stored feed, for every worker at once. Views of users without a
+            stored feed, or flushed before this worker built its index, are
+            kept as pending events of the row and applied by the next read.
+        '''
+        views = {}
+        for event in events:
+            if event['interaction'].get('interaction_type') != 'view' or event.get('user_id') is None:
+                continue
+            anime_id = anime_key(event['interaction'].get('anime_id'))
+            anime_genre = (event.get('anime') or {}).get('anime_genre')
+            views.setdefault(str(event['user_id']), []).append([anime_id, anime_genre])
+        if not views:
+            return
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, user_views in views.items():
+                row = connection.execute("SELECT feed, pending FROM feeds WHERE user_id = ?", (user_id,)).fetchone()
+                pending = (json.loads(row[1]) if row is not None else []) + user_views
+                if row is None or row[0] is None or self._genre_index is None:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO feeds (user_id, feed, pending) VALUES (?, ?, ?)",
+                        (user_id, row[0] if row is not None else None, json.dumps(pending))
+                    )
+                    continue
+                user_feed = UserFeed.from_json(row[0])
+                with self._lock:
+                    for anime_id, anime_genre in pending:
+                        self._apply_view(user_feed, anime_id, anime_genre)
+                    self._score(user_feed)
+                connection.execute(
+                    "UPDATE feeds SET feed = ?, pending = '[]' WHERE user_id = ?", (user_feed.to_json(), user_id)
+                )
+                self.refreshes += 1
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'indexed_animes': len(self._names),
+                'index_source': self._source[0] if self._source is not None else None,
+                'hits': self.hits,
+                'rescored': self.rescored,
+                'bootstraps': self.bootstraps,
+                'refreshes': self.refreshes,
+                'store_errors': self.store_errors
+            }
+
+
+_feed_builder = None
+_feed_builder_lock = threading.Lock()
+
+
+def get_feed_builder():
+    global _feed_builder
+    if _feed_builder is None:
+        with _feed_builder_lock:
+            if _feed_builder is None:
+                _feed_builder = FeedBuilder()
+    return _feed_builder
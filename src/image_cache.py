@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+import time
+import requests
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from src.exception import CustomException
+from src.logger import logging
+from src.pipeline.artifact_registry import ArtifactRegistry
+from src.utils import get_anime_image_url, get_anime_image_url_hybrid, get_anime_image_urls_alternative
+
+
+@dataclass
+class ImageCacheConfig:
+    cache_file_path = os.path.join('artifacts', 'image_cache.sqlite')
+    image_index_path = os.path.join('artifacts', 'image_index.json')
+    max_entries = 5000
+    # Found covers rarely change, misses are retried much sooner
+    ttl = 7 * 24 * 60 * 60
+    negative_ttl = 60 * 60
+    # How long a request waits for another request that is fetching the same title
+    inflight_timeout = 30
+    # Bulk resolution: parallel requests allowed per host and the time budget of one page
+    anilist_concurrency = 4
+    myanimelist_concurrency = 2
+    page_deadline = 8.0
+    # Titles looked up per aliased AniList query
+    anilist_batch_size = 10
+
+
+def normalize_title(title):
+    return ' '.join(str(title).lower().split())
+
+
+class ImageIndex:
+    '''
+        Offline-built cover URL index (see src/pipeline/image_prefetch_pipeline.py).
+        titles maps a normalized title to {'url', 'fetched_at'}. A url of None
+        records a title that has no cover anywhere.
+    '''
+    def __init__(self, titles=None):
+        self.titles = titles or {}
+
+    def lookup(self, title):
+        entry = self.titles.get(normalize_title(title))
+        if entry is None:
+            return False, None
+        return True, entry['url']
+
+    def update(self, title, url, fetched_at):
+        self.titles[normalize_title(title)] = {'url': url, 'fetched_at': fetched_at}
+
+
+def load_image_index(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return ImageIndex(data.get('titles'))
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+def save_image_index(file_path, image_index):
+    try:
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'titles': image_index.titles}, f)
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+
+class ImageCache:
+    '''
+        Two-tier cover image cache keyed by normalized title.
+        Tier one is an in-process LRU, tier two a SQLite file shared by all
+        workers. Misses (None) are cached too, with a shorter TTL, and
+        concurrent lookups of the same title share a single fetch.
+    '''
+    def __init__(self, config=None, resolver=None):
+        self.cache_config = config or ImageCacheConfig()
+        self.resolver = resolver or get_anime_image_url_hybrid
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.cache_config.cache_file_path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.cache_config.cache_file_path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS images (title TEXT PRIMARY KEY, url TEXT, expires_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def _remember(self, key, url, expires_at):
+        with self._lock:
+            self._entries[key] = (url, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.cache_config.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, title):
+        '''
+            Returns (found, url). found is False when the title is not cached
+            or has expired; url can be None for a cached miss.
+        '''
+        key = normalize_title(title)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    return True, entry[0]
+                del self._entries[key]
+
+        try:
+            row = self._connection().execute(
+                "SELECT url, expires_at FROM images WHERE title = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.info(f"Image cache read failed for {key}: {e}")
+            return False, None
+        if row is None or row[1] <= now:
+            return False, None
+        self._remember(key, row[0], row[1])
+        return True, row[0]
+
+    def store(self, title, url):
+        key = normalize_title(title)
+        expires_at = time.time() + (self.cache_config.ttl if url else self.cache_config.negative_ttl)
+        self._remember(key, url, expires_at)
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO images (title, url, expires_at) VALUES (?, ?, ?)",
+                (key, url, expires_at)
+            )
+            connection.commit()
+        except sqlite3.Error as e:
+            logging.info(f"Image cache write failed for {key}: {e}")
+
+    def forget(self, title):
+        key = normalize_title(title)
+        with self._lock:
+            self._entries.pop(key, None)
+        try:
+            connection = self._connection()
+            connection.execute("DELETE FROM images WHERE title = ?", (key,))
+            connection.commit()
+        except sqlite3.Error as e:
+            logging.info(f"Image cache delete failed for {key}: {e}")
+
+    def claim(self, title):
+        '''
+            Registers a fetch of title. Returns (leader, event): only the leader
+            fetches and must call release(), everyone else waits on event.
+        '''
+        key = normalize_title(title)
+        with self._inflight_lock:
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._inflight[key] = event
+        return leader, event
+
+    def release(self, title, url, store=True):
+        '''
+            Ends the fetch of title. store=False wakes the waiting requests
+            without caching anything, for fetches that failed rather than
+            found no cover.
+        '''
+        key = normalize_title(title)
+        try:
+            if store:
+                self.store(title, url)
+        finally:
+            with self._inflight_lock:
+                event = self._inflight.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def get(self, title, resolver=None):
+        try:
+            found, url = self.lookup(title)
+            if found:
+                return url
+
+            leader, event = self.claim(title)
+            if not leader:
+                # Someone else is already fetching this title, wait for their result
+                event.wait(self.cache_config.inflight_timeout)
+                return self.lookup(title)[1]
+
+            url = None
+            try:
+                url = (resolver or self.resolver)(title)
+                return url
+            finally:
+                self.release(title, url)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+class BulkImageResolver:
+    '''
+        Resolves the covers of a whole page in parallel.
+        Cached titles are answered directly. The misses are looked up on AniList
+        in batches of aliased queries, and only the titles AniList does not know
+        are scraped from MyAnimeList, one by one; titles whose AniList lookup
+        failed are neither scraped nor cached. Each host has its own thread
+        pool, sized to its concurrency limit, and pooled keep-alive sessions,
+        so slow MyAnimeList scrapes never hold up the AniList batches.
+        Titles that are not resolved within the deadline come back as None;
+        their fetches keep running and fill the cache for the next page.
+    '''
+    def __init__(self, cache, config=None):
+        self.cache = cache
+        self.cache_config = config or cache.cache_config
+        self.anilist_session = self._session(self.cache_config.anilist_concurrency)
+        self.myanimelist_session = self._session(self.cache_config.myanimelist_concurrency)
+        self.anilist_executor = ThreadPoolExecutor(
+            max_workers=self.cache_config.anilist_concurrency, thread_name_prefix='image-resolver-anilist'
+        )
+        self.myanimelist_executor = ThreadPoolExecutor(
+            max_workers=self.cache_config.myanimelist_concurrency, thread_name_prefix='image-resolver-myanimelist'
+        )
+
+    def _session(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _resolve_anilist(self, titles):
+        image_urls = {}
+        try:
+            image_urls = get_anime_image_urls_alternative(titles, session=self.anilist_session)
+        except Exception as e:
+            logging.info(f"AniList batch lookup failed: {e}")
+        for title in titles:
+            if title not in image_urls:
+                # The lookup failed, nothing is cached so the next page asks again
+                self.cache.release(title, None, store=False)
+            elif image_urls[title]:
+                self.cache.release(title, image_urls[title])
+            else:
+                # Only the AniList misses fall back to MyAnimeList scraping
+                self.myanimelist_executor.submit(self._resolve_myanimelist, title)
+
+    def _resolve_myanimelist(self, title):
+        try:
+            image_url = get_anime_image_url(title, session=self.myanimelist_session, raise_errors=True)
+        except Exception as e:
+            logging.info(f"MyAnimeList lookup failed for {title}: {e}")
+            # A failed scrape is not a miss, nothing is cached
+            self.cache.release(title, None, store=False)
+            return
+        self.cache.release(title, image_url)
+
+    def resolve(self, titles, deadline=None, refresh=False):
+        '''
+            refresh fetches every title again instead of answering from the
+            cache; their cached entries are dropped first, so a failed
+            fetch leaves them unknown rather than at the old value.
+        '''
+        try:
+            deadline = self.cache_config.page_deadline if deadline is None else deadline
+            results = {}
+            waiting = {}
+            to_fetch = []
+            for title in dict.fromkeys(titles):
+                found, url = self.cache.lookup(title) if not refresh else (False, None)
+                if found:
+                    results[title] = url
+                    continue
+                leader, event = self.cache.claim(title)
+                waiting[title] = event
+                if leader:
+                    if refresh:
+                        self.cache.forget(title)
+                    to_fetch.append(title)
+
+            batch_size = self.cache_config.anilist_batch_size
+            for start in range(0, len(to_fetch), batch_size):
+                self.anilist_executor.submit(self._resolve_anilist, to_fetch[start:start + batch_size])
+
+            end = time.monotonic() + deadline
+            missed = 0
+            for title, event in waiting.items():
+                event.wait(max(0.0, end - time.monotonic()))
+                found, url = self.cache.lookup(title)
+                results[title] = url if found else None
+                missed += not found
+            if missed:
+                logging.info(f"{missed} cover images missed the {deadline}s page deadline")
+            return results
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+_bulk_resolver = None
+_image_index_registry = None
+
+
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+    return _image_cache
+
+
+def get_bulk_resolver():
+    global _bulk_resolver
+    if _bulk_resolver is None:
+        cache = get_image_cache()
+        with _image_cache_lock:
+            if _bulk_resolver is None:
+                _bulk_resolver = BulkImageResolver(cache)
+    return _bulk_resolver
+
+
+def get_image_index():
+    '''
+        The prefetched image index, reloaded when the prefetch job rewrites it.
+        None until the job has run once.
+    '''
+    global _image_index_registry
+    if _image_index_registry is None:
+        with _image_cache_lock:
+            if _image_index_registry is None:
+                _image_index_registry = ArtifactRegistry().register(
+                    'image_index', ImageCacheConfig.image_index_path, load_image_index, optional=True
+                )
+    return _image_index_registry.get()['image_index']
+
+
+def resolve_image_urls(titles, deadline=None):
+    '''
+        Maps every title to its cover URL, or None when it is unknown or was
+        not resolved before the deadline.
+        The prefetched image index is an O(1) lookup that is tried first,
+        only the titles it does not know go to the cache and the network.
+    '''
+    results = {}
+    remaining = []
+    image_index = get_image_index()
+    for title in titles:
+        found, url = image_index.lookup(title) if image_index is not None else (False, None)
+        if found:
+            results[title] = url
+        else:
+            remaining.append(title)
+    if remaining:
+        results.update(get_bulk_resolver().resolve(remaining, deadline))
+    return results
@@ -0,0 +1,352 @@
+import os
+import sys
+import glob
+import json
+import atexit
+import threading
+import time
+
+from dataclasses import dataclass
+from postgrest.exceptions import APIError
+from src.exception import CustomException
+from src.logger import logging
+from src.connection_pool import get_client_pool
+from src.repository import AnimeRepository
+
+
+@dataclass
+class InteractionBufferConfig:
+    journal_dir = os.path.join('artifacts', 'interaction_journal')
+    # Events kept in memory (and in the journal) before submit() starts refusing new ones
+    max_pending = 10000
+    # A flush happens every flush_size events or every flush_interval seconds, whichever comes first
+    flush_size = 100
+    flush_interval = 0.5
+    # How long submit() waits for room when the buffer is full
+    submit_timeout = 1.0
+    retry_interval = 5.0
+    # After this many failed flushes of a batch it is split to find the events the database rejects,
+    # which are moved to the dead-letter file instead of blocking the buffer
+    max_attempts = 3
+    dead_letter_path = os.path.join('artifacts', 'interaction_dead_letter.jsonl')
+
+
+# SQLSTATE classes caused by the rows themselves: data exceptions and integrity constraint violations
+REJECTION_SQLSTATE_CLASSES = ('22', '23')
+
+
+def is_rejection(error):
+    '''
+        True when the database refused the data of a write. Connection,
+        timeout and server errors say nothing about the events.
+    '''
+    # The repository wraps the PostgREST error in a CustomException
+    while isinstance(error, CustomException) and error.args and isinstance(error.args[0], BaseException):
+        error = error.args[0]
+    code = error.code if isinstance(error, APIError) else None
+    return isinstance(code, str) and code[:2] in REJECTION_SQLSTATE_CLASSES
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class InteractionBuffer:
+    '''
+        Write-behind buffer for /view and /rating events.
+        submit() appends the event to a local journal file and returns at once;
+        a background thread writes the events to Supabase in bulk (one upsert
+        into animes, one lookup of unresolved user_ids, one insert into
+        useranimeinteractions) and then drops them from the journal. Events
+        left in the journal of a dead worker are replayed on the next start.
+        A batch that keeps failing while the database is reachable is
+        bisected; the events it rejects on their own with a constraint or
+        validation error go to a dead-letter file and the rest are written.
+        Any other error stops the bisection and leaves the unwritten events
+        buffered.
+    '''
+    def __init__(self, client_pool=None, config=None):
+        self.buffer_config = config or InteractionBufferConfig()
+        self.client_pool = client_pool or get_client_pool()
+        # Owner process: after a fork the flusher thread only exists in the parent
+        self.pid = os.getpid()
+        self.journal_path = os.path.join(self.buffer_config.journal_dir, f"{self.pid}.jsonl")
+        self._pending = []
+        self._condition = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._stopping = False
+        self._listeners = []
+        self._failures = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.dead_lettered = 0
+
+        os.makedirs(self.buffer_config.journal_dir, exist_ok=True)
+        self._recover()
+        self._thread = threading.Thread(target=self._run, name='interaction-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _recover(self):
+        '''
+            Replays the journals of dead workers. Each one is first claimed
+            by renaming it to <pid>.<n>.claimed with this worker's pid, so two
+            workers starting together never both read it; a claim left by a
+            worker that died while recovering is claimed again.
+        '''
+        claimed = []
+        paths = glob.glob(os.path.join(self.buffer_config.journal_dir, '*.jsonl'))
+        paths += glob.glob(os.path.join(self.buffer_config.journal_dir, '*.claimed'))
+        for path in paths:
+            owner = os.path.basename(path).split('.')[0]
+            if path != self.journal_path and owner.isdigit() and int(owner) != self.pid and pid_alive(int(owner)):
+                continue
+            if path != self.journal_path:
+                claim_path = os.path.join(self.buffer_config.journal_dir, f"{self.pid}.{time.time_ns()}.{len(claimed)}.claimed")
+                try:
+                    os.rename(path, claim_path)
+                except FileNotFoundError:
+                    # Claimed by another worker first
+                    continue
+                claimed.append(claim_path)
+                path = claim_path
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self._pending.append(json.loads(line))
+                        except ValueError:
+                            # A torn last line from a crash mid-write
+                            logging.info(f"Skipping unreadable journal line in {path}")
+        # The recovered events are in this worker's journal before the claimed files go
+        self._rewrite_journal(self._pending)
+        for path in claimed:
+            os.remove(path)
+        if self._pending:
+            logging.info(f"Recovered {len(self._pending)} buffered interactions from the journal")
+
+    def _rewrite_journal(self, events):
+        with self._journal_lock:
+            tmp_path = f"{self.journal_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+
+    def add_listener(self, listener):
+        '''
+            listener(events) is called after every successful flush with the
+            written events, user_id filled in.
+        '''
+        self._listeners.append(listener)
+
+    def submit(self, event):
+        '''
+            Queues an event of the form
+            {'email', 'user_id' (optional), 'anime': {...animes row...}, 'interaction': {...}}.
+            Returns False when the buffer stays full for submit_timeout seconds.
+        '''
+        try:
+            with self._condition:
+                deadline = time.monotonic() + self.buffer_config.submit_timeout
+                while len(self._pending) >= self.buffer_config.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._stopping:
+                        self.rejected += 1
+                        return False
+                    self._condition.wait(remaining)
+
+                with self._journal_lock:
+                    with open(self.journal_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(event) + '\n')
+                        # Accepted events survive a crash of the machine, not only of the worker
+                        f.flush()
+                        os.fsync(f.fileno())
+                self._pending.append(event)
+                if len(self._pending) >= self.buffer_config.flush_size:
+                    self._condition.notify_all()
+            return True
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._pending) < self.buffer_config.flush_size:
+                    self._condition.wait(self.buffer_config.flush_interval)
+                batch = list(self._pending)
+                stopping = self._stopping
+            if batch:
+                rejected, remaining = [], []
+                try:
+                    written = self._flush(batch)
+                except Exception as e:
+                    self._failures += 1
+                    logging.info(f"Interaction flush of {len(batch)} events failed (attempt {self._failures}): {e}")
+                    if stopping:
+                        # Leave them in the journal, the next start replays them
+                        return
+                    written = None
+                    # Splitting is pointless while the database is down, the batch is retried as a whole
+                    if self._failures >= self.buffer_config.max_attempts and self._database_reachable():
+                        written, rejected, remaining = self._isolate(batch)
+                    if written is None:
+                        time.sleep(self.buffer_config.retry_interval)
+                        continue
+                if not remaining:
+                    self._failures = 0
+                if rejected:
+                    self._dead_letter(rejected)
+                with self._condition:
+                    # Events the bisection did not get to stay first in line
+                    self._pending[:len(batch)] = remaining
+                    self._rewrite_journal(self._pending)
+                    self.flushed += len(batch) - len(rejected) - len(remaining)
+                    self.dead_lettered += len(rejected)
+                    self._condition.notify_all()
+                for listener in self._listeners:
+                    try:
+                        listener(written)
+                    except Exception as e:
+                        logging.info(f"Interaction listener failed: {e}")
+                if remaining:
+                    time.sleep(self.buffer_config.retry_interval)
+            if stopping and not batch:
+                return
+
+    def _flush(self, batch):
+        client = self.client_pool.acquire()
+        healthy = False
+        try:
+            repository = AnimeRepository(client)
+            # Resolve the user_id of every event that does not carry one, in one query
+            user_ids = repository.get_user_ids(
+                event['email'] for event in batch if event.get('user_id') is None and event.get('email')
+            )
+
+            # Deduplicated anime rows; anime already in the table are left untouched
+            animes = {}
+            for event in batch:
+                anime = event.get('anime')
+                if anime is not None and anime.get('anime_id') is not None:
+                    animes.setdefault(anime['anime_id'], anime)
+            repository.upsert_animes(animes.values())
+
+            interactions = []
+            written = []
+            for event in batch:
+                user_id = event.get('user_id') or user_ids.get(event.get('email'))
+                if user_id is None:
+                    logging.info(f"Dropping interaction of unknown user {event.get('email')}")
+                    continue
+                interactions.append(dict(event['interaction'], user_id=user_id))
+                written.append(dict(event, user_id=user_id))
+            repository.insert_interactions(interactions)
+            healthy = True
+            return written
+        finally:
+            self.client_pool.release(client, healthy=healthy)
+
+    def _isolate(self, batch):
+        '''
+            Writes batch in halves, recursively, down to the single events
+            that fail on their own. Returns (written, [(event, error), ...],
+            remaining): a single event that fails with anything but a
+            rejection stops the bisection, it and the events not tried yet
+            are remaining, in batch order.
+        '''
+        written, rejected = [], []
+        pending = [batch]
+        while pending:
+            events = pending.pop()
+            try:
+                written.extend(self._flush(events))
+            except Exception as e:
+                if len(events) > 1:
+                    middle = len(events) // 2
+                    pending += [events[middle:], events[:middle]]
+                elif is_rejection(e):
+                    rejected.append((events[0], e))
+                else:
+                    logging.info(f"Interaction bisection stopped, the database failed without rejecting the event: {e}")
+                    return written, rejected, events + [event for group in reversed(pending) for event in group]
+        return written, rejected, []
+
+    def _database_reachable(self):
+        client = self.client_pool.acquire()
+        healthy = False
+        try:
+            AnimeRepository(client).ping()
+            healthy = True
+        except Exception as e:
+            logging.info(f"Database unreachable, interactions stay buffered: {e}")
+        finally:
+            self.client_pool.release(client, healthy=healthy)
+        return healthy
+
+    def _dead_letter(self, rejected):
+        os.makedirs(os.path.dirname(self.buffer_config.dead_letter_path) or '.', exist_ok=True)
+        with open(self.buffer_config.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(
+                json.dumps({'event': event, 'error': str(error), 'failed_at': time.time()}) + '\n'
+                for event, error in rejected
+            ))
+        logging.info(f"Moved {len(rejected)} interactions the database rejects to {self.buffer_config.dead_letter_path}")
+
+    def close(self, timeout=10):
+        '''
+            Stops accepting events and drains the buffer to the database.
+        '''
+        with self._condition:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def metrics(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'flushed': self.flushed,
+                'rejected': self.rejected,
+                'dead_lettered': self.dead_lettered
+            }
+
+
+_interaction_buffer = None
+_interaction_buffer_lock = threading.Lock()
+_interaction_listeners = []
+
+
+def add_interaction_listener(listener):
+    '''
+        Registers listener without creating the buffer, so importing the app
+        in a pre-forking server (gunicorn --preload) starts no flusher in the
+        master; every worker creates its own buffer on first use.
+    '''
+    with _interaction_buffer_lock:
+        _interaction_listeners.append(listener)
+        if _interaction_buffer is not None and _interaction_buffer.pid == os.getpid():
+            _interaction_buffer.add_listener(listener)
+
+
+def get_interaction_buffer():
+    global _interaction_buffer
+    if _interaction_buffer is None or _interaction_buffer.pid != os.getpid():
+        with _interaction_buffer_lock:
+            if _interaction_buffer is None or _interaction_buffer.pid != os.getpid():
+                interaction_buffer = InteractionBuffer()
+                for listener in _interaction_listeners:
+                    interaction_buffer.add_listener(listener)
+                _interaction_buffer = interaction_buffer
+    return _interaction_buffer
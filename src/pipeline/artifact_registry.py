@@ -0,0 +1,288 @@
+import os
+import sys
+import threading
+import time
+
+from dataclasses import dataclass
+from src.components.artifact_bundle import BUNDLE_MANIFEST, load_component, read_json
+from src.components.catalog_store import load_catalog_store
+from src.components.genre_index import load_genre_index
+from src.components.model_index import load_index
+from src.exception import CustomException
+from src.logger import logging
+from src.utils import file_digest, load_array, load_object, load_embedding
+
+
+@dataclass
+class ArtifactRegistryConfig:
+    catalog_store_file_path = os.path.join('artifacts', 'catalog', 'manifest.json')
+    # Versioned bundle written by the training; the pickles below are read when it is absent
+    bundle_dir = os.path.join('artifacts', 'bundle')
+    preprocessor_file_path = os.path.join('artifacts', 'preprocessor.pkl')
+    binarizer_file_path = os.path.join('artifacts', 'binarizer.pkl')
+    model_file_path = os.path.join('artifacts', 'model_trainer.pkl')
+    embedding_file_path = os.path.join('artifacts', 'embedding.npz')
+    genre_index_file_path = os.path.join('artifacts', 'genre_index', 'manifest.json')
+    query_encoder_file_path = os.path.join('artifacts', 'query_encoder.pkl')
+    catalog_embedding_file_path = os.path.join('artifacts', 'catalog_embedding.npy')
+    # Seconds between two stat() checks of the artifact files
+    check_interval = 2.0
+
+
+class LazyArtifact:
+    '''
+        Artifact loaded on first access instead of when the snapshot is built.
+        Snapshots that share it load it once; a failed load is retried on
+        the next access.
+    '''
+    def __init__(self, loader, file_path):
+        self.loader = loader
+        self.file_path = file_path
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self.loader(self.file_path)
+                    self._loaded = True
+        return self._value
+
+
+class ArtifactSnapshot:
+    '''
+        Immutable view of every loaded artifact at one version.
+        A request keeps its snapshot for its whole lifetime, so a reload
+        never swaps objects underneath it.
+    '''
+    def __init__(self, version, artifacts, signatures):
+        self.version = version
+        self.artifacts = artifacts
+        self.signatures = signatures
+
+    def __getitem__(self, name):
+        artifact = self.artifacts[name]
+        return artifact.resolve() if isinstance(artifact, LazyArtifact) else artifact
+
+    def get(self, name, default=None):
+        return self[name] if name in self.artifacts else default
+
+
+class ArtifactRegistry:
+    '''
+        Process-wide cache of the training artifacts.
+        Artifacts are loaded once and shared by every request; when a file
+        changes on disk (mtime/size, confirmed by content hash) a complete new
+        snapshot is built and swapped in with a single reference assignment.
+    '''
+    def __init__(self, config=None):
+        self.registry_config = config or ArtifactRegistryConfig()
+        self.specs = {}
+        self.checks = []
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, name, file_path, loader, optional=False, fallback=None, lazy=False):
+        '''
+            fallback, a (file_path, loader) pair, is used while file_path does
+            not exist. A lazy artifact is only loaded when a request first
+            reads it from the snapshot.
+        '''
+        sources = [(file_path, loader)] + ([fallback] if fallback is not None else [])
+        self.specs[name] = (sources, optional, lazy)
+        self._last_check = 0.0
+        return self
+
+    def validate(self, check):
+        '''
+            check(snapshot) raises when the artifacts of a new snapshot do not
+            belong together; the snapshot is then not swapped in.
+        '''
+        self.checks.append(check)
+        return self
+
+    def get(self):
+        try:
+            snapshot = self._snapshot
+            if snapshot is None:
+                with self._lock:
+                    if self._snapshot is None:
+                        self._snapshot = self._build(None)
+                        self._last_check = time.monotonic()
+                return self._snapshot
+
+            if time.monotonic() - self._last_check < self.registry_config.check_interval:
+                return snapshot
+
+            # Only one thread checks the files; the others keep serving the current snapshot
+            if not self._lock.acquire(blocking=False):
+                return snapshot
+            try:
+                self._last_check = time.monotonic()
+                if self._is_stale(self._snapshot):
+                    try:
+                        self._snapshot = self._build(self._snapshot)
+                    except Exception as e:
+                        logging.info(f"Artifact reload failed, keeping version {self._snapshot.version}: {e}")
+                return self._snapshot
+            finally:
+                self._lock.release()
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def reload(self):
+        with self._lock:
+            self._snapshot = self._build(self._snapshot)
+            self._last_check = time.monotonic()
+            return self._snapshot
+
+    def _stat(self, file_path):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _source(self, sources):
+        # The first source whose file exists, with its stat
+        for file_path, loader in sources:
+            stat = self._stat(file_path)
+            if stat is not None:
+                return file_path, loader, stat
+        return None, None, None
+
+    def _is_stale(self, snapshot):
+        for name, (sources, _, _) in self.specs.items():
+            old = snapshot.signatures.get(name)
+            file_path, _, stat = self._source(sources)
+            if old is None or stat is None:
+                if old is not None or stat is not None:
+                    return True
+                continue
+            if file_path != old[0]:
+                return True
+            if stat != old[1]:
+                # Touched but identical content does not need a reload
+                if file_digest(file_path) != old[2]:
+                    return True
+                snapshot.signatures[name] = (file_path, stat, old[2])
+        return False
+
+    def _build(self, previous):
+        artifacts = {}
+        signatures = {}
+        for name, (sources, optional, lazy) in self.specs.items():
+            file_path, loader, stat = self._source(sources)
+            if stat is None:
+                if not optional:
+                    raise FileNotFoundError(f"Artifact {name} not found at {sources[0][0]}")
+                artifacts[name] = None
+                signatures[name] = None
+                continue
+
+            old = previous.signatures.get(name) if previous is not None else None
+            if old is not None and old[:2] == (file_path, stat):
+                artifacts[name] = previous.artifacts[name]
+                signatures[name] = old
+                continue
+
+            digest = file_digest(file_path)
+            if old is not None and old[0] == file_path and old[2] == digest:
+                artifacts[name] = previous.artifacts[name]
+            elif lazy:
+                artifacts[name] = LazyArtifact(loader, file_path)
+            else:
+                artifacts[name] = loader(file_path)
+            signatures[name] = (file_path, stat, digest)
+
+        version = previous.version + 1 if previous is not None else 1
+        snapshot = ArtifactSnapshot(version, artifacts, signatures)
+        for check in self.checks:
+            check(snapshot)
+        logging.info(f"Artifacts loaded successfully (version {version})")
+        return snapshot
+
+
+def check_artifacts(snapshot):
+    '''
+        The files of a training run are written one after the other, so a
+        snapshot built in between can pair a new query encoder or catalog
+        with the old model. Bundle components must be the ones the manifest
+        lists, the catalog files must have the digests the manifest recorded
+        for them, the encoder and the manifest's feature layout must have as many
+        features as the model matrix has columns, the catalog, genre index
+        and catalog embedding must have one row per model row.
+    '''
+    manifest = snapshot.get('manifest')
+    if manifest is not None:
+        bundle_dir = os.path.dirname(snapshot.signatures['manifest'][0])
+        for name, signature in snapshot.signatures.items():
+            if signature is None or name == 'manifest' or os.path.dirname(signature[0]) != bundle_dir:
+                continue
+            entry = manifest['components'].get(os.path.basename(signature[0])[:-len('.json')])
+            if entry is None or entry['sha256'] != signature[2]:
+                raise ValueError(f"Bundle component {os.path.basename(signature[0])} does not match the manifest")
+        # Catalog files of the same run, counts alone miss a retrain of the same size
+        for name, digest in manifest.get('artifacts', {}).items():
+            if name not in snapshot.signatures:
+                continue
+            signature = snapshot.signatures[name]
+            if signature is None or signature[2] != digest:
+                raise ValueError(f"Artifact {name} is not the one the bundle manifest was written with")
+
+    matrix = getattr(snapshot['model'], 'matrix', None)
+    if matrix is None:
+        return
+    n_rows, n_features = matrix.shape
+    layout = manifest.get('feature_layout') if manifest is not None else None
+    if layout is not None and layout['n_features'] != n_features:
+        raise ValueError(f"Feature layout has {layout['n_features']} features, the model has {n_features}")
+    query_encoder = snapshot.get('query_encoder')
+    if query_encoder is not None and query_encoder.n_features != n_features:
+        raise ValueError(f"Query encoder produces {query_encoder.n_features} features, the model has {n_features}")
+    rows = {'catalog': len(snapshot['catalog'])}
+    if snapshot.get('genre_index') is not None:
+        rows['genre_index'] = snapshot['genre_index'].n_rows
+    if snapshot.get('catalog_embedding') is not None:
+        rows['catalog_embedding'] = len(snapshot['catalog_embedding'])
+    for name, count in rows.items():
+        if count != n_rows:
+            raise ValueError(f"Artifact {name} has {count} rows, the model has {n_rows}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = ArtifactRegistryConfig()
+
+                def bundled(name):
+                    return os.path.join(config.bundle_dir, f"{name}.json")
+
+                # The preprocessor, binarizer and embedding only serve the DataFrame
+                # path, used when there is no query encoder, so they load lazily
+                _registry = (
+                    ArtifactRegistry(config)
+                    .register('catalog', config.catalog_store_file_path, load_catalog_store)
+                    .register('preprocessor', bundled('query_encoder'), load_component, fallback=(config.preprocessor_file_path, load_object), lazy=True)
+                    .register('binarizer', bundled('binarizer'), load_component, fallback=(config.binarizer_file_path, load_object), lazy=True)
+                    .register('model', bundled('model'), load_component, fallback=(config.model_file_path, load_index))
+                    .register('embedding', bundled('embedding'), load_component, fallback=(config.embedding_file_path, load_embedding), lazy=True)
+                    # Optional so artifacts trained before the genre index and query encoder still load
+                    .register('genre_index', config.genre_index_file_path, load_genre_index, optional=True)
+                    .register('query_encoder', bundled('query_encoder'), load_component, optional=True, fallback=(config.query_encoder_file_path, load_object))
+                    # Raw title vectors of the catalog rows, memory-mapped on first use
+                    .register('catalog_embedding', config.catalog_embedding_file_path, load_array, optional=True, lazy=True)
+                    # Absent for pickle-only artifacts, it is only used by check_artifacts
+                    .register('manifest', os.path.join(config.bundle_dir, BUNDLE_MANIFEST), read_json, optional=True)
+                    .validate(check_artifacts)
+                )
+    return _registry
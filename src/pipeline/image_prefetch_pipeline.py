@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+from dataclasses import dataclass
+from src.exception import CustomException
+from src.logger import logging
+from src.image_cache import (
+    ImageCacheConfig, ImageIndex, get_bulk_resolver, get_image_cache,
+    load_image_index, normalize_title, save_image_index
+)
+
+
+@dataclass
+class ImagePrefetchConfig:
+    dataset_path = os.path.join('artifacts', 'raw.csv')
+    image_index_path = ImageCacheConfig.image_index_path
+    # Entries older than this are fetched again, misses are retried sooner
+    stale_after = 30 * 24 * 60 * 60
+    negative_stale_after = 7 * 24 * 60 * 60
+    # Titles resolved between two checkpoints of the index file
+    checkpoint_size = 200
+    batch_deadline = 300.0
+
+
+class ImagePrefetch:
+    '''
+        Resolves the cover of every englishTitle in the catalog ahead of time
+        and writes artifacts/image_index.json, which the web app reads as an
+        O(1) lookup. The index is checkpointed after every batch, so an
+        interrupted run resumes where it stopped, and later runs only fetch
+        titles that are missing or stale.
+    '''
+    def __init__(self):
+        self.prefetch_config = ImagePrefetchConfig()
+
+    def is_stale(self, entry, now):
+        if entry is None:
+            return True
+        max_age = self.prefetch_config.stale_after if entry['url'] else self.prefetch_config.negative_stale_after
+        return now - entry['fetched_at'] > max_age
+
+    def initiate_image_prefetch(self, refresh_all=False):
+        try:
+            dataset = pd.read_csv(self.prefetch_config.dataset_path, encoding='latin', usecols=['englishTitle'])
+            dataset = dataset.dropna(subset=['englishTitle'])
+            dataset = dataset[dataset['englishTitle'] != '']
+            logging.info(f"Image prefetch started for {len(dataset)} catalog titles")
+
+            if os.path.exists(self.prefetch_config.image_index_path):
+                image_index = load_image_index(self.prefetch_config.image_index_path)
+            else:
+                image_index = ImageIndex()
+
+            now = time.time()
+            todo = {}
+            for title in dataset['englishTitle']:
+                key = normalize_title(title)
+                if refresh_all or self.is_stale(image_index.titles.get(key), now):
+                    todo.setdefault(key, title)
+            titles = list(todo.values())
+            logging.info(f"{len(titles)} titles are missing or stale")
+
+            cache = get_image_cache()
+            resolver = get_bulk_resolver()
+            resolved = 0
+            for start in range(0, len(titles), self.prefetch_config.checkpoint_size):
+                batch = titles[start:start + self.prefetch_config.checkpoint_size]
+                # --refresh-all must not be answered from the image cache
+                resolver.resolve(batch, deadline=self.prefetch_config.batch_deadline, refresh=refresh_all)
+
+                fetched_at = time.time()
+                for title in batch:
+                    # Titles whose fetch failed or missed the deadline are not cached, they stay
+                    # missing from the index and are retried next run instead of stored as None
+                    found, url = cache.lookup(title)
+                    if found:
+                        image_index.update(title, url, fetched_at)
+                        resolved += 1
+
+                save_image_index(self.prefetch_config.image_index_path, image_index)
+                print(f"Image prefetch checkpoint: {min(start + len(batch), len(titles))}/{len(titles)} titles")
+
+            save_image_index(self.prefetch_config.image_index_path, image_index)
+            logging.info(f"Image prefetch finished, {resolved} titles resolved")
+            return self.prefetch_config.image_index_path
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Prefetch cover images for the catalog in artifacts/raw.csv")
+    parser.add_argument("--refresh-all", action="store_true", help="fetch every title again, not only missing or stale ones")
+    args = parser.parse_args()
+
+    prefetchObj = ImagePrefetch()
+    print(prefetchObj.initiate_image_prefetch(refresh_all=args.refresh_all))
@@ -7,130 +7,302 @@ import sklearn
 from src.exception import CustomException
 from src.logger import logging
 from src.utils import *
+from src.components.model_index import merge_neighbors
+from src.delta_index import get_delta_index
+from src.pipeline.artifact_registry import get_registry
+from src.image_cache import resolve_image_urls
+from src.pipeline.recommendation_cache import get_recommendation_cache, recommendation_key
+
+PLACEHOLDER_IMAGE_URL = "https://via.placeholder.com/300x450/1a1033/a78bfa?text=No+Image"
+
 
 class PredictPipeline:
-    def __init__(self):
-        pass
-        
-    def suggestAnimes(self, features):
+    def __init__(self, registry=None):
+        self.registry = registry or get_registry()
+
+    def encodeFeatures(self, features, artifacts):
+        '''
+            Turns a DataFrame of N query rows into the (N, n_features) matrix
+            the model was trained on: [embedding, genre, other_features]
+        '''
         try:
-            dataset_path = os.path.join('artifacts', 'raw.csv')
-            preprocessor_file_path = os.path.join('artifacts', 'preprocessor.pkl')
-            binarizer_file_path = os.path.join('artifacts', 'binarizer.pkl')
-            model_file_path = os.path.join('artifacts', 'model_trainer.pkl')
-            
-            dataset = pd.read_csv(dataset_path, encoding='latin')
-            preprocessor = load_object(file_path=preprocessor_file_path)
-            binarizer = load_object(file_path=binarizer_file_path)
-            model = load_object(file_path=model_file_path)
-            
-            # Handle englishTitle embedding
-            english_title_value = features['englishTitle'].iloc[0]
-            if english_title_value is not None and english_title_value != '':
-                # Generate embeddings for the title
-                title_df = pd.DataFrame({'englishTitle': [english_title_value]})
-                english_embedding = generateEmbeddings(title_df).numpy()
-            else:
-                # Use zeros if no title provided (100 dimensions)
-                english_embedding = np.zeros((1, 100))
-            
-            # Handle genre transformation
-            genre_value = features['genre'].iloc[0]
-            if genre_value is not None and genre_value != [None]:
-                # MultiLabelBinarizer expects a list of samples, so wrap in another list
-                # genre_value is ['Action', 'Comedy'], we need [['Action', 'Comedy']]
-                genre_encoded = binarizer.transform([genre_value])
-            else:
-                # Use zeros if no genre provided
-                genre_encoded = np.zeros((1, len(binarizer.classes_)))
-            
+            preprocessor = artifacts['preprocessor']
+            binarizer = artifacts['binarizer']
+            embedding = artifacts['embedding']
+
+            # Handle englishTitle embedding, rows without a title keep a zero vector
+            titles = features['englishTitle'].tolist()
+            has_title = np.array([not pd.isna(title) and title != '' for title in titles], dtype=bool)
+            english_embedding = np.zeros((len(titles), embedding['weights'].shape[1]), dtype=np.float32)
+            if has_title.any():
+                title_df = pd.DataFrame({'englishTitle': [title for title, keep in zip(titles, has_title) if keep]})
+                english_embedding[has_title] = generateEmbeddings(title_df, embedding['weights'], embedding['max_length'])
+
+            # Handle genre transformation, an empty label list binarizes to a zero row
+            genres = self.queryGenres(features['genre'].tolist())
+            genre_encoded = binarizer.transform(genres)
+
             # Drop englishTitle and genre from features before preprocessing
             # The preprocessor only handles: rating, episodes, type
             features_for_preprocessing = features.drop(columns=['englishTitle', 'genre'])
-            
+
             # Transform the remaining features (rating, episodes, type)
             # The SimpleImputer in the pipeline will handle None values
             features_transformed = preprocessor.transform(features_for_preprocessing)
-            
+
             print(f"English embedding shape: {english_embedding.shape}")
             print(f"Genre encoded shape: {genre_encoded.shape}")
             print(f"Features transformed shape: {features_transformed.shape}")
-            
-            # Concatenate all features in the correct order: [embedding, genre, other_features]
+
             # This should match the order used during training
-            final_features = np.concatenate([english_embedding, genre_encoded, features_transformed], axis=1)
-            
+            return np.concatenate([english_embedding, genre_encoded, features_transformed], axis=1)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def encodeRecords(self, records, artifacts):
+        '''
+            Feature matrix of CustomData records. Uses the query encoder
+            exported at training, which skips the DataFrames and the
+            ColumnTransformer; artifacts without one go through encodeFeatures.
+        '''
+        query_encoder = artifacts.get('query_encoder')
+        if query_encoder is not None:
+            return query_encoder.encode_records(records)
+        return self.encodeFeatures(pd.DataFrame(records, columns=CustomBatchData.features, dtype=object), artifacts)
+
+    def queryGenres(self, genre_values):
+        return [
+            list(genre) if isinstance(genre, (list, tuple)) and list(genre) != [None] else []
+            for genre in genre_values
+        ]
+
+    def searchNeighbors(self, final_features, genres, artifacts, n_neighbors, delta=None):
+        '''
+            kneighbors over the catalog, restricted for every query that asks
+            for genres to the rows having all of them (any of them when too
+            few rows have all). Queries without genres, or whose genres match
+            fewer than n_neighbors rows, search the whole catalog.
+            Queries sharing a candidate set are searched with one call.
+            The delta of anime added since training is searched with the
+            same filter and merged into the top n_neighbors.
+        '''
+        model = artifacts['model']
+        genre_index = artifacts.get('genre_index')
+        groups = {}
+        for row, query_genres in enumerate(genres):
+            key = tuple(sorted(set(query_genres))) if genre_index is not None else ()
+            groups.setdefault(key, []).append(row)
+
+        indices = [None] * len(genres)
+        for key, rows in groups.items():
+            candidates, mode = None, None
+            if key:
+                candidates, mode = genre_index.select(key, mode='and'), 'and'
+                if len(candidates) < n_neighbors:
+                    candidates, mode = genre_index.select(key, mode='or'), 'or'
+                if len(candidates) < n_neighbors:
+                    candidates, mode = None, None
+            distances, found = model.kneighbors(final_features[rows], n_neighbors=n_neighbors, candidates=candidates)
+            if delta is not None and len(delta) > 0:
+                distances, found = merge_neighbors(distances, found, *delta.search(final_features[rows], n_neighbors, key, mode), n_neighbors)
+            for row, neighbors in zip(rows, found):
+                indices[row] = neighbors
+        return indices
+
+    def collectAnimes(self, indices, catalog, with_images=True, limit=10, delta=None):
+        try:
+            # The catalog store only holds validated rows, so the first limit
+            # neighbors are the page, gathered column by column
+            if delta is not None:
+                recommended_animes = delta.gather(indices, catalog, limit=limit)
+            else:
+                recommended_animes = catalog.gather(indices, limit=limit)
+
+            if with_images:
+                self.attachImages(recommended_animes)
+            return recommended_animes
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def attachImages(self, recommended_animes):
+        # Fetch the image URLs of the whole page in parallel, cached across requests and workers
+        image_urls = resolve_image_urls([anime['englishTitle'] for anime in recommended_animes])
+        for anime in recommended_animes:
+            # Use a placeholder if image not found
+            anime['imageUrl'] = image_urls.get(anime['englishTitle']) or PLACEHOLDER_IMAGE_URL
+        return recommended_animes
+
+    def recommendRecords(self, records, with_images=False):
+        '''
+            One page of recommendations per CustomData record, in input order.
+            The records are encoded as a single matrix and searched with one
+            kneighbors call per distinct genre filter.
+        '''
+        try:
+            # Artifacts are loaded once per process and shared across requests
+            artifacts = self.registry.get()
+            catalog = artifacts['catalog']
+
+            final_features = self.encodeRecords(records, artifacts)
             print(f"Final features shape: {final_features.shape}")
-            
+            delta = get_delta_index().get(artifacts, self.encodeRecords)
+
             # Get recommendations
-            # Request more neighbors to account for potential filtering
-            n_neighbors = min(20, len(dataset))  # Don't request more than dataset size
-            distances, indices = model.kneighbors(final_features, n_neighbors=n_neighbors)
-            
-            # Convert to list of dictionaries and filter out invalid entries
-            recommended_animes = []
-            for indice in indices[0]:
-                anime = dataset.iloc[indice]
-                
-                # Skip if englishTitle is missing or NaN
-                if pd.isna(anime.get('englishTitle')) or anime.get('englishTitle') == '':
-                    continue
-                
-                # Get the anime title for image scraping
-                anime_title = anime.get('englishTitle', 'Unknown Title')
-                
-                # Fetch the image URL using web scraping
-                print(f"Fetching image for: {anime_title}")
-                image_url = get_anime_image_url_alternative(anime_title)
-                
-                # Use a placeholder if image not found
-                if not image_url:
-                    image_url = "https://via.placeholder.com/300x450/1a1033/a78bfa?text=No+Image"
-                
-                # Convert Series to dictionary and handle NaN values
-                anime_dict = {
-                    'id': int(anime.get('id')) if not pd.isna(anime.get('id')) else 'N/A',
-                    'englishTitle': anime_title,
-                    'type': anime.get('type', 'Unknown') if not pd.isna(anime.get('type')) else 'Unknown',
-                    'rating': anime.get('rating', 'N/A') if not pd.isna(anime.get('rating')) else 'N/A',
-                    'episodes': anime.get('episodes', 'N/A') if not pd.isna(anime.get('episodes')) else 'N/A',
-                    'genre': anime.get('genre', '[]') if not pd.isna(anime.get('genre')) else '[]',
-                    'imageUrl': image_url
-                }
-                
-                recommended_animes.append(anime_dict)
-                
-                # Stop once we have 10 valid recommendations
-                if len(recommended_animes) >= 10:
-                    break
-            
+            # Every catalog row is displayable, so a page needs exactly its own number of neighbors
+            n_neighbors = min(10, len(catalog) + len(delta))  # Don't request more than catalog size
+            genres = self.queryGenres(record.get('genre') for record in records)
+            indices = self.searchNeighbors(final_features, genres, artifacts, n_neighbors, delta)
+
+            pages = [self.collectAnimes(row, catalog, with_images=False, delta=delta) for row in indices]
+            if with_images:
+                # Covers of every page resolved in one parallel lookup, not one lookup per page
+                self.attachImages([anime for page in pages for anime in page])
+            return pages
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def suggestAnimes(self, features, with_images=True):
+        try:
+            recommended_animes = self.recommendRecords(features.iloc[:1].to_dict('records'), with_images=with_images)[0]
             print(f"Returning {len(recommended_animes)} recommendations")
             return recommended_animes
         except Exception as e:
             raise CustomException(e, sys)
-        
+
+    def suggestAnimesCached(self, custom_data, coalescer=None):
+        '''
+            suggestAnimes behind the recommendation cache. Returns
+            (recommended_animes, hit); hit tells whether the page came from the cache.
+            A miss goes through coalescer (a RequestCoalescer) when given, so it is
+            computed in one batch with the other queries arriving at the same time.
+        '''
+        try:
+            cache = get_recommendation_cache()
+            record = custom_data.generate_record()
+            key = recommendation_key(record)
+            # Pages also change when anime are added to the delta
+            artifacts = self.registry.get()
+            version = (artifacts.version, get_delta_index().get(artifacts, self.encodeRecords).version)
+
+            recommended_animes = cache.get(key, version)
+            hit = recommended_animes is not None
+            if not hit:
+                # The form record is encoded directly, no DataFrame is built
+                if coalescer is not None:
+                    recommended_animes = coalescer.recommend(record, key)
+                else:
+                    recommended_animes = self.recommendRecords([record])[0]
+                cache.put(key, version, recommended_animes)
+            return self.attachImages(recommended_animes), hit
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def suggestAnimesBatch(self, features, with_images=False):
+        '''
+            Recommendations for every row of features in one pass.
+            Returns one list of recommendations per input row, in input order.
+        '''
+        try:
+            results = self.recommendRecords(features.to_dict('records'), with_images=with_images)
+            logging.info(f"Batch recommendations generated for {len(results)} queries")
+            return results
+        except Exception as e:
+            raise CustomException(e, sys)
+
 
 class CustomData:
     def __init__(self, features, values):
         self.features = features
         self.values = values
-    
-    def generate_data_frame(self):
+
+    def generate_record(self):
         try:
-            dict = {
-                'englishTitle': [None],
-                'genre': [None],
-                'episodes': [0],
-                'rating': [0],
-                'type': [0]
+            record = {
+                'englishTitle': None,
+                'genre': None,
+                'episodes': 0,
+                'rating': 0,
+                'type': 0
             }
             for k, v in zip(self.features, self.values):
                 if k in ['englishTitle', 'genre'] and v != '':
-                    dict[k] = [v]
+                    record[k] = v
                 if k in ['englishTitle', 'genre'] and v == '':
-                    dict[k] = [None]
+                    record[k] = None
                 if v != '':
-                    dict[k] = [v]
-            return pd.DataFrame(dict)
+                    record[k] = v
+            return record
         except Exception as e:
-            raise CustomException(e, sys)
\ No newline at end of file
+            raise CustomException(e, sys)
+
+    def generate_data_frame(self):
+        try:
+            return pd.DataFrame({k: [v] for k, v in self.generate_record().items()})
+        except Exception as e:
+            raise CustomException(e, sys)
+
+
+class CustomBatchData:
+    '''
+        Many query rows at once, each a dict with the same keys as the
+        /findanime form. Missing or empty values get the form defaults.
+    '''
+    features = ['englishTitle', 'genre', 'episodes', 'rating', 'type']
+
+    def __init__(self, queries):
+        self.queries = queries
+
+    def validate(self):
+        '''
+            Error message for the first query that cannot become a record,
+            None when every query is valid. A genre may be a list of labels
+            or a single label.
+        '''
+        for position, query in enumerate(self.queries):
+            if not isinstance(query, dict):
+                return f"Query {position} must be an object"
+            title = query.get('englishTitle')
+            if title is not None and not isinstance(title, str):
+                return f"Query {position}: englishTitle must be a string"
+            genre = query.get('genre')
+            if genre is not None and not isinstance(genre, str) and not (
+                isinstance(genre, list) and all(isinstance(label, str) for label in genre)
+            ):
+                return f"Query {position}: genre must be a string or a list of strings"
+            for key in ('episodes', 'rating'):
+                value = query.get(key)
+                if value in (None, ''):
+                    continue
+                try:
+                    if isinstance(value, bool):
+                        raise ValueError(value)
+                    float(value)
+                except (TypeError, ValueError):
+                    return f"Query {position}: {key} must be a number"
+            anime_type = query.get('type')
+            if anime_type not in (None, 0) and not isinstance(anime_type, str):
+                return f"Query {position}: type must be a string"
+        return None
+
+    def generate_records(self):
+        try:
+            records = []
+            for query in self.queries:
+                genre = query.get('genre') or None
+                values = [
+                    query.get('englishTitle') or None,
+                    [genre] if isinstance(genre, str) else genre,
+                    query.get('episodes') or 0,
+                    query.get('rating') or 0,
+                    query.get('type') or 0
+                ]
+                records.append(CustomData(self.features, values).generate_record())
+            return records
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def generate_data_frame(self):
+        try:
+            return pd.DataFrame(self.generate_records(), columns=self.features, dtype=object)
+        except Exception as e:
+            raise CustomException(e, sys)
@@ -0,0 +1,118 @@
+import json
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class RecommendationCacheConfig:
+    max_entries = 2048
+    ttl = 10 * 60
+
+
+def canonical_number(value):
+    # '7', 7 and 7.0 reach the preprocessor as the same number
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def canonical_title(title):
+    # Missing titles are encoded as a zero vector, the others are split on
+    # single spaces like normalizeTitles; empty words add no token
+    if title is None or title != title or title == '':
+        return None
+    return ' '.join(word for word in str(title).lower().split(" ") if word)
+
+
+def recommendation_key(record):
+    '''
+        sha256 of a CustomData record with every value in canonical form:
+        the title as the query encoder tokenizes it, genres sorted and
+        deduplicated, numbers as floats.
+    '''
+    genres = record.get('genre')
+    anime_type = record.get('type')
+    canonical = {
+        'englishTitle': canonical_title(record.get('englishTitle')),
+        'genre': sorted(set(str(genre) for genre in genres)) if isinstance(genres, (list, tuple)) else [],
+        'episodes': canonical_number(record.get('episodes')),
+        'rating': canonical_number(record.get('rating')),
+        'type': anime_type.strip() if isinstance(anime_type, str) else anime_type,
+    }
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RecommendationCache:
+    '''
+        LRU of recommendation pages keyed by recommendation_key and bounded
+        by size and TTL. Entries belong to the artifact version they were
+        computed with: the first lookup under a new version drops them all.
+        Pages are stored without image URLs, which have their own cache.
+    '''
+    def __init__(self, config=None):
+        self.cache_config = config or RecommendationCacheConfig()
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # Copies, the caller adds image URLs to the cards
+                return [dict(anime) for anime in entry[1]]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, recommended_animes):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (
+                time.monotonic() + self.cache_config.ttl,
+                [dict(anime) for anime in recommended_animes]
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.cache_config.max_entries:
+                self._entries.popitem(last=False)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+_recommendation_cache = None
+_recommendation_cache_lock = threading.Lock()
+
+
+def get_recommendation_cache():
+    global _recommendation_cache
+    if _recommendation_cache is None:
+        with _recommendation_cache_lock:
+            if _recommendation_cache is None:
+                _recommendation_cache = RecommendationCache()
+    return _recommendation_cache
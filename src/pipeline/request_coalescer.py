@@ -0,0 +1,180 @@
+import sys
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from src.exception import CustomException
+from src.logger import logging
+from src.pipeline.predict_pipeline import PredictPipeline
+
+
+@dataclass
+class RequestCoalescerConfig:
+    # Seconds the oldest queued query waits for others to join its batch. Queries
+    # arriving while a batch is computed are batched anyway, so by default a
+    # lone query is not delayed
+    window = 0.0
+    # A batch is sent as soon as it holds this many queries
+    max_batch_size = 64
+    # Seconds a request waits for its page before giving up
+    timeout = 10.0
+    # Queueing delays kept for the percentiles reported by metrics()
+    delay_samples = 1024
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class PendingQuery:
+    def __init__(self, record, key):
+        self.record = record
+        # Without a key a query is only ever batched with itself
+        self.key = key if key is not None else id(self)
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class RequestCoalescer:
+    '''
+        Micro-batching in front of PredictPipeline.recommendRecords.
+        Concurrent requests queue their record; a background thread takes up
+        to max_batch_size of them, waiting at most window seconds after the
+        oldest one, encodes and searches them as one matrix and hands each
+        request its own page through a Future. Queries with the same
+        recommendation key in a batch are computed once, queries whose
+        request timed out before their batch started are not computed.
+    '''
+    def __init__(self, recommend, config=None):
+        self.coalescer_config = config or RequestCoalescerConfig()
+        self.recommend_records = recommend
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._delays = deque(maxlen=self.coalescer_config.delay_samples)
+        # Batch sizes bucketed by power of two: 1, 2, 4, ... up to max_batch_size
+        self._histogram = {}
+        self.batches = 0
+        self.queries = 0
+        self.failures = 0
+        self.cancelled = 0
+
+        self._thread = threading.Thread(target=self._run, name='request-coalescer', daemon=True)
+        self._thread.start()
+
+    def submit(self, record, key=None):
+        query = PendingQuery(record, key)
+        with self._condition:
+            self._queue.append(query)
+            self._condition.notify_all()
+        return query.future
+
+    def recommend(self, record, key=None):
+        '''
+            The recommendation page of one CustomData record, computed in a
+            batch with the queries that arrive at the same time.
+        '''
+        try:
+            future = self.submit(record, key)
+            try:
+                return future.result(timeout=self.coalescer_config.timeout)
+            finally:
+                # No-op once the batch has started, a timed-out query is otherwise dropped
+                future.cancel()
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                deadline = self._queue[0].enqueued + self.coalescer_config.window
+                while len(self._queue) < self.coalescer_config.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.coalescer_config.max_batch_size))]
+            self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.monotonic()
+        # Running futures can no longer be cancelled, so every result below is delivered
+        live = [query for query in batch if query.future.set_running_or_notify_cancel()]
+        if len(live) < len(batch):
+            with self._condition:
+                self.cancelled += len(batch) - len(live)
+            batch = live
+        if not batch:
+            return
+        # One row per distinct query, every duplicate shares its page
+        rows = {}
+        records = []
+        for query in batch:
+            if query.key not in rows:
+                rows[query.key] = len(records)
+                records.append(query.record)
+        try:
+            pages = self.recommend_records(records)
+        except Exception as e:
+            logging.info(f"Coalesced batch of {len(batch)} queries failed, retrying them one by one: {e}")
+            # One bad query must not fail the others of its batch
+            pages = []
+            for record in records:
+                try:
+                    pages.append(self.recommend_records([record])[0])
+                except Exception as error:
+                    pages.append(error)
+
+        with self._condition:
+            self.batches += 1
+            self.queries += len(batch)
+            bucket = 1
+            while bucket < len(batch):
+                bucket *= 2
+            self._histogram[bucket] = self._histogram.get(bucket, 0) + 1
+            self._delays.extend(started - query.enqueued for query in batch)
+            self.failures += sum(isinstance(pages[rows[query.key]], Exception) for query in batch)
+        for query in batch:
+            page = pages[rows[query.key]]
+            if isinstance(page, Exception):
+                query.future.set_exception(page)
+            else:
+                # Copies, the caller adds image URLs to the cards
+                query.future.set_result([dict(anime) for anime in page])
+
+    def metrics(self):
+        with self._condition:
+            delays = sorted(delay * 1000 for delay in self._delays)
+            return {
+                'pending': len(self._queue),
+                'batches': self.batches,
+                'queries': self.queries,
+                'failures': self.failures,
+                'cancelled': self.cancelled,
+                'mean_batch_size': self.queries / self.batches if self.batches else 0.0,
+                'batch_size_histogram': {f"<={bucket}": count for bucket, count in sorted(self._histogram.items())},
+                'queue_delay_ms': {
+                    'p50': percentile(delays, 0.5),
+                    'p95': percentile(delays, 0.95),
+                    'p99': percentile(delays, 0.99),
+                    'max': delays[-1] if delays else 0.0
+                }
+            }
+
+
+_request_coalescer = None
+_request_coalescer_lock = threading.Lock()
+
+
+def get_request_coalescer():
+    global _request_coalescer
+    if _request_coalescer is None:
+        with _request_coalescer_lock:
+            if _request_coalescer is None:
+                _request_coalescer = RequestCoalescer(PredictPipeline().recommendRecords)
+    return _request_coalescer
@@ -0,0 +1,172 @@
+import sys
+
+from src.exception import CustomException
+from src.logger import logging
+
+
+class AnimeRepository:
+    '''
+        Data access for the Supabase tables used by the web app.
+        Lookups over several anime are in_() queries of up to chunk_size
+        values instead of one query per anime, which keeps the request URL
+        short, and selects that can return many rows are read in pages of
+        page_size rows (PostgREST caps the rows returned by one request).
+    '''
+    def __init__(self, client):
+        self.client = client
+
+    def _select_pages(self, build_query, page_size):
+        # build_query() returns a new ordered select, a query builder is not reused
+        rows = []
+        while True:
+            response = build_query().range(len(rows), len(rows) + page_size - 1).execute()
+            rows.extend(response.data)
+            if len(response.data) < page_size:
+                return rows
+
+    def _select_in(self, table, columns, column, values, chunk_size):
+        # Each chunk matches at most chunk_size rows of a unique column, below the row cap
+        rows = []
+        for start in range(0, len(values), chunk_size):
+            response = (
+                self.client.table(table)
+                .select(columns)
+                .in_(column, values[start:start + chunk_size])
+                .execute()
+            )
+            rows.extend(response.data)
+        return rows
+
+    def ping(self):
+        # One-row select, raises when the database cannot be reached
+        self.client.table("users").select("user_id").limit(1).execute()
+
+    def get_user(self, email, columns="user_id"):
+        try:
+            response = (
+                self.client.table("users")
+                .select(columns)
+                .eq("email", email)
+                .execute()
+            )
+            return response.data[0] if len(response.data) > 0 else None
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_user_id(self, email):
+        user = self.get_user(email)
+        return user['user_id'] if user is not None else None
+
+    def create_user(self, name, email, password):
+        try:
+            return (
+                self.client.table("users")
+                .insert({"name": name, "email": email, "password": password})
+                .execute()
+            )
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_interaction_summary(self, user_id, page_size=1000):
+        '''
+            One paged query for what used to be two count="exact" queries plus
+            the viewed anime_id query. Returns (interaction_count, viewed_anime_ids),
+            the ids in interaction order.
+        '''
+        try:
+            interactions = self._select_pages(
+                lambda: (
+                    self.client.table("useranimeinteractions")
+                    .select("anime_id, interaction_type")
+                    .eq("user_id", user_id)
+                    .order("timestamp")
+                    .order("anime_id")
+                ),
+                page_size
+            )
+            viewed_anime_ids = [
+                interaction['anime_id'] for interaction in interactions
+                if interaction['interaction_type'] == 'view'
+            ]
+            return len(interactions), viewed_anime_ids
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_animes(self, anime_ids, columns="anime_id, anime_name, anime_genre", chunk_size=100):
+        try:
+            anime_ids = list(dict.fromkeys(anime_ids))
+            animes = self._select_in("animes", columns, "anime_id", anime_ids, chunk_size)
+            return {anime['anime_id']: anime for anime in animes}
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_user_ids(self, emails, chunk_size=100):
+        try:
+            emails = list(dict.fromkeys(emails))
+            users = self._select_in("users", "user_id, email", "email", emails, chunk_size)
+            return {user['email']: user['user_id'] for user in users}
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def upsert_animes(self, animes):
+        '''
+            Inserts the anime rows that are not in the table yet, keyed by anime_id.
+            Rows are grouped by column set so each group is one bulk request.
+        '''
+        try:
+            groups = {}
+            for anime in animes:
+                groups.setdefault(tuple(sorted(anime)), []).append(anime)
+            for rows in groups.values():
+                (
+                    self.client.table("animes")
+                    .upsert(rows, on_conflict="anime_id", ignore_duplicates=True)
+                    .execute()
+                )
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def insert_interactions(self, interactions):
+        try:
+            if len(interactions) == 0:
+                return None
+            return self.client.table("useranimeinteractions").insert(interactions).execute()
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_all_animes(self, columns="anime_id, anime_name, anime_genre", page_size=1000):
+        '''
+            Every row of the animes table, read in pages of page_size rows
+            (PostgREST caps the rows returned by a single request).
+        '''
+        try:
+            return self._select_pages(
+                lambda: self.client.table("animes").select(columns).order("anime_id"),
+                page_size
+            )
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def get_seen_anime_names(self, user_id, page_size=1000):
+        '''
+            Names of the anime the user has viewed, one entry per view: the
+            paged views, then their names in chunks of anime ids.
+        '''
+        try:
+            interactions = self._select_pages(
+                lambda: (
+                    self.client.table("useranimeinteractions")
+                    .select("anime_id")
+                    .eq("user_id", user_id)
+                    .eq("interaction_type", "view")
+                    .order("timestamp")
+                    .order("anime_id")
+                ),
+                page_size
+            )
+            anime_ids = [interaction['anime_id'] for interaction in interactions]
+            animes = self.get_animes(anime_ids, "anime_id, anime_name")
+            logging.info(f"Loaded {len(anime_ids)} seen animes for user {user_id}")
+            return [animes[anime_id]['anime_name'] for anime_id in anime_ids if anime_id in animes]
+        except Exception as e:
+            raise CustomException(e, sys)
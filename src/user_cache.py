@@ -0,0 +1,76 @@
+import threading
+import time
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class UserCacheConfig:
+    max_entries = 10000
+    # Bounds how long a user_id changed outside the app (row deleted and recreated) can be served
+    ttl = 10 * 60
+
+
+class UserIdCache:
+    '''
+        In-process LRU of email -> user_id.
+        Only existing users are cached, so a signup never has to wait for a
+        cached "unknown email" to expire; signup still invalidates the email
+        in case its row was recreated with a new user_id.
+    '''
+    def __init__(self, config=None):
+        self.cache_config = config or UserCacheConfig()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[email]
+            self.misses += 1
+            return None
+
+    def put(self, email, user_id):
+        if email is None or user_id is None:
+            return
+        with self._lock:
+            self._entries[email] = (user_id, time.monotonic() + self.cache_config.ttl)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.cache_config.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+_user_id_cache = None
+_user_id_cache_lock = threading.Lock()
+
+
+def get_user_id_cache():
+    global _user_id_cache
+    if _user_id_cache is None:
+        with _user_id_cache_lock:
+            if _user_id_cache is None:
+                _user_id_cache = UserIdCache()
+    return _user_id_cache
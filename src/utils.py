@@ -4,65 +4,104 @@ import sys
 import numpy as np
 import pandas
 import sklearn
-import nltk
-import torch
-import tensorflow
 import pickle
 import mysql.connector
 import requests
 import time
 import re
+import hashlib
 
 from supabase import create_client, Client
 from bs4 import BeautifulSoup
 from mysql.connector import Error
 from datetime import datetime
-from torch.nn import Embedding
+from functools import lru_cache
+from itertools import chain
 from sklearn.preprocessing import MultiLabelBinarizer
-from tensorflow.keras.preprocessing.text import one_hot
-from tensorflow.keras.utils import pad_sequences
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from src.exception import CustomException
 from src.logger import logging
 
+_STOPWORDS = None
+_LEMMATIZER = None
+ANILIST_URL = 'https://graphql.anilist.co'
+MYANIMELIST_URL = 'https://myanimelist.net'
+# Same filter characters as keras.preprocessing.text.one_hot
+ONE_HOT_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+_ONE_HOT_TABLE = str.maketrans({c: ' ' for c in ONE_HOT_FILTERS})
 
-def generateEmbeddings(train_data):
+
+def generateEmbeddingWeights(vocab_size=500, embedding_dim=100, seed=42):
+    try:
+        # Same N(0, 1) initialisation as torch.nn.Embedding, but reproducible from the seed
+        rng = np.random.default_rng(seed)
+        return rng.standard_normal((vocab_size, embedding_dim)).astype(np.float32)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def generateEmbeddings(train_data, weights, max_length=None):
     try:
         train_corpus = generateCorpus(train_data)
-        train_one_hot = generateOneHot(train_corpus)
-        train_tokens = generateTokens(train_corpus)
-        train_padding = generatePadding(train_tokens, train_one_hot)
-        
-        train_padding = torch.LongTensor(train_padding)
-        
-        embedding_layer = Embedding(num_embeddings=500, embedding_dim=100)
-    
+        return embedCorpus(train_corpus, weights, max_length)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def embedCorpus(corpus, weights, max_length=None, out=None, block_size=4096):
+    try:
+        train_one_hot = generateOneHot(corpus, vocab_size=weights.shape[0])
+        train_tokens = generateTokens(corpus)
+        train_padding = np.asarray(generatePadding(train_tokens, train_one_hot, max_length=max_length), dtype=np.int64)
         
-        with torch.no_grad():
-            train_embedding = embedding_layer(train_padding)
-        return train_embedding.mean(dim=1)
-    
+        # Mean of the embedding rows over the padded sequence, as the torch layer did.
+        # Rows are gathered block_size at a time so the (rows, max_length, dim)
+        # intermediate stays small, and written into out when one is given
+        if out is None:
+            out = np.empty((len(train_padding), weights.shape[1]), dtype=np.float32)
+        for start in range(0, len(train_padding), block_size):
+            out[start:start + block_size] = weights[train_padding[start:start + block_size]].mean(axis=1, dtype=np.float32)
+        return out
     except Exception as e:
         raise CustomException(e, sys)
     
+def getStopwords():
+    global _STOPWORDS
+    if _STOPWORDS is None:
+        # nltk is imported lazily, it is slow to import and only needed once a title is embedded
+        from nltk.corpus import stopwords
+        _STOPWORDS = frozenset(stopwords.words("english"))
+    return _STOPWORDS
+
+def getLemmatizer():
+    global _LEMMATIZER
+    if _LEMMATIZER is None:
+        from nltk.stem import WordNetLemmatizer
+        _LEMMATIZER = WordNetLemmatizer()
+    return _LEMMATIZER
+
+@lru_cache(maxsize=65536)
+def lemmatizeToken(word):
+    return getLemmatizer().lemmatize(word)
+
+def normalizeTitles(titles):
+    try:
+        stop_words = getStopwords()
+        # str() first so missing titles become 'nan'/'None' exactly as before
+        split_titles = pandas.Series([str(title) for title in titles], dtype=object).str.lower().str.split(" ")
+        return [
+            ' '.join(lemmatizeToken(word) for word in words if word not in stop_words)
+            for words in split_titles
+        ]
+    except Exception as e:
+        raise CustomException(e, sys)
+
 def generateCorpus(df):
     try:
-        corpus = []
-        lemmatizer = WordNetLemmatizer()
-        
-        for i in range(df.shape[0]):
-            data = str(df['englishTitle'][i]).lower()
-            data = data.split(" ")
-            data = [word for word in data if word not in stopwords.words("english")]
-            data = [lemmatizer.lemmatize(word) for word in data]
-            corpus.append(' '.join(data))
-        return corpus
+        return normalizeTitles(df['englishTitle'])
     except Exception as e:
         raise CustomException(e, sys)
     
 def generateTokens(corpus):
     try:
+        import nltk
         word_tokens = []
         for word in corpus:
             word_tokens.append(nltk.word_tokenize(word))
@@ -70,19 +109,62 @@ def generateTokens(corpus):
     except Exception as e:
         raise CustomException(e, sys)
 
-def generateOneHot(corpus):
+def parseGenres(value):
+    '''
+        Genre labels of a catalog row. Accepts a list, the stringified list
+        stored in raw.csv ("['Action', 'Comedy']") or a comma separated string.
+    '''
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(genre).strip() for genre in value if genre is not None and str(genre).strip()]
+    genres = (genre.strip(" '\"[]") for genre in str(value).split(','))
+    return [genre for genre in genres if genre]
+
+def textToWordSequence(text):
+    return [word for word in text.lower().translate(_ONE_HOT_TABLE).split(' ') if word]
+
+@lru_cache(maxsize=65536)
+def hashWord(word, vocab_size):
+    # md5 instead of the builtin hash(), which is salted per process and would
+    # give every worker a different index for the same word
+    return int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % (vocab_size - 1) + 1
+
+def generateOneHot(corpus, vocab_size=500):
     try:
-        vocab_size = 500
-        return [one_hot(word, vocab_size) for word in corpus]
+        return [[hashWord(word, vocab_size) for word in textToWordSequence(text)] for text in corpus]
     except Exception as e:
         raise CustomException(e, sys)
 
-def generatePadding(tokens, one_hot_repr):
+def generateMaxLength(tokens):
     try:
         max_length = 0
         for token in tokens:
             max_length = max(max_length, len(token))
-        return pad_sequences(one_hot_repr, maxlen=max_length, padding='pre')
+        return max_length
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def generatePadding(tokens, one_hot_repr, max_length=None):
+    try:
+        if max_length is None:
+            max_length = generateMaxLength(tokens)
+        
+        # Pre-padding and pre-truncation, same layout as keras pad_sequences(padding='pre')
+        padded = np.zeros((len(one_hot_repr), max_length), dtype=np.int32)
+        if max_length == 0 or len(one_hot_repr) == 0:
+            return padded
+        lengths = np.fromiter((min(len(seq), max_length) for seq in one_hot_repr), dtype=np.int64, count=len(one_hot_repr))
+        values = np.fromiter(
+            chain.from_iterable(seq[len(seq) - length:] for seq, length in zip(one_hot_repr, lengths)),
+            dtype=np.int32,
+            count=int(lengths.sum())
+        )
+        rows = np.repeat(np.arange(len(one_hot_repr)), lengths)
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cols = np.repeat(max_length - lengths, lengths) + np.arange(len(values)) - starts
+        padded[rows, cols] = values
+        return padded
     except Exception as e:
         raise CustomException(e, sys)
     
@@ -91,8 +173,11 @@ def save_object(file_path, obj):
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
         
-        with open(file_path, 'wb') as f:
+        # Write to a temporary file and rename it so readers never see a partial pickle
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
             pickle.dump(obj, f)
+        os.replace(tmp_path, file_path)
     except Exception as e:
         raise CustomException(e, sys)
 
@@ -104,25 +189,142 @@ def load_object(file_path):
     except Exception as e:
         raise CustomException(e, sys)
 
-def get_anime_image_url(anime_title):
+def save_array(file_path, array):
+    '''
+        Writes array as a raw .npy file, which load_array maps read-only so
+        every worker process shares the same pages of the OS page cache.
+    '''
+    try:
+        dir_path = os.path.dirname(file_path)
+        os.makedirs(dir_path, exist_ok=True)
+        
+        # A reader that already mapped the previous file keeps its inode after the rename
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def load_array(file_path, mmap_mode='r'):
+    try:
+        return np.load(file_path, mmap_mode=mmap_mode)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def array_digest(arrays, block_size=1 << 24):
+    '''
+        sha256 of the raw bytes of arrays, read block by block so memory-mapped
+        arrays are hashed without loading them whole.
+    '''
+    digest = hashlib.sha256()
+    for array in arrays:
+        flat = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        for start in range(0, len(flat), block_size):
+            digest.update(flat[start:start + block_size].tobytes())
+    return digest.hexdigest()
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ArrayWriter:
+    '''
+        Fills a .npy file of known shape block by block with plain file writes,
+        so neither the array nor its pages stay in the process memory. The
+        file is written under a temporary name and renamed over file_path by
+        close(), once every row has been written.
+    '''
+    def __init__(self, file_path, shape, dtype):
+        try:
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            self.file_path = file_path
+            self.tmp_path = f"{file_path}.tmp"
+            self.shape = tuple(shape)
+            self.dtype = np.dtype(dtype)
+            self.row_size = self.dtype.itemsize * int(np.prod(self.shape[1:]))
+            self.file = open(self.tmp_path, 'wb+')
+            np.lib.format.write_array_header_1_0(self.file, {
+                'descr': np.lib.format.dtype_to_descr(self.dtype),
+                'fortran_order': False,
+                'shape': self.shape
+            })
+            self.offset = self.file.tell()
+            self.file.truncate(self.offset + self.shape[0] * self.row_size)
+            self.position = 0
+        except Exception as e:
+            raise CustomException(e, sys)
+
+    def write(self, block):
+        self.write_at(self.position, block)
+        self.position += len(block)
+
+    def write_at(self, position, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if position + len(block) > self.shape[0]:
+            raise ValueError(f"{self.file_path}: writing rows {position}:{position + len(block)} past {self.shape[0]}")
+        self.file.seek(self.offset + position * self.row_size)
+        self.file.write(block.tobytes())
+
+    def close(self):
+        try:
+            if self.position != self.shape[0]:
+                raise ValueError(f"{self.file_path}: {self.position} rows written, {self.shape[0]} expected")
+            self.file.close()
+            os.replace(self.tmp_path, self.file_path)
+        except Exception as e:
+            raise CustomException(e, sys)
+
+def save_embedding(file_path, weights, max_length):
+    try:
+        dir_path = os.path.dirname(file_path)
+        os.makedirs(dir_path, exist_ok=True)
+        
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, weights=weights.astype(np.float32), max_length=np.int64(max_length))
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def load_embedding(file_path):
+    try:
+        with np.load(file_path) as data:
+            return {
+                'weights': data['weights'],
+                'max_length': int(data['max_length'])
+            }
+    except Exception as e:
+        raise CustomException(e, sys)
+
+def get_anime_image_url(anime_title, session=None, raise_errors=False):
     """
     Scrape high-quality anime image from MyAnimeList
     Returns the highest quality image URL available
+    Pass a requests.Session to reuse pooled connections
+    With raise_errors, a timeout, connection error, 429 or 5xx raises instead
+    of returning None, so callers can tell a failed scrape from a miss
     """
     try:
+        http = session or requests
         # Format search query
         search_query = anime_title.replace(" ", "%20")
-        search_url = f"https://myanimelist.net/anime.php?q={search_query}&cat=anime"
+        search_url = f"{MYANIMELIST_URL}/anime.php?q={search_query}&cat=anime"
         
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         }
         
         # Get search results page
-        response = requests.get(search_url, headers=headers, timeout=10)
+        response = http.get(search_url, headers=headers, timeout=10)
         
         if response.status_code != 200:
             print(f"Search failed: {response.status_code}")
+            if raise_errors and (response.status_code == 429 or response.status_code >= 500):
+                response.raise_for_status()
             return None
         
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -147,10 +349,12 @@ def get_anime_image_url(anime_title):
         time.sleep(0.5)
         
         # Visit the actual anime page to get high-quality image
-        anime_response = requests.get(anime_url, headers=headers, timeout=10)
+        anime_response = http.get(anime_url, headers=headers, timeout=10)
         
         if anime_response.status_code != 200:
             print(f"Failed to load anime page: {anime_response.status_code}")
+            if raise_errors and (anime_response.status_code == 429 or anime_response.status_code >= 500):
+                anime_response.raise_for_status()
             return None
         
         anime_soup = BeautifulSoup(anime_response.text, 'html.parser')
@@ -189,21 +393,27 @@ def get_anime_image_url(anime_title):
         
     except requests.exceptions.Timeout:
         print(f"Request timed out for: {anime_title}")
+        if raise_errors:
+            raise
         return None
     except requests.exceptions.RequestException as e:
         print(f"Request error for {anime_title}: {e}")
+        if raise_errors:
+            raise
         return None
     except Exception as e:
         print(f"Unexpected error for {anime_title}: {e}")
         return None
 
 
-def get_anime_image_url_alternative(anime_title):
+def get_anime_image_url_alternative(anime_title, session=None):
     """
     Alternative method using AniList GraphQL API
     This provides very high quality images and is more reliable
+    Pass a requests.Session to reuse pooled connections
     """
     try:
+        http = session or requests
         query = '''
         query ($search: String) {
             Media(search: $search, type: ANIME) {
@@ -224,9 +434,9 @@ def get_anime_image_url_alternative(anime_title):
             'search': anime_title
         }
         
-        url = 'https://graphql.anilist.co'
+        url = ANILIST_URL
         
-        response = requests.post(
+        response = http.post(
             url, 
             json={'query': query, 'variables': variables},
             timeout=10
@@ -247,6 +457,70 @@ def get_anime_image_url_alternative(anime_title):
         return None
 
 
+def get_anime_image_urls_alternative(anime_titles, session=None):
+    """
+    Batch variant of get_anime_image_url_alternative
+    Looks up all titles in one AniList request, one aliased Media field per title
+    Returns a dict title -> image URL (None when AniList has no match)
+    Titles whose lookup failed (rate limit, server error, timeout) are left out,
+    so callers can tell them from misses and ask again later
+    """
+    anime_titles = list(dict.fromkeys(anime_titles))
+    results = {}
+    if not anime_titles:
+        return results
+    try:
+        http = session or requests
+        variables = {f's{i}': title for i, title in enumerate(anime_titles)}
+        declarations = ', '.join(f'${name}: String' for name in variables)
+        fields = '\n'.join(
+            f'a{i}: Media(search: $s{i}, type: ANIME) {{ id coverImage {{ extraLarge large }} }}'
+            for i in range(len(anime_titles))
+        )
+        query = f'query ({declarations}) {{\n{fields}\n}}'
+        
+        response = http.post(
+            ANILIST_URL,
+            json={'query': query, 'variables': variables},
+            timeout=10
+        )
+        
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f"AniList batch failed: {response.status_code}")
+            return results
+        
+        # A title without a match comes back as a null alias (AniList may answer 404 for it),
+        # so read whatever data the response carries instead of relying on the status code
+        try:
+            body = response.json()
+        except ValueError:
+            print(f"AniList batch failed: {response.status_code}")
+            return results
+        data = body.get('data')
+        if not data:
+            print(f"AniList batch failed: {response.status_code} {body.get('errors')}")
+            return results
+        
+        # Only a "not found" error makes a null alias a miss, any other error is a failure
+        failed = {
+            error['path'][0] for error in body.get('errors') or []
+            if error.get('status') != 404 and error.get('path')
+        }
+        for i, title in enumerate(anime_titles):
+            alias = f'a{i}'
+            if alias not in data or alias in failed:
+                continue
+            media = data[alias]
+            results[title] = None
+            if media and media.get('coverImage'):
+                results[title] = media['coverImage'].get('extraLarge') or media['coverImage'].get('large')
+        return results
+        
+    except Exception as e:
+        print(f"AniList batch API error for {len(anime_titles)} titles: {e}")
+        return results
+
+
 def get_anime_image_url_hybrid(anime_title):
     """
     Hybrid approach: Try AniList first (better quality), fallback to MAL
@@ -0,0 +1,212 @@
+import json
+import threading
+import time
+import types
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+from src.image_cache import ImageCache, ImageCacheConfig
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    '''
+        The chain of PostgREST builder calls the repository makes, evaluated
+        over in-memory rows. Like PostgREST, one request returns at most
+        max_rows rows.
+    '''
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.columns = None
+        self.filters = []
+        self.order_by = []
+        self.rows = None
+        self.count = None
+        self.written = None
+        self.on_conflict = None
+
+    def select(self, columns):
+        self.columns = [column.strip() for column in columns.split(',')]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        self.client.in_sizes.append(len(values))
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column):
+        self.order_by.append(column)
+        return self
+
+    def range(self, start, end):
+        self.rows = (start, end)
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.written = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self.written = list(rows)
+        self.on_conflict = on_conflict
+        return self
+
+    def execute(self):
+        self.client.requests += 1
+        if not self.client.up:
+            raise ConnectionError("Database unreachable")
+        table = self.client.tables.setdefault(self.table, [])
+        if self.written is not None:
+            if self.client.reject is not None:
+                self.client.reject(self.table, self.written)
+            # upsert(ignore_duplicates=True): rows whose key is taken are left untouched
+            taken = {row.get(self.on_conflict) for row in table} if self.on_conflict else set()
+            table.extend(row for row in self.written if not self.on_conflict or row.get(self.on_conflict) not in taken)
+            return FakeResponse(self.written)
+        rows = [row for row in table if all(f(row) for f in self.filters)]
+        if self.order_by:
+            rows.sort(key=lambda row: tuple(row[column] for column in self.order_by))
+        if self.rows is not None:
+            rows = rows[self.rows[0]:self.rows[1] + 1]
+        rows = rows[:min(self.client.max_rows, self.count if self.count is not None else self.client.max_rows)]
+        return FakeResponse([{column: row.get(column) for column in self.columns} for row in rows])
+
+
+class FakeClient:
+    '''
+        In-memory Supabase client: tables maps a table name to its rows.
+        Every request fails with ConnectionError while up is False, and
+        reject(table, rows), when set, may raise to refuse a write.
+    '''
+    def __init__(self, tables=None, max_rows=1000):
+        self.tables = tables if tables is not None else {}
+        self.max_rows = max_rows
+        self.up = True
+        self.reject = None
+        self.requests = 0
+        self.in_sizes = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class StubHosts:
+    '''
+        Stand-in for AniList (POST /anilist, GraphQL) and MyAnimeList
+        (GET /mal/anime.php search, GET /mal/anime/<title> page) on one local
+        HTTP server. Records every request and the peak number of requests
+        in flight per host.
+    '''
+    def __init__(self):
+        # title -> cover URL, titles a host does not know have no match there
+        self.covers = {'anilist': {}, 'myanimelist': {}}
+        self.delay = {'anilist': 0.0, 'myanimelist': 0.0}
+        self.status = {'anilist': 200, 'myanimelist': 200}
+        self.requests = {'anilist': [], 'myanimelist': []}
+        self.active = {'anilist': 0, 'myanimelist': 0}
+        self.max_active = {'anilist': 0, 'myanimelist': 0}
+        self.lock = threading.Lock()
+        self.base_url = None
+
+    def enter(self, host, request):
+        with self.lock:
+            self.requests[host].append(request)
+            self.active[host] += 1
+            self.max_active[host] = max(self.max_active[host], self.active[host])
+
+    def leave(self, host):
+        with self.lock:
+            self.active[host] -= 1
+
+    def anilist_body(self, variables):
+        data, errors = {}, []
+        for name, title in variables.items():
+            alias = f"a{name[1:]}"
+            url = self.covers['anilist'].get(title)
+            data[alias] = {'id': 1, 'coverImage': {'extraLarge': url, 'large': url}} if url else None
+            if url is None:
+                errors.append({'message': 'Not Found.', 'status': 404, 'path': [alias]})
+        return {'data': data, 'errors': errors} if errors else {'data': data}
+
+
+def make_handler(hosts):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body, content_type):
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            hosts.enter('anilist', request)
+            try:
+                time.sleep(hosts.delay['anilist'])
+                if hosts.status['anilist'] != 200:
+                    body = {'data': None, 'errors': [{'message': 'Too Many Requests.', 'status': hosts.status['anilist']}]}
+                    return self.reply(hosts.status['anilist'], json.dumps(body), 'application/json')
+                self.reply(200, json.dumps(hosts.anilist_body(request['variables'])), 'application/json')
+            finally:
+                hosts.leave('anilist')
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            hosts.enter('myanimelist', url.path)
+            try:
+                time.sleep(hosts.delay['myanimelist'])
+                if hosts.status['myanimelist'] != 200:
+                    return self.reply(hosts.status['myanimelist'], '', 'text/html')
+                if url.path == '/mal/anime.php':
+                    title = parse_qs(url.query)['q'][0]
+                    found = title in hosts.covers['myanimelist']
+                    link = f'<a class="hoverinfo_trigger" href="{hosts.base_url}/mal/anime/{quote(title)}">{title}</a>'
+                    return self.reply(200, link if found else '<p>No results</p>', 'text/html')
+                title = unquote(url.path.rsplit('/', 1)[-1])
+                self.reply(200, f'<img itemprop="image" data-src="{hosts.covers["myanimelist"][title]}">', 'text/html')
+            finally:
+                hosts.leave('myanimelist')
+
+    return Handler
+
+
+@pytest.fixture
+def stub_hosts(monkeypatch):
+    hosts = StubHosts()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(hosts))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    hosts.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr('src.utils.ANILIST_URL', f"{hosts.base_url}/anilist")
+    monkeypatch.setattr('src.utils.MYANIMELIST_URL', f"{hosts.base_url}/mal")
+    # The scraper pauses between its two MyAnimeList requests
+    monkeypatch.setattr('src.utils.time', types.SimpleNamespace(sleep=lambda seconds: None))
+    yield hosts
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def image_cache(tmp_path):
+    config = ImageCacheConfig()
+    config.cache_file_path = str(tmp_path / 'image_cache.sqlite')
+    return ImageCache(config)
@@ -0,0 +1,92 @@
+import os
+import json
+import pytest
+import requests
+
+from src.image_cache import BulkImageResolver
+from src.utils import get_anime_image_urls_alternative
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'anilist')
+
+
+class RecordedResponse:
+    def __init__(self, status, body=None, text=None):
+        self.status_code = status
+        self.body = body
+        self.text = text if text is not None else json.dumps(body)
+
+    def json(self):
+        if self.body is None:
+            raise ValueError("No JSON body")
+        return self.body
+
+
+class RecordedSession:
+    '''
+        Replays one AniList exchange from tests/fixtures/anilist/<name>.json:
+        the request variables it expects, the status and the JSON body (or
+        raw text) of the answer. A fixture is recorded by saving these three
+        from a real call.
+    '''
+    def __init__(self, name):
+        with open(os.path.join(FIXTURES, f"{name}.json"), 'r', encoding='utf-8') as f:
+            self.fixture = json.load(f)
+        self.calls = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        assert json['variables'] == self.fixture['request']['variables']
+        return RecordedResponse(self.fixture['status'], self.fixture.get('body'), self.fixture.get('text'))
+
+
+class TimeoutSession:
+    def post(self, url, json=None, timeout=None):
+        raise requests.exceptions.ReadTimeout("Read timed out")
+
+
+def test_aliases_map_back_to_titles():
+    session = RecordedSession('batch_not_found')
+    results = get_anime_image_urls_alternative(['Cowboy Bebop', 'Not An Anime At All', 'Mushishi', 'Cowboy Bebop'], session=session)
+
+    assert session.calls == 1
+    assert results == {
+        'Cowboy Bebop': 'https://s4.anilist.co/file/anilistcdn/media/anime/cover/large/bx1-CXtrrkMpJ8Zq.png',
+        # A 404 alias is a miss
+        'Not An Anime At All': None,
+        'Mushishi': 'https://s4.anilist.co/file/anilistcdn/media/anime/cover/medium/bx457-DbG5ZWbUPTWc.jpg'
+    }
+
+
+@pytest.mark.parametrize('name', ['rate_limited', 'server_error'])
+def test_failed_batch_leaves_every_title_out(name):
+    assert get_anime_image_urls_alternative(['Cowboy Bebop', 'Mushishi'], session=RecordedSession(name)) == {}
+
+
+def test_timeout_leaves_every_title_out():
+    assert get_anime_image_urls_alternative(['Cowboy Bebop', 'Mushishi'], session=TimeoutSession()) == {}
+
+
+def test_alias_error_is_not_a_miss():
+    results = get_anime_image_urls_alternative(['Cowboy Bebop', 'Mushishi'], session=RecordedSession('partial_error'))
+
+    assert results == {'Cowboy Bebop': 'https://s4.anilist.co/file/anilistcdn/media/anime/cover/large/bx1-CXtrrkMpJ8Zq.png'}
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_failed_lookups_are_neither_scraped_nor_cached(stub_hosts, image_cache, status):
+    stub_hosts.status['anilist'] = status
+    stub_hosts.covers['myanimelist'] = {'Cowboy Bebop': 'https://myanimelist/1.jpg'}
+    resolver = BulkImageResolver(image_cache)
+
+    assert resolver.resolve(['Cowboy Bebop', 'Mushishi'], deadline=5) == {'Cowboy Bebop': None, 'Mushishi': None}
+    assert stub_hosts.requests['myanimelist'] == []
+    assert image_cache.lookup('Cowboy Bebop') == (False, None)
+
+    # Once AniList answers again the titles are looked up as usual
+    stub_hosts.status['anilist'] = 200
+    stub_hosts.covers['anilist'] = {'Mushishi': 'https://anilist/457.jpg'}
+    assert resolver.resolve(['Cowboy Bebop', 'Mushishi'], deadline=5) == {
+        'Cowboy Bebop': 'https://myanimelist/1.jpg',
+        'Mushishi': 'https://anilist/457.jpg'
+    }
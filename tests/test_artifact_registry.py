@@ -0,0 +1,113 @@
+import json
+import os
+import numpy as np
+import pytest
+
+from src.components.artifact_bundle import (
+    BUNDLE_MANIFEST, load_component, read_json, save_encoder_components, save_index_component, update_manifest
+)
+from src.components.model_index import ExactIndex
+from src.components.query_encoder import QueryEncoder
+from src.pipeline.artifact_registry import ArtifactRegistry, check_artifacts
+from src.utils import file_digest
+
+
+N_ROWS = 6
+
+
+def make_encoder(embedding_dim=4):
+    weights = np.random.default_rng(0).normal(size=(20, embedding_dim)).astype(np.float32)
+    numeric = {'rating': (7.0, 7.0, 1.0), 'episodes': (12.0, 12.0, 4.0)}
+    return QueryEncoder(weights, 5, ['Action', 'Drama'], numeric, 'TV', ['Movie', 'TV'])
+
+
+def save_model(bundle_dir, n_features, seed=1):
+    matrix = np.random.default_rng(seed).normal(size=(N_ROWS, n_features))
+    save_index_component(bundle_dir, ExactIndex().fit(matrix))
+
+
+def save_catalog(catalog_path, titles):
+    with open(catalog_path, 'w') as f:
+        json.dump(titles, f)
+
+
+def save_run(bundle_dir, catalog_path, titles, seed=1):
+    # Training order: catalog, encoder with the catalog digest, model
+    save_catalog(catalog_path, titles)
+    encoder = make_encoder()
+    save_encoder_components(bundle_dir, encoder, {'catalog': file_digest(catalog_path)})
+    save_model(bundle_dir, encoder.n_features, seed=seed)
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    bundle_dir = str(tmp_path / 'bundle')
+    catalog_path = str(tmp_path / 'catalog.json')
+    save_run(bundle_dir, catalog_path, list(range(N_ROWS)))
+    registry = (
+        ArtifactRegistry()
+        .register('catalog', catalog_path, read_json)
+        .register('model', os.path.join(bundle_dir, 'model.json'), load_component)
+        .register('query_encoder', os.path.join(bundle_dir, 'query_encoder.json'), load_component)
+        .register('manifest', os.path.join(bundle_dir, BUNDLE_MANIFEST), read_json, optional=True)
+        .validate(check_artifacts)
+    )
+    registry.registry_config.check_interval = 0.0
+    return bundle_dir, catalog_path, registry
+
+
+def test_consistent_bundle_loads(bundle):
+    bundle_dir, catalog_path, registry = bundle
+    snapshot = registry.get()
+    assert snapshot['model'].matrix.shape == (N_ROWS, make_encoder().n_features)
+    assert snapshot['manifest']['feature_layout']['n_features'] == snapshot['query_encoder'].n_features
+
+
+def test_feature_layout_mismatch_keeps_previous_snapshot(bundle):
+    bundle_dir, catalog_path, registry = bundle
+    previous = registry.get()
+    layout = dict(previous['manifest']['feature_layout'], n_features=3)
+    update_manifest(bundle_dir, feature_layout=layout)
+
+    assert registry.get() is previous
+    with pytest.raises(ValueError, match='Feature layout has 3 features'):
+        registry._build(previous)
+
+
+def test_component_written_after_manifest_is_rejected(bundle):
+    bundle_dir, catalog_path, registry = bundle
+    previous = registry.get()
+    manifest_path = os.path.join(bundle_dir, BUNDLE_MANIFEST)
+    with open(manifest_path, 'rb') as f:
+        manifest = f.read()
+    # A snapshot built between the model component and the manifest of a new run
+    save_model(bundle_dir, make_encoder().n_features, seed=2)
+    with open(manifest_path, 'wb') as f:
+        f.write(manifest)
+
+    assert registry.get() is previous
+    with pytest.raises(ValueError, match='model.json does not match the manifest'):
+        registry._build(previous)
+
+
+def test_retrain_of_the_same_size_waits_for_its_model(bundle):
+    bundle_dir, catalog_path, registry = bundle
+    previous = registry.get()
+    retrained = [f"title {row}" for row in range(N_ROWS)]
+
+    # New catalog, encoder still from the previous run
+    save_catalog(catalog_path, retrained)
+    assert registry.get() is previous
+    with pytest.raises(ValueError, match='Artifact catalog is not the one'):
+        registry._build(previous)
+
+    # New catalog and encoder, model still from the previous run
+    save_encoder_components(bundle_dir, make_encoder(), {'catalog': file_digest(catalog_path)})
+    assert registry.get() is previous
+    with pytest.raises(ValueError, match='model.json does not match the manifest'):
+        registry._build(previous)
+
+    save_model(bundle_dir, make_encoder().n_features, seed=2)
+    snapshot = registry.get()
+    assert snapshot is not previous
+    assert snapshot['catalog'] == retrained
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.components.catalog_store import CatalogStore, load_catalog_store, save_catalog_store
+from src.exception import CustomException
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'id': [10, np.nan, 30, 40],
+        'englishTitle': ['Attack on Titan', 'Spirited Away', 'Death Note', 'Mushishi'],
+        'type': ['TV', 'Movie', None, 'TV'],
+        'rating': [8.5, 8.9, np.nan, '7.1'],
+        'episodes': [25, 1, 37, None],
+        'genre': ["['Action']", "['Drama']", None, "['Mystery']"],
+    })
+
+
+def test_saved_store_is_memory_mapped(frame, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    catalog_store = CatalogStore.from_frame(frame)
+    save_catalog_store(manifest_path, catalog_store)
+    loaded = load_catalog_store(manifest_path)
+
+    assert len(loaded) == len(frame)
+    for name, column in catalog_store.columns.items():
+        assert isinstance(loaded[name], np.memmap)
+        # Fixed-width unicode and numbers, nothing pickled
+        assert loaded[name].dtype.kind in 'Uifb'
+        np.testing.assert_array_equal(loaded[name], column)
+
+
+def test_column_of_another_run_is_rejected(frame, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    save_catalog_store(manifest_path, CatalogStore.from_frame(frame))
+    np.save(str(tmp_path / 'rating.npy'), np.zeros(len(frame) + 1))
+
+    with pytest.raises(CustomException, match='Catalog column rating has 5 rows'):
+        load_catalog_store(manifest_path)
+
+
+def test_untitled_rows_are_refused(frame):
+    frame.loc[2, 'englishTitle'] = None
+    with pytest.raises(ValueError, match='needs an englishTitle'):
+        CatalogStore.from_frame(frame)
+
+
+def test_gather_returns_cards_in_index_order(frame):
+    cards = CatalogStore.from_frame(frame).gather([3, 1, 2, 0], limit=3)
+
+    assert cards == [
+        {'id': 40, 'englishTitle': 'Mushishi', 'type': 'TV', 'rating': 7.1, 'episodes': 'N/A', 'genre': "['Mystery']"},
+        {'id': 'N/A', 'englishTitle': 'Spirited Away', 'type': 'Movie', 'rating': 8.9, 'episodes': 1.0, 'genre': "['Drama']"},
+        {'id': 30, 'englishTitle': 'Death Note', 'type': 'Unknown', 'rating': 'N/A', 'episodes': 37.0, 'genre': '[]'},
+    ]
+    # Plain Python values, the page is serialized to JSON
+    assert all(type(card['id']) in (int, str) and type(card['englishTitle']) is str for card in cards)
+
+
+def test_gather_from_disk_and_after_append(frame, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    catalog_store = CatalogStore.from_frame(frame)
+    save_catalog_store(manifest_path, catalog_store)
+    loaded = load_catalog_store(manifest_path)
+    assert loaded.gather([2, 0, 1]) == catalog_store.gather([2, 0, 1])
+    assert loaded.gather([]) == []
+
+    added = CatalogStore.from_frame(pd.DataFrame({'id': [50], 'englishTitle': ['Planetes'], 'rating': [8.3]}))
+    appended = loaded.append(added)
+    assert len(appended) == len(frame) + 1
+    assert appended.gather([4, 0]) == added.gather([0]) + catalog_store.gather([0])
@@ -0,0 +1,83 @@
+import threading
+import pytest
+
+from conftest import FakeClient
+from src.connection_pool import ConnectionPoolConfig, SupabaseClientPool
+from src.exception import CustomException
+
+
+@pytest.fixture
+def pool():
+    config = ConnectionPoolConfig()
+    config.max_size = 2
+    config.acquire_timeout = 0.1
+    clients = []
+
+    def factory():
+        clients.append(FakeClient({'users': [{'user_id': 1}]}))
+        return clients[-1]
+
+    pool = SupabaseClientPool(factory, config)
+    pool.clients = clients
+    return pool
+
+
+def test_healthy_client_is_reused_without_a_check(pool):
+    client = pool.acquire()
+    pool.release(client)
+    assert pool.acquire() is client
+    assert client.requests == 0
+    assert pool.metrics()['reused'] == 1
+
+
+def test_client_released_unhealthy_is_checked_before_reuse(pool):
+    client = pool.acquire()
+    pool.release(client, healthy=False)
+    assert pool.acquire() is client
+    # One ping of the users table
+    assert client.requests == 1
+    assert pool.metrics()['discarded'] == 0
+
+
+def test_client_failing_its_check_is_replaced(pool):
+    client = pool.acquire()
+    client.up = False
+    pool.release(client, healthy=False)
+
+    replacement = pool.acquire()
+    assert replacement is not client
+    assert pool.clients == [client, replacement]
+    assert pool.metrics()['discarded'] == 1
+    # The discarded client gave its slot back, both slots can be taken
+    pool.release(replacement)
+    assert len({id(pool.acquire()), id(pool.acquire())}) == 2
+
+
+def test_idle_client_is_checked_after_the_interval(pool):
+    pool.pool_config.health_check_interval = 0
+    client = pool.acquire()
+    pool.release(client)
+    client.up = False
+    assert pool.acquire() is not client
+    assert pool.metrics()['discarded'] == 1
+
+
+def test_acquire_waits_for_a_free_slot(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(CustomException, match='No Supabase client available'):
+        pool.acquire()
+
+    pool.pool_config.acquire_timeout = 5
+    threading.Timer(0.05, pool.release, args=(held[0],)).start()
+    assert pool.acquire() is held[0]
+    assert len(pool.clients) == 2
+
+
+def test_failing_factory_releases_its_slot(pool):
+    def failing_factory():
+        raise ConnectionError("Supabase unreachable")
+
+    pool.factory = failing_factory
+    for _ in range(pool.pool_config.max_size + 1):
+        with pytest.raises(CustomException, match='Supabase unreachable'):
+            pool.acquire()
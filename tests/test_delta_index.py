@@ -0,0 +1,127 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.components.artifact_bundle import load_component, save_index_component
+from src.components.catalog_store import CatalogStore, load_catalog_store, save_catalog_store
+from src.components.genre_index import GenreIndex, load_genre_index, save_genre_index
+from src.components.model_index import ExactIndex
+from src.delta_index import DeltaIndex, DeltaIndexConfig
+from src.pipeline.artifact_registry import ArtifactRegistry, check_artifacts
+from src.utils import file_digest, load_array, save_array
+
+
+N_FEATURES = 8
+N_BASE = 5
+EMBEDDING_DIM = 3
+
+
+def encode(records, artifacts):
+    return np.random.default_rng(len(records)).normal(size=(len(records), N_FEATURES))
+
+
+def events(anime_ids):
+    return [
+        {'user_id': 1, 'interaction': {'interaction_type': 'view'}, 'anime': {'anime_id': anime_id, 'anime_name': f"New {anime_id}", 'anime_genre': "['Action']"}}
+        for anime_id in anime_ids
+    ]
+
+
+def save_base(config, n_rows):
+    frame = pd.DataFrame({
+        'id': list(range(1, n_rows + 1)),
+        'englishTitle': [f"Anime {row}" for row in range(n_rows)],
+        'genre': ["['Drama']"] * n_rows,
+    })
+    save_catalog_store(config.catalog_store_file_path, CatalogStore.from_frame(frame))
+    save_genre_index(config.genre_index_file_path, GenreIndex.from_labels([['Drama']] * n_rows))
+    save_array(config.catalog_embedding_file_path, np.random.default_rng(0).normal(size=(n_rows, EMBEDDING_DIM)).astype(np.float32))
+    save_index_component(config.bundle_dir, ExactIndex().fit(np.random.default_rng(0).normal(size=(n_rows, N_FEATURES))))
+
+
+def wait_for_compaction():
+    for thread in threading.enumerate():
+        if thread.name == 'delta-compaction':
+            thread.join()
+
+
+@pytest.fixture
+def delta(tmp_path):
+    config = DeltaIndexConfig()
+    config.log_path = str(tmp_path / 'delta' / 'items.jsonl')
+    config.bundle_dir = str(tmp_path / 'bundle')
+    config.catalog_store_file_path = str(tmp_path / 'catalog' / 'manifest.json')
+    config.genre_index_file_path = str(tmp_path / 'genre_index' / 'manifest.json')
+    config.catalog_embedding_file_path = str(tmp_path / 'catalog_embedding.npy')
+    config.compact_threshold = 3
+    save_base(config, N_BASE)
+    registry = (
+        ArtifactRegistry()
+        .register('catalog', config.catalog_store_file_path, load_catalog_store)
+        .register('model', os.path.join(config.bundle_dir, 'model.json'), load_component)
+        .register('genre_index', config.genre_index_file_path, load_genre_index, optional=True)
+        .register('catalog_embedding', config.catalog_embedding_file_path, load_array, optional=True, lazy=True)
+        .validate(check_artifacts)
+    )
+    registry.registry_config.check_interval = 0.0
+    return DeltaIndex(config, registry), registry
+
+
+def test_compaction_keeps_merged_items_in_the_log(delta):
+    delta_index, registry = delta
+    delta_index.add_events(events([101, 102, 103]))
+    before = registry.get()
+    assert len(delta_index.get(before, encode)) == 3
+    wait_for_compaction()
+    assert delta_index.compactions == 1
+
+    after = registry.get()
+    assert len(after['catalog']) == N_BASE + 3
+    # The title vectors of the merged rows are the first columns of their encoding
+    np.testing.assert_array_equal(after['catalog_embedding'][N_BASE:], encode([None] * 3, after)[:, :EMBEDDING_DIM].astype(np.float32))
+    assert len(delta_index.get(after, encode)) == 0
+    with open(delta_index.delta_config.log_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 3
+
+    # A retrain from raw.csv does not have them, they are delta rows again
+    save_base(delta_index.delta_config, N_BASE)
+    retrained = registry.get()
+    assert len(retrained['catalog']) == N_BASE
+    assert sorted(delta_index.get(retrained, encode).anime_ids) == ['101', '102', '103']
+
+
+def test_compaction_backs_off_after_an_attempt(delta, monkeypatch):
+    delta_index, registry = delta
+    delta_index.add_events(events([101, 102, 103]))
+    before = registry.get()
+    delta_index.get(before, encode)
+    wait_for_compaction()
+    attempts = []
+    monkeypatch.setattr(delta_index, '_compact', lambda *args: attempts.append(args))
+
+    # This worker's registry has not reloaded yet, its snapshot still holds the merged rows
+    for _ in range(3):
+        delta_index._last_check = 0.0
+        delta_index.get(before, encode)
+    wait_for_compaction()
+    assert attempts == []
+
+
+def test_compaction_skips_artifacts_replaced_on_disk(delta):
+    delta_index, registry = delta
+    delta_index.delta_config.compact_threshold = 100
+    delta_index.add_events(events([101, 102, 103]))
+    stale = registry.get()
+    snapshot = delta_index.get(stale, encode)
+    # The registry only looks at the files again after check_interval
+    registry.registry_config.check_interval = 3600.0
+
+    # Another worker compacted, or a retrain finished, after this snapshot was taken
+    save_base(delta_index.delta_config, N_BASE + 1)
+    replaced = file_digest(delta_index.delta_config.catalog_store_file_path)
+    delta_index._compact(stale, snapshot)
+
+    assert delta_index.compactions == 0
+    assert file_digest(delta_index.delta_config.catalog_store_file_path) == replaced
@@ -0,0 +1,81 @@
+import pytest
+
+from src.feed_builder import FeedBuilder, FeedBuilderConfig
+
+
+class NoArtifacts:
+    def get(self):
+        raise FileNotFoundError("No trained artifacts")
+
+
+class FakeRepository:
+    '''The animes table and the views of user 1, shared by every worker.'''
+    def __init__(self):
+        self.animes = [
+            {'anime_id': i, 'anime_name': f"Anime {i}", 'anime_genre': "['Action']" if i < 5 else "['Drama']"}
+            for i in range(10)
+        ]
+        self.views = [0]
+
+    def get_all_animes(self, columns):
+        return self.animes
+
+    def get_interaction_summary(self, user_id):
+        return len(self.views), list(self.views)
+
+    def get_animes(self, anime_ids, columns):
+        return {anime['anime_id']: anime for anime in self.animes if anime['anime_id'] in anime_ids}
+
+
+def view(anime_id):
+    return {'user_id': 1, 'anime': None, 'interaction': {'anime_id': anime_id, 'interaction_type': 'view'}}
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = FeedBuilderConfig()
+    config.store_file_path = str(tmp_path / 'feed_store.sqlite')
+    return config
+
+
+def test_every_worker_drops_a_viewed_anime_at_once(config):
+    repository = FakeRepository()
+    workers = [FeedBuilder(config, NoArtifacts()), FeedBuilder(config, NoArtifacts())]
+    for worker in workers:
+        assert 'Anime 1' in worker.get_feed(1, repository)
+    assert [worker.bootstraps for worker in workers] == [1, 0]
+
+    # The view is written by the first worker's interaction buffer
+    repository.views.append(1)
+    workers[0].apply_events([view(1)])
+
+    for worker in workers:
+        assert 'Anime 1' not in worker.get_feed(1, repository)
+    assert workers[1].hits == 2
+
+
+def test_feeds_survive_a_restart(config):
+    repository = FakeRepository()
+    FeedBuilder(config, NoArtifacts()).get_feed(1, repository)
+    repository.views.append(1)
+    FeedBuilder(config, NoArtifacts()).apply_events([view(1)])
+
+    restarted = FeedBuilder(config, NoArtifacts())
+    assert 'Anime 1' not in restarted.get_feed(1, repository)
+    assert restarted.bootstraps == 0
+
+
+def test_views_flushed_during_a_bootstrap_are_applied(config):
+    repository = FakeRepository()
+    worker, other = FeedBuilder(config, NoArtifacts()), FeedBuilder(config, NoArtifacts())
+    bootstrap = worker._bootstrap
+
+    def slow_bootstrap(user_id, repository):
+        user_feed = bootstrap(user_id, repository)
+        # Flushed by another worker after the views were read
+        other.apply_events([view(1)])
+        return user_feed
+
+    worker._bootstrap = slow_bootstrap
+    assert 'Anime 1' not in worker.get_feed(1, repository)
+    assert 'Anime 1' not in other.get_feed(1, repository)
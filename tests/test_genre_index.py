@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from src.components.genre_index import GenreIndex, load_genre_index, save_genre_index
+
+
+LABELS = [
+    ['Action', 'Drama'],
+    ['Comedy'],
+    [],
+    ['Action', 'Comedy', 'Drama'],
+    ['Drama'],
+    ['Action'],
+]
+
+
+def brute_force(labels, genres, mode):
+    test = all if mode == 'and' else any
+    return [row for row, row_genres in enumerate(labels) if genres and test(genre in row_genres for genre in genres)]
+
+
+@pytest.fixture
+def genre_index():
+    return GenreIndex.from_labels(LABELS)
+
+
+@pytest.mark.parametrize('genres', [
+    ['Action'], ['Action', 'Drama'], ['Drama', 'Action', 'Drama'], ['Action', 'Comedy', 'Drama'],
+    ['Comedy', 'Unknown'], ['Unknown'], [],
+])
+@pytest.mark.parametrize('mode', ['and', 'or'])
+def test_select_matches_brute_force(genre_index, genres, mode):
+    rows = genre_index.select(genres, mode=mode)
+    assert rows.dtype == np.int32
+    assert rows.tolist() == brute_force(LABELS, genres, mode)
+
+
+def test_select_rejects_an_unknown_mode(genre_index):
+    with pytest.raises(ValueError, match='Unknown genre selection mode'):
+        genre_index.select(['Action'], mode='xor')
+
+
+def test_extend_with_new_genres(genre_index):
+    added = [['Sports', 'Action'], [], ['Drama']]
+    extended = genre_index.extend(added)
+    labels = LABELS + added
+
+    assert extended.classes == ['Action', 'Comedy', 'Drama', 'Sports']
+    assert [sorted(extended.genres_of(row)) for row in range(extended.n_rows)] == [sorted(genres) for genres in labels]
+    for genres in (['Action'], ['Sports'], ['Action', 'Drama'], ['Sports', 'Comedy']):
+        for mode in ('and', 'or'):
+            assert extended.select(genres, mode=mode).tolist() == brute_force(labels, genres, mode)
+
+
+def test_saved_index_selects_the_same_rows(genre_index, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    save_genre_index(manifest_path, genre_index)
+    loaded = load_genre_index(manifest_path)
+
+    assert isinstance(loaded.postings, np.memmap)
+    for genres in (['Action', 'Drama'], ['Comedy']):
+        for mode in ('and', 'or'):
+            assert loaded.select(genres, mode=mode).tolist() == genre_index.select(genres, mode=mode).tolist()
+    np.testing.assert_array_equal(loaded.score({'Action': 2, 'Comedy': 1}), [2, 1, 0, 3, 0, 2])
@@ -0,0 +1,78 @@
+import time
+
+from src.image_cache import BulkImageResolver
+
+
+def make_resolver(image_cache, anilist_concurrency=4, myanimelist_concurrency=2, batch_size=10):
+    image_cache.cache_config.anilist_concurrency = anilist_concurrency
+    image_cache.cache_config.myanimelist_concurrency = myanimelist_concurrency
+    image_cache.cache_config.anilist_batch_size = batch_size
+    return BulkImageResolver(image_cache)
+
+
+def test_only_anilist_misses_are_scraped(stub_hosts, image_cache):
+    titles = [f"Title {i}" for i in range(12)]
+    stub_hosts.covers['anilist'] = {title: f"https://anilist/{i}.jpg" for i, title in enumerate(titles[:10])}
+    stub_hosts.covers['myanimelist'] = {'Title 10': 'https://myanimelist/10.jpg'}
+
+    results = make_resolver(image_cache).resolve(titles, deadline=5)
+
+    assert results == {
+        **{title: f"https://anilist/{i}.jpg" for i, title in enumerate(titles[:10])},
+        'Title 10': 'https://myanimelist/10.jpg',
+        'Title 11': None
+    }
+    # Two aliased queries for twelve titles, a search and a page for the MyAnimeList hit
+    assert len(stub_hosts.requests['anilist']) == 2
+    assert sorted(stub_hosts.requests['myanimelist']) == ['/mal/anime.php', '/mal/anime.php', '/mal/anime/Title%2010']
+
+
+def test_cached_titles_are_not_fetched_again(stub_hosts, image_cache):
+    stub_hosts.covers['anilist'] = {'Cached': 'https://anilist/cached.jpg'}
+    resolver = make_resolver(image_cache)
+    resolver.resolve(['Cached'], deadline=5)
+
+    assert resolver.resolve(['Cached'], deadline=5) == {'Cached': 'https://anilist/cached.jpg'}
+    assert len(stub_hosts.requests['anilist']) == 1
+
+
+def test_concurrency_is_limited_per_host(stub_hosts, image_cache):
+    stub_hosts.delay = {'anilist': 0.1, 'myanimelist': 0.1}
+    titles = [f"Title {i}" for i in range(16)]
+    stub_hosts.covers['anilist'] = {title: f"https://anilist/{title}.jpg" for title in titles[:8]}
+    stub_hosts.covers['myanimelist'] = {title: f"https://myanimelist/{title}.jpg" for title in titles[8:]}
+
+    results = make_resolver(image_cache, anilist_concurrency=3, myanimelist_concurrency=2, batch_size=1).resolve(titles, deadline=10)
+
+    assert all(results.values())
+    assert stub_hosts.max_active['anilist'] == 3
+    assert stub_hosts.max_active['myanimelist'] == 2
+
+
+def test_slow_scrapes_do_not_hold_up_anilist(stub_hosts, image_cache):
+    stub_hosts.delay['myanimelist'] = 2.0
+    stub_hosts.covers['myanimelist'] = {f"Scraped {i}": f"https://myanimelist/{i}.jpg" for i in range(8)}
+    stub_hosts.covers['anilist'] = {f"Found {i}": f"https://anilist/{i}.jpg" for i in range(8)}
+    resolver = make_resolver(image_cache, batch_size=1)
+
+    # Fills the MyAnimeList pool with scrapes that outlive this page
+    resolver.resolve(list(stub_hosts.covers['myanimelist']), deadline=0.2)
+    start = time.monotonic()
+    results = resolver.resolve(list(stub_hosts.covers['anilist']), deadline=1.0)
+
+    assert results == stub_hosts.covers['anilist']
+    assert time.monotonic() - start < 1.0
+
+
+def test_deadline_bounds_the_page(stub_hosts, image_cache):
+    stub_hosts.delay['anilist'] = 1.0
+    stub_hosts.covers['anilist'] = {'Slow': 'https://anilist/slow.jpg'}
+    resolver = make_resolver(image_cache)
+
+    start = time.monotonic()
+    assert resolver.resolve(['Slow'], deadline=0.2) == {'Slow': None}
+    assert time.monotonic() - start < 0.8
+
+    # The fetch keeps running and fills the cache for the next page
+    time.sleep(1.5)
+    assert image_cache.lookup('Slow') == (True, 'https://anilist/slow.jpg')
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from src.image_cache import BulkImageResolver, load_image_index
+from src.pipeline.image_prefetch_pipeline import ImagePrefetch
+
+
+@pytest.fixture
+def prefetch(tmp_path, monkeypatch, image_cache):
+    pd.DataFrame({'id': [1, 2], 'englishTitle': ['Cowboy Bebop', 'Mushishi']}).to_csv(tmp_path / 'raw.csv', index=False)
+    resolver = BulkImageResolver(image_cache)
+    monkeypatch.setattr('src.pipeline.image_prefetch_pipeline.get_image_cache', lambda: image_cache)
+    monkeypatch.setattr('src.pipeline.image_prefetch_pipeline.get_bulk_resolver', lambda: resolver)
+    prefetch = ImagePrefetch()
+    prefetch.prefetch_config.dataset_path = str(tmp_path / 'raw.csv')
+    prefetch.prefetch_config.image_index_path = str(tmp_path / 'image_index.json')
+    prefetch.prefetch_config.batch_deadline = 5.0
+    return prefetch
+
+
+def indexed_urls(prefetch):
+    image_index = load_image_index(prefetch.prefetch_config.image_index_path)
+    return {title: entry['url'] for title, entry in image_index.titles.items()}
+
+
+def test_outage_is_not_stored_as_a_miss(stub_hosts, prefetch):
+    stub_hosts.status['anilist'] = 503
+    prefetch.initiate_image_prefetch()
+    assert indexed_urls(prefetch) == {}
+
+    stub_hosts.status['anilist'] = 200
+    stub_hosts.covers['anilist'] = {'Cowboy Bebop': 'https://anilist/1.jpg'}
+    stub_hosts.status['myanimelist'] = 503
+    prefetch.initiate_image_prefetch()
+    # Mushishi is unknown to AniList and its scrape failed
+    assert indexed_urls(prefetch) == {'cowboy bebop': 'https://anilist/1.jpg'}
+
+    stub_hosts.status['myanimelist'] = 200
+    prefetch.initiate_image_prefetch()
+    assert indexed_urls(prefetch) == {'cowboy bebop': 'https://anilist/1.jpg', 'mushishi': None}
+
+
+def test_refresh_all_bypasses_the_image_cache(stub_hosts, prefetch):
+    stub_hosts.covers['anilist'] = {'Cowboy Bebop': 'https://anilist/1.jpg', 'Mushishi': 'https://anilist/457.jpg'}
+    prefetch.initiate_image_prefetch()
+
+    stub_hosts.covers['anilist']['Mushishi'] = 'https://anilist/457-new.jpg'
+    prefetch.initiate_image_prefetch(refresh_all=True)
+
+    assert indexed_urls(prefetch)['mushishi'] == 'https://anilist/457-new.jpg'
+    assert len(stub_hosts.requests['anilist']) == 2
@@ -0,0 +1,193 @@
+import os
+import json
+import multiprocessing
+import time
+import pytest
+
+from postgrest.exceptions import APIError
+import src.interaction_buffer as interaction_buffer_module
+from conftest import FakeClient
+from src.connection_pool import SupabaseClientPool
+from src.interaction_buffer import InteractionBuffer, InteractionBufferConfig, add_interaction_listener, get_interaction_buffer
+
+
+# Above the largest pid_max Linux allows, no process has these pids
+DEAD_PID = 2 ** 22 + 1
+
+
+def reject_bad_rows(database):
+    def reject(table, rows):
+        if table != 'useranimeinteractions':
+            return
+        if any(row['anime_id'] == 'bad' for row in rows):
+            # PostgREST answers 400 for the whole insert
+            raise APIError({'code': '22P02', 'message': 'invalid input syntax for type bigint: "bad"'})
+        if any(row['anime_id'] == 'slow' for row in rows) and database.timeouts:
+            database.timeouts -= 1
+            raise TimeoutError("The read operation timed out")
+    return reject
+
+
+def fake_database():
+    database = FakeClient({'users': [], 'animes': [], 'useranimeinteractions': []})
+    database.interactions = database.tables['useranimeinteractions']
+    # Inserts holding the 'slow' anime that time out
+    database.timeouts = 0
+    database.reject = reject_bad_rows(database)
+    return database
+
+
+def fake_pool(database):
+    return SupabaseClientPool(lambda: database)
+
+
+@pytest.fixture
+def config(tmp_path):
+    config = InteractionBufferConfig()
+    config.journal_dir = str(tmp_path / 'journal')
+    config.dead_letter_path = str(tmp_path / 'dead_letter.jsonl')
+    config.flush_size = 4
+    config.flush_interval = 0.01
+    config.retry_interval = 0.01
+    config.max_pending = 20
+    return config
+
+
+def event(anime_id):
+    return {
+        'email': 'a@b.c',
+        'user_id': 1,
+        'anime': {'anime_id': anime_id, 'anime_name': f"Anime {anime_id}"},
+        'interaction': {'anime_id': anime_id, 'interaction_type': 'view'}
+    }
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+
+def test_rejected_event_is_dead_lettered(config):
+    database = fake_database()
+    buffer = InteractionBuffer(fake_pool(database), config)
+    for anime_id in [1, 2, 'bad', 3, 4, 5, 6]:
+        assert buffer.submit(event(anime_id))
+
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+    assert sorted(row['anime_id'] for row in database.interactions) == [1, 2, 3, 4, 5, 6]
+    assert buffer.metrics()['dead_lettered'] == 1
+    with open(config.dead_letter_path, 'r', encoding='utf-8') as f:
+        [dead] = [json.loads(line) for line in f]
+    assert dead['event']['anime']['anime_id'] == 'bad'
+    assert 'bad' not in open(buffer.journal_path, encoding='utf-8').read()
+
+    # Later events go through
+    for anime_id in range(7, 27):
+        assert buffer.submit(event(anime_id))
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+    assert len(database.interactions) == 26
+    buffer.close()
+
+
+def test_timeout_during_bisection_is_not_dead_lettered(config):
+    database = fake_database()
+    database.timeouts = 5
+    buffer = InteractionBuffer(fake_pool(database), config)
+    for anime_id in [1, 'bad', 2, 'slow']:
+        assert buffer.submit(event(anime_id))
+
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+    assert sorted(str(row['anime_id']) for row in database.interactions) == ['1', '2', 'slow']
+    assert buffer.metrics()['dead_lettered'] == 1
+    with open(config.dead_letter_path, 'r', encoding='utf-8') as f:
+        assert [json.loads(line)['event']['anime']['anime_id'] for line in f] == ['bad']
+    buffer.close()
+
+
+def test_outage_keeps_every_event(config):
+    database = fake_database()
+    database.up = False
+    buffer = InteractionBuffer(fake_pool(database), config)
+    for anime_id in range(5):
+        assert buffer.submit(event(anime_id))
+
+    time.sleep(0.3)
+    assert buffer.metrics()['pending'] == 5
+    assert buffer.metrics()['dead_lettered'] == 0
+
+    database.up = True
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+    assert sorted(row['anime_id'] for row in database.interactions) == list(range(5))
+    buffer.close()
+
+
+def write_journal(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(''.join(json.dumps(e) + '\n' for e in events))
+
+
+def test_journals_of_dead_workers_are_replayed(config):
+    os.makedirs(config.journal_dir)
+    write_journal(os.path.join(config.journal_dir, f"{DEAD_PID}.jsonl"), [event(1), event(2)])
+    # Left by a worker that died while recovering
+    write_journal(os.path.join(config.journal_dir, f"{DEAD_PID + 1}.5.0.claimed"), [event(3)])
+    live_path = os.path.join(config.journal_dir, f"{os.getppid()}.jsonl")
+    write_journal(live_path, [event(4)])
+
+    database = fake_database()
+    buffer = InteractionBuffer(fake_pool(database), config)
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+
+    assert sorted(row['anime_id'] for row in database.interactions) == [1, 2, 3]
+    assert sorted(os.listdir(config.journal_dir)) == sorted([os.path.basename(buffer.journal_path), os.path.basename(live_path)])
+    buffer.close()
+
+
+def recover_in_child(config, barrier, results):
+    barrier.wait()
+    buffer = InteractionBuffer(fake_pool(fake_database()), config)
+    wait_for(lambda: buffer.metrics()['pending'] == 0)
+    results.put(buffer.metrics()['flushed'])
+    buffer.close()
+
+
+def test_workers_starting_together_replay_a_journal_once(config):
+    os.makedirs(config.journal_dir)
+    for offset in range(200):
+        write_journal(os.path.join(config.journal_dir, f"{DEAD_PID + offset}.jsonl"), [event(offset)])
+
+    context = multiprocessing.get_context('fork')
+    barrier, results = context.Barrier(4), context.Queue()
+    workers = [context.Process(target=recover_in_child, args=(config, barrier, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    flushed = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(10)
+
+    assert sum(flushed) == 200
+
+
+def buffer_after_fork(results):
+    interaction_buffer = get_interaction_buffer()
+    results.put((interaction_buffer.pid == os.getpid(), interaction_buffer._thread.is_alive(), len(interaction_buffer._listeners)))
+
+
+def test_buffer_is_created_in_the_process_that_uses_it(config, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('src.interaction_buffer._interaction_buffer', None)
+    monkeypatch.setattr('src.interaction_buffer._interaction_listeners', [])
+    add_interaction_listener(lambda events: None)
+    # Registering a listener does not start a flusher, as with gunicorn --preload
+    assert interaction_buffer_module._interaction_buffer is None
+
+    parent_buffer = get_interaction_buffer()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=buffer_after_fork, args=(results,))
+    child.start()
+    assert results.get(timeout=30) == (True, True, 1)
+    child.join(10)
+    parent_buffer.close()
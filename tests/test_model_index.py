@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from sklearn.neighbors import NearestNeighbors
+from src.components.model_index import ExactIndex, IVFIndex, evaluate_index
+
+
+def clustered(n_rows, n_features=16, n_clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, n_features))
+    return centers[rng.integers(0, n_clusters, n_rows)] + 0.3 * rng.normal(size=(n_rows, n_features))
+
+
+@pytest.fixture(scope='module')
+def data():
+    X = clustered(2000)
+    queries = clustered(100, seed=1)
+    return X, queries
+
+
+def test_exact_index_matches_sklearn_cosine(data):
+    X, queries = data
+    expected_distances, expected_indices = NearestNeighbors(n_neighbors=10, metric='cosine').fit(X).kneighbors(queries)
+    distances, indices = ExactIndex().fit(X).kneighbors(queries, batch_size=7)
+
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+
+def test_exact_index_candidates_match_sklearn_on_the_subset(data):
+    X, queries = data
+    candidates = np.arange(0, len(X), 3)
+    expected_distances, expected_positions = NearestNeighbors(n_neighbors=10, metric='cosine').fit(X[candidates]).kneighbors(queries)
+    distances, indices = ExactIndex().fit(X).kneighbors(queries, candidates=candidates)
+
+    np.testing.assert_array_equal(indices, candidates[expected_positions])
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+
+def test_exact_index_extend_matches_a_refit(data):
+    X, queries = data
+    extended = ExactIndex().fit(X[:1500]).extend(X[1500:])
+    np.testing.assert_array_equal(extended.kneighbors(queries)[1], ExactIndex().fit(X).kneighbors(queries)[1])
+
+
+def test_ivf_recall_against_exact_search(data):
+    X, queries = data
+    exact = ExactIndex().fit(X)
+    report = evaluate_index(IVFIndex(n_probe=8).fit(X), exact, queries, k=10)
+    assert report['recall@10'] >= 0.9
+
+    # Probing every list is an exact search
+    ivf = IVFIndex(n_lists=16, n_probe=16).fit(X)
+    assert evaluate_index(ivf, exact, queries, k=10)['recall@10'] == 1.0
+
+
+def test_ivf_extend_and_candidates_return_catalog_rows(data):
+    X, queries = data
+    ivf = IVFIndex(n_probe=8).fit(X[:1500]).extend(X[1500:])
+    exact = ExactIndex().fit(X)
+    assert evaluate_index(ivf, exact, queries, k=10)['recall@10'] >= 0.9
+
+    candidates = np.arange(1, len(X), 2)
+    np.testing.assert_array_equal(
+        ivf.kneighbors(queries, candidates=candidates)[1],
+        exact.kneighbors(queries, candidates=candidates)[1]
+    )
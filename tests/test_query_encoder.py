@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.preprocessing import MultiLabelBinarizer
+from src.components.data_transformation import DataTransformation
+from src.components.query_encoder import QueryEncoder
+from src.pipeline.predict_pipeline import CustomBatchData, PredictPipeline
+
+
+GENRES = ['Action', 'Comedy', 'Drama']
+# Form posts and JSON batches: numbers as strings, empty or missing fields, unknown labels
+QUERIES = [
+    {'englishTitle': 'Attack on Titan', 'genre': 'Action', 'episodes': '25', 'rating': '8.5', 'type': 'TV'},
+    {'englishTitle': 'Spirited Away', 'genre': ['Drama', 'Comedy'], 'episodes': 1, 'rating': 8.9, 'type': 'Movie'},
+    {'englishTitle': None, 'genre': None, 'episodes': None, 'rating': None, 'type': None},
+    {'englishTitle': '', 'genre': '', 'episodes': '', 'rating': '', 'type': ''},
+    {'englishTitle': 'the Stories of Heroes', 'genre': ['Music', 'Action'], 'episodes': '0', 'rating': '0', 'type': 'Music'},
+    {'englishTitle': '  Final  Season ', 'genre': 'Comedy', 'episodes': ' 12 ', 'rating': '7', 'type': 'OVA'},
+    {},
+]
+
+
+@pytest.fixture(autouse=True)
+def plain_text_normalization(monkeypatch):
+    # The NLTK corpora are not available offline, normalizeTitles keeps its splitting
+    monkeypatch.setattr('src.utils.getStopwords', lambda: frozenset(['the', 'of']))
+    monkeypatch.setattr('src.utils.lemmatizeToken', lambda word: word[:-1] if word.endswith('s') and len(word) > 3 else word)
+    monkeypatch.setattr('src.utils.generateTokens', lambda corpus: [text.split() for text in corpus])
+
+
+@pytest.fixture
+def artifacts():
+    # Fitted like the training frame: numeric columns with gaps, types as strings
+    training = pd.DataFrame({
+        'rating': [7.5, np.nan, 8.1, 6.0, 9.2, np.nan],
+        'episodes': [12, 24, np.nan, 1, 13, 26],
+        'type': ['TV', 'Movie', 'TV', 'OVA', np.nan, 'TV'],
+    })
+    preprocessor = DataTransformation().get_preprocessor_object().fit(training)
+    binarizer = MultiLabelBinarizer(classes=GENRES).fit([GENRES])
+    weights = np.random.default_rng(0).normal(size=(50, 4)).astype(np.float32)
+    return {
+        'preprocessor': preprocessor,
+        'binarizer': binarizer,
+        'embedding': {'weights': weights, 'max_length': 6},
+        'query_encoder': QueryEncoder.from_fitted(preprocessor, binarizer, weights, 6),
+    }
+
+
+def test_query_encoder_matches_the_column_transformer(artifacts):
+    batch = CustomBatchData(QUERIES)
+    assert batch.validate() is None
+    pipeline = PredictPipeline(registry=object())
+
+    expected = pipeline.encodeFeatures(batch.generate_data_frame(), artifacts)
+    encoded = pipeline.encodeRecords(batch.generate_records(), artifacts)
+
+    assert encoded.shape == expected.shape == (len(QUERIES), artifacts['query_encoder'].n_features)
+    np.testing.assert_allclose(encoded, expected, rtol=0, atol=1e-12)
+
+
+def test_query_encoder_transform_matches_on_form_strings(artifacts):
+    frame = pd.DataFrame({
+        'rating': ['8.5', None, '7', 0, np.nan],
+        'episodes': ['25', None, ' 12 ', 0, np.nan],
+        'type': ['TV', None, 'Music', 0, np.nan],
+    }, dtype=object)
+    np.testing.assert_allclose(
+        artifacts['query_encoder'].transform(frame), artifacts['preprocessor'].transform(frame), rtol=0, atol=1e-12
+    )
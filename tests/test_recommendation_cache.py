@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from src.components.query_encoder import QueryEncoder
+from src.pipeline.recommendation_cache import RecommendationCache, recommendation_key
+
+
+TITLES = [
+    'Attack on Titan', 'attack on titan', '  Attack  on Titan ', 'ATTACK ON TITAN',
+    'Attack\ton Titan', 'Attack on\nTitan', 'Attack on Titans', '', '   ', 'nan', None, float('nan'),
+]
+
+
+@pytest.fixture(autouse=True)
+def plain_text_normalization(monkeypatch):
+    # The NLTK corpora are not available offline, normalizeTitles keeps its splitting
+    monkeypatch.setattr('src.utils.getStopwords', lambda: frozenset(['on']))
+    monkeypatch.setattr('src.utils.lemmatizeToken', lambda word: word[:-1] if word.endswith('s') and len(word) > 3 else word)
+    monkeypatch.setattr('src.utils.generateTokens', lambda corpus: [text.split() for text in corpus])
+
+
+def make_encoder():
+    weights = np.random.default_rng(0).normal(size=(50, 4)).astype(np.float32)
+    numeric = {'rating': (7.0, 7.0, 1.0), 'episodes': (12.0, 12.0, 4.0)}
+    return QueryEncoder(weights, 6, ['Action', 'Drama'], numeric, 'TV', ['Movie', 'TV'])
+
+
+def record(title, genre=('Action',), episodes=12, rating=7.5, anime_type='TV'):
+    return {'englishTitle': title, 'genre': list(genre), 'episodes': episodes, 'rating': rating, 'type': anime_type}
+
+
+def test_equal_keys_encode_to_the_same_features():
+    records = [record(title) for title in TITLES]
+    features = make_encoder().encode_records(records)
+    for i, a in enumerate(records):
+        for j, b in enumerate(records):
+            if recommendation_key(a) == recommendation_key(b):
+                np.testing.assert_array_equal(features[i], features[j], err_msg=f"{TITLES[i]!r} and {TITLES[j]!r}")
+
+
+def test_title_canonicalization():
+    key = recommendation_key(record('Attack on Titan'))
+    assert recommendation_key(record('  ATTACK  on titan ')) == key
+    # normalizeTitles splits on spaces only, a tab keeps the words together
+    assert recommendation_key(record('Attack\ton Titan')) != key
+    # A missing title is a zero vector, the text 'nan' is not
+    assert recommendation_key(record(float('nan'))) == recommendation_key(record(None)) == recommendation_key(record(''))
+    assert recommendation_key(record('nan')) != recommendation_key(record(None))
+
+
+def test_genre_and_number_canonicalization():
+    key = recommendation_key(record('Attack on Titan', genre=('Action', 'Drama')))
+    assert recommendation_key(record('Attack on Titan', genre=('Drama', 'Action', 'Drama'))) == key
+    assert recommendation_key(record('Attack on Titan', genre=('Action', 'Drama'), episodes='12', rating=' 7.5 ')) == key
+    assert recommendation_key(record('Attack on Titan', genre=('Action',))) != key
+
+
+def test_new_artifact_version_drops_every_page():
+    cache = RecommendationCache()
+    key = recommendation_key(record('Attack on Titan'))
+    cache.put(key, (1, 0), [{'englishTitle': 'Titan'}])
+    assert cache.get(key, (1, 0)) == [{'englishTitle': 'Titan'}]
+
+    # A delta append bumps the second part of the version
+    assert cache.get(key, (1, 1)) is None
+    assert cache.metrics()['entries'] == 0
+    cache.put(key, (1, 1), [{'englishTitle': 'Titan 2'}])
+    assert cache.get(key, (2, 1)) is None
+    assert cache.get(key, (1, 1)) is None
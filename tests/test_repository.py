@@ -0,0 +1,39 @@
+from conftest import FakeClient
+from src.repository import AnimeRepository
+
+
+def heavy_user_client(n_views=2500):
+    interactions = [
+        {'user_id': 1, 'anime_id': i % 1200, 'interaction_type': 'view' if i % 5 else 'rating', 'timestamp': f"2024-01-01T00:{i:06d}"}
+        for i in range(n_views)
+    ]
+    animes = [{'anime_id': i, 'anime_name': f"Anime {i}", 'anime_genre': 'Action'} for i in range(1200)]
+    return FakeClient({'useranimeinteractions': interactions, 'animes': animes}), interactions
+
+
+def test_interactions_are_read_past_the_row_cap():
+    client, interactions = heavy_user_client()
+    count, viewed = AnimeRepository(client).get_interaction_summary(1)
+
+    assert count == len(interactions)
+    assert viewed == [row['anime_id'] for row in interactions if row['interaction_type'] == 'view']
+
+
+def test_seen_names_chunk_the_anime_ids():
+    client, interactions = heavy_user_client()
+    names = AnimeRepository(client).get_seen_anime_names(1)
+
+    assert names == [f"Anime {row['anime_id']}" for row in interactions if row['interaction_type'] == 'view']
+    n_distinct = len({row['anime_id'] for row in interactions if row['interaction_type'] == 'view'})
+    assert client.in_sizes == [100] * (n_distinct // 100) + [n_distinct % 100] * bool(n_distinct % 100)
+    # Three pages for the 2000 views, then one request per chunk
+    assert client.requests == 3 + len(client.in_sizes)
+
+
+def test_empty_lookups_make_no_request():
+    client = FakeClient({'animes': [], 'users': []})
+    repository = AnimeRepository(client)
+
+    assert repository.get_animes([]) == {}
+    assert repository.get_user_ids([]) == {}
+    assert client.requests == 0
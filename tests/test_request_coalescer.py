@@ -0,0 +1,54 @@
+import threading
+import pytest
+
+from src.exception import CustomException
+from src.pipeline.request_coalescer import RequestCoalescer, RequestCoalescerConfig
+
+
+class BlockingRecommender:
+    '''
+        recommendRecords stand-in that holds every batch until released.
+    '''
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, records):
+        self.batches.append([record['title'] for record in records])
+        self.started.set()
+        self.release.wait(5)
+        return [[{'englishTitle': record['title']}] for record in records]
+
+
+def test_timed_out_query_is_not_computed():
+    recommender = BlockingRecommender()
+    config = RequestCoalescerConfig()
+    config.timeout = 0.05
+    coalescer = RequestCoalescer(recommender, config)
+
+    first = coalescer.submit({'title': 'first'})
+    assert recommender.started.wait(5)
+    # Queued behind the running batch, its request gives up first
+    with pytest.raises(CustomException):
+        coalescer.recommend({'title': 'late'})
+    recommender.release.set()
+
+    assert first.result(5) == [{'englishTitle': 'first'}]
+    assert coalescer.submit({'title': 'next'}).result(5) == [{'englishTitle': 'next'}]
+    assert recommender.batches == [['first'], ['next']]
+    assert coalescer.metrics()['cancelled'] == 1
+
+
+def test_queries_queued_during_a_batch_share_the_next_one():
+    recommender = BlockingRecommender()
+    coalescer = RequestCoalescer(recommender)
+    assert coalescer.coalescer_config.window == 0.0
+
+    coalescer.submit({'title': 'first'})
+    assert recommender.started.wait(5)
+    futures = [coalescer.submit({'title': f"queued {n}"}) for n in range(3)]
+    recommender.release.set()
+
+    assert [future.result(5) for future in futures] == [[{'englishTitle': f"queued {n}"}] for n in range(3)]
+    assert recommender.batches == [['first'], ['queued 0', 'queued 1', 'queued 2']]
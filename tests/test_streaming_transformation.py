@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.components.catalog_store import load_catalog_store
+from src.components.data_transformation import DataTransformation
+from src.components.genre_index import load_genre_index
+from src.utils import load_array
+
+
+@pytest.fixture(autouse=True)
+def plain_text_normalization(monkeypatch):
+    # Both paths share the title normalization, the comparison does not depend on the NLTK corpora
+    monkeypatch.setattr('src.utils.getStopwords', lambda: frozenset(['the', 'a', 'of', 'no']))
+    monkeypatch.setattr('src.utils.lemmatizeToken', lambda word: word[:-1] if word.endswith('s') and len(word) > 3 else word)
+    for module in ('src.utils', 'src.components.data_transformation'):
+        monkeypatch.setattr(f'{module}.generateTokens', lambda corpus: [text.split() for text in corpus])
+
+
+def make_catalog(path, n_rows=3000, untitled=range(731, 1462), seed=0):
+    rng = np.random.default_rng(seed)
+    words = ['Attack', 'Titans', 'Hero', 'Academia', 'Dragon', 'Ball', 'Piece', 'Note', 'of', 'the', 'Spirits']
+    genres = ['Action', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Sci-Fi', 'Slice of Life']
+    rows = []
+    for i in range(n_rows):
+        title = ' '.join(rng.choice(words, rng.integers(1, 5)))
+        rows.append({
+            'id': i + 1 if rng.random() > 0.05 else np.nan,
+            'englishTitle': np.nan if i in untitled or rng.random() < 0.1 else title,
+            'title_userPreferred': f"Preferred {title}",
+            'genre': str([str(genre) for genre in rng.choice(genres, rng.integers(0, 4), replace=False)]),
+            'theme': 'x',
+            'rating': rng.uniform(5, 9) if rng.random() > 0.1 else np.nan,
+            'episodes': int(rng.integers(1, 60)) if rng.random() > 0.1 else np.nan,
+            'type': rng.choice(['TV', 'Movie', 'OVA', 'ONA']) if rng.random() > 0.05 else np.nan,
+        })
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def transformation(directory, streaming):
+    transformation = DataTransformation()
+    config = transformation.transformation_config
+    config.bundle_dir = str(directory / 'bundle')
+    config.genre_index_file_path = str(directory / 'genre_index' / 'manifest.json')
+    config.catalog_store_file_path = str(directory / 'catalog' / 'manifest.json')
+    config.train_features_file_path = str(directory / 'train_features.npy')
+    config.catalog_embedding_file_path = str(directory / 'catalog_embedding.npy')
+    config.streaming = streaming
+    # Odd size, and rows 731-1461 make the second chunk entirely untitled
+    config.chunk_size = 731
+    return transformation
+
+
+def test_streaming_matches_in_memory(tmp_path):
+    make_catalog(tmp_path / 'raw.csv')
+    in_memory, _ = transformation(tmp_path / 'memory', False).initiate_data_transformation(str(tmp_path / 'raw.csv'))
+    streamed, _ = transformation(tmp_path / 'streaming', True).initiate_data_transformation(str(tmp_path / 'raw.csv'))
+
+    assert streamed.shape == in_memory.shape
+    assert streamed.dtype == in_memory.dtype
+    # Statistics merged chunk by chunk differ from the one-shot ones only by rounding
+    np.testing.assert_allclose(streamed, in_memory, rtol=0, atol=1e-6)
+
+    catalogs = [load_catalog_store(str(tmp_path / name / 'catalog' / 'manifest.json')) for name in ('memory', 'streaming')]
+    assert catalogs[0].columns.keys() == catalogs[1].columns.keys()
+    for name in catalogs[0].columns:
+        np.testing.assert_array_equal(catalogs[1][name], catalogs[0][name])
+
+    genre_indexes = [load_genre_index(str(tmp_path / name / 'genre_index' / 'manifest.json')) for name in ('memory', 'streaming')]
+    assert list(genre_indexes[1].classes) == list(genre_indexes[0].classes)
+    for key in ('indptr', 'indices', 'offsets', 'postings'):
+        np.testing.assert_array_equal(getattr(genre_indexes[1], key), getattr(genre_indexes[0], key))
+
+    embeddings = [load_array(str(tmp_path / name / 'catalog_embedding.npy')) for name in ('memory', 'streaming')]
+    assert embeddings[0].dtype == np.float32 and embeddings[0].shape == (len(in_memory), 100)
+    np.testing.assert_array_equal(embeddings[1], embeddings[0])
+    # The raw title vectors are the embedding block of the features
+    np.testing.assert_array_equal(embeddings[0], in_memory[:, :100])
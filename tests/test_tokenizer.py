@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from src.utils import generateOneHot, generatePadding, hashWord
+
+try:
+    from keras.preprocessing.sequence import pad_sequences
+    from keras.preprocessing.text import hashing_trick
+except ImportError:
+    from hashlib import md5
+
+    # Transcribed from keras 2.x (keras/preprocessing/text.py and sequence.py), for environments without TensorFlow
+    def text_to_word_sequence(text, filters='!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n', lower=True, split=' '):
+        if lower:
+            text = text.lower()
+        text = text.translate(str.maketrans({c: split for c in filters}))
+        return [i for i in text.split(split) if i]
+
+    def hashing_trick(text, n, hash_function=None):
+        if hash_function == 'md5':
+            hash_function = lambda w: int(md5(w.encode()).hexdigest(), 16)
+        return [(hash_function(w) % (n - 1) + 1) for w in text_to_word_sequence(text)]
+
+    def pad_sequences(sequences, maxlen=None, dtype='int32', padding='pre', truncating='pre', value=0.0):
+        if maxlen is None:
+            maxlen = max((len(s) for s in sequences), default=0)
+        x = np.full((len(sequences), maxlen), value, dtype=dtype)
+        for idx, s in enumerate(sequences):
+            if not len(s):
+                continue
+            trunc = s[-maxlen:] if truncating == 'pre' else s[:maxlen]
+            if padding == 'post':
+                x[idx, :len(trunc)] = trunc
+            else:
+                x[idx, -len(trunc):] = trunc
+        return x
+
+
+TITLES = [
+    'attack titan',
+    'Fullmetal Alchemist: Brotherhood',
+    'K-On!!  (Season 2)',
+    "JoJo's Bizarre Adventure\tPart 3\nStardust",
+    'Re:Zero - Starting Life in Another World',
+    'Shingeki no Kyojin – The Final Season',
+    'ソードアート・オンライン',
+    '',
+    '!!!',
+]
+
+
+@pytest.mark.parametrize('vocab_size', [2, 50, 500])
+def test_one_hot_matches_md5_hashing_trick(vocab_size):
+    assert generateOneHot(TITLES, vocab_size=vocab_size) == [hashing_trick(title, vocab_size, hash_function='md5') for title in TITLES]
+
+
+def test_hash_word_is_md5_modulo_vocabulary():
+    for word in ['attack', 'titan', 'ソードアート', "jojo's"]:
+        assert hashWord(word, 500) == hashing_trick(word, 500, hash_function='md5')[0]
+        assert 1 <= hashWord(word, 500) <= 499
+
+
+@pytest.mark.parametrize('max_length', [None, 1, 3, 8])
+def test_padding_is_pre_padded_and_pre_truncated(max_length):
+    sequences = [[5, 6, 7, 8, 9], [1], [], [2, 3, 4], [10, 11, 12, 13, 14, 15, 16]]
+    expected = pad_sequences(sequences, maxlen=max_length if max_length is not None else 7, padding='pre', truncating='pre')
+    padded = generatePadding(sequences, sequences, max_length=max_length)
+
+    assert padded.dtype == np.int32
+    np.testing.assert_array_equal(padded, expected)
+
+
+def test_padding_to_zero_length():
+    # keras slices s[-0:] there and fails, an empty matrix is the only sensible answer
+    assert generatePadding([[1, 2], []], [[1, 2], []], max_length=0).shape == (2, 0)
+
+
+def test_padding_of_hashed_titles():
+    one_hot = generateOneHot(TITLES)
+    padded = generatePadding(one_hot, one_hot, max_length=4)
+    np.testing.assert_array_equal(padded, pad_sequences([hashing_trick(title, 500, hash_function='md5') for title in TITLES], maxlen=4))
@@ -0,0 +1,47 @@
+import time
+
+from src.user_cache import UserCacheConfig, UserIdCache
+
+
+def make_cache(max_entries=3, ttl=60):
+    config = UserCacheConfig()
+    config.max_entries = max_entries
+    config.ttl = ttl
+    return UserIdCache(config)
+
+
+def test_least_recently_used_email_is_evicted():
+    cache = make_cache()
+    for user_id, email in enumerate(['a@x', 'b@x', 'c@x']):
+        cache.put(email, user_id)
+    # A hit makes a@x the most recently used
+    assert cache.get('a@x') == 0
+    cache.put('d@x', 3)
+
+    assert cache.get('b@x') is None
+    assert [cache.get(email) for email in ['a@x', 'c@x', 'd@x']] == [0, 2, 3]
+    assert cache.metrics()['entries'] == 3
+
+
+def test_unknown_emails_are_not_cached():
+    cache = make_cache()
+    # A lookup that found no user stores nothing, the signup that follows is seen at once
+    cache.put('new@x', None)
+    assert cache.metrics()['entries'] == 0
+    cache.put('new@x', 7)
+    assert cache.get('new@x') == 7
+    cache.put(None, 8)
+    assert cache.metrics()['entries'] == 1
+
+
+def test_entries_expire_and_invalidate():
+    cache = make_cache(ttl=0.05)
+    cache.put('a@x', 1)
+    cache.put('b@x', 2)
+    cache.invalidate('a@x')
+    assert cache.get('a@x') is None
+
+    time.sleep(0.1)
+    assert cache.get('b@x') is None
+    metrics = cache.metrics()
+    assert (metrics['entries'], metrics['hits'], metrics['misses']) == (0, 0, 2)